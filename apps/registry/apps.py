@@ -4,3 +4,11 @@ from django.apps import AppConfig
 class RegistryConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "apps.registry"
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+
+        from . import caching  # noqa F401 connect the cache invalidation receivers
+        from .metrics import install_query_recorder
+
+        connection_created.connect(install_query_recorder)
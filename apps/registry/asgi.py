@@ -0,0 +1,46 @@
+import logging
+
+from .fastdeploy import aclose_http_clients, close_http_clients
+from .relay import get_relay
+
+logger = logging.getLogger(__name__)
+
+
+class LifespanMiddleware:
+    """
+    Django's ASGI handler doesn't support the lifespan protocol. Handle
+    lifespan events here to start the fastdeploy websocket relay on startup
+    and release process wide resources like pooled fastdeploy connections
+    on shutdown. Everything else is passed on to the wrapped application.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "lifespan":
+            return await self.app(scope, receive, send)
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                self.startup()
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await self.shutdown()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    def startup(self):
+        relay = get_relay()
+        if relay is not None:
+            relay.start()
+
+    async def shutdown(self):
+        try:
+            relay = get_relay()
+            if relay is not None:
+                await relay.stop()
+            close_http_clients()
+            await aclose_http_clients()
+        except Exception:  # pragma: no cover
+            logger.exception("could not close http clients")
@@ -0,0 +1,224 @@
+"""
+Microbenchmarks for the code running on every poll: parsing remote
+deployments, finding new steps, sorting and encoding them. Each benchmark
+runs on synthetic deployments of different sizes. The secrets benchmarks
+create size secrets for the deployment context. Results can be stored as
+a baseline and later runs compared against it, see the benchmark command.
+
+The memory benchmarks compare the size of a step history kept as pydantic
+Steps with the size of the same history kept as StepRecords.
+"""
+
+import json
+import secrets
+import statistics
+import timeit
+import tracemalloc
+from collections.abc import Callable
+from dataclasses import asdict, dataclass
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .fastdeploy import RemoteDeployment, Step, StepRecord
+from .models import SECRET_ALPHABET, create_secrets
+from .serializers import RegistryJSONEncoder
+
+SIZES = (10, 100, 1_000, 10_000)
+
+
+def make_remote_deployment(size: int) -> RemoteDeployment:
+    """
+    Finished deployment with size steps with increasing ids, every tenth
+    step hasn't been started yet.
+    """
+    started = datetime(2022, 7, 22, 9)
+    steps = []
+    for step_id in range(1, size + 1):
+        step_started = None if step_id % 10 == 0 else started + timedelta(seconds=step_id)
+        steps.append(Step(id=step_id, name=f"step {step_id}", started=step_started, state="success"))
+    return RemoteDeployment(id=1, steps=steps, started=started, finished=started + timedelta(hours=1))
+
+
+def bench_parse(size: int) -> Callable[[], object]:
+    data = make_remote_deployment(size).model_dump()
+    return lambda: RemoteDeployment.model_validate(data)
+
+
+def bench_diff(size: int) -> Callable[[], object]:
+    remote = make_remote_deployment(size)
+    seen = remote.model_copy(update={"steps": remote.steps[: size // 2], "finished": None})
+    return lambda: remote.get_new_steps(seen)
+
+
+def bench_sort(size: int) -> Callable[[], object]:
+    steps = make_remote_deployment(size).steps[::-1]
+    return lambda: sorted(steps)
+
+
+def bench_steps_for_client(size: int) -> Callable[[], object]:
+    remote = make_remote_deployment(size)
+    return lambda: remote.steps_for_client
+
+
+def bench_encode(size: int) -> Callable[[], object]:
+    remote = make_remote_deployment(size)
+    return lambda: json.dumps(remote, cls=RegistryJSONEncoder)
+
+
+def bench_encode_dict(size: int) -> Callable[[], object]:
+    """
+    Former way of encoding: dump to a dict, then encode it with DjangoJSONEncoder.
+    """
+    remote = make_remote_deployment(size)
+    return lambda: json.dumps(remote.model_dump(), cls=DjangoJSONEncoder)
+
+
+def bench_create_secrets(size: int) -> Callable[[], object]:
+    return lambda: create_secrets(size)
+
+
+def bench_create_secrets_choice(size: int) -> Callable[[], object]:
+    """
+    Former way of creating secrets: one secrets.choice call per character.
+    """
+    return lambda: ["".join(secrets.choice(SECRET_ALPHABET) for _ in range(32)) for _ in range(size)]
+
+
+BENCHMARKS: dict[str, Callable[[int], Callable[[], object]]] = {
+    "parse": bench_parse,
+    "diff": bench_diff,
+    "sort": bench_sort,
+    "steps_for_client": bench_steps_for_client,
+    "encode": bench_encode,
+    "encode_dict": bench_encode_dict,
+    "create_secrets": bench_create_secrets,
+    "create_secrets_choice": bench_create_secrets_choice,
+}
+
+
+def build_steps(size: int) -> list[Step]:
+    """
+    Steps parsed from json, like the ones received from fastdeploy.
+    """
+    return RemoteDeployment.model_validate_json(make_remote_deployment(size).model_dump_json()).steps
+
+
+def build_step_records(size: int) -> list[StepRecord]:
+    return [StepRecord.from_step(step) for step in build_steps(size)]
+
+
+MEMORY_BENCHMARKS: dict[str, Callable[[int], object]] = {
+    "steps": build_steps,
+    "step_records": build_step_records,
+}
+
+
+@dataclass
+class BenchmarkResult:
+    name: str
+    size: int
+    seconds: float  # median time per call
+
+    @property
+    def key(self) -> str:
+        return f"{self.name}[{self.size}]"
+
+
+def measure(func: Callable[[], object], repeat: int = 5, min_time: float = 0.2) -> float:
+    """
+    Median time per call of repeat runs, each calling func often enough to
+    take at least min_time.
+    """
+    timer = timeit.Timer(func)
+    number = 1
+    while timer.timeit(number) < min_time / repeat and number < 1_000_000:
+        number *= 10
+    return statistics.median(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def run_benchmarks(
+    names: list[str] | None = None, sizes=SIZES, repeat: int = 5, min_time: float = 0.2
+) -> list[BenchmarkResult]:
+    results = []
+    for name in names or BENCHMARKS:
+        for size in sizes:
+            func = BENCHMARKS[name](size)
+            results.append(BenchmarkResult(name=name, size=size, seconds=measure(func, repeat, min_time)))
+    return results
+
+
+@dataclass
+class MemoryResult:
+    name: str
+    size: int
+    bytes: int  # retained by the built object
+
+    @property
+    def key(self) -> str:
+        return f"{self.name}[{self.size}]"
+
+
+def measure_memory(build: Callable[[int], object], size: int) -> int:
+    """
+    Bytes still allocated after build(size) returned, while its result is alive.
+    """
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        result = build(size)
+        retained = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    del result
+    return retained
+
+
+def run_memory_benchmarks(sizes=SIZES) -> list[MemoryResult]:
+    return [
+        MemoryResult(name=name, size=size, bytes=measure_memory(build, size))
+        for name, build in MEMORY_BENCHMARKS.items()
+        for size in sizes
+    ]
+
+
+def format_memory_results(results: list[MemoryResult]) -> str:
+    lines = [f"{'memory':<26} {'total':>12} {'per step':>12}"]
+    for result in results:
+        lines.append(f"{result.key:<26} {result.bytes / 1024:>10.1f}kB {result.bytes / result.size:>11.0f}B")
+    return "\n".join(lines)
+
+
+def save_baseline(path: Path, results: list[BenchmarkResult]) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps([asdict(result) for result in results], indent=2) + "\n")
+
+
+def load_baseline(path: Path) -> dict[str, BenchmarkResult]:
+    results = [BenchmarkResult(**data) for data in json.loads(path.read_text())]
+    return {result.key: result for result in results}
+
+
+def get_regressions(
+    results: list[BenchmarkResult], baseline: dict[str, BenchmarkResult], threshold: float
+) -> list[tuple[BenchmarkResult, BenchmarkResult]]:
+    """
+    Results slower than threshold times their baseline, with the baseline.
+    """
+    regressions = []
+    for result in results:
+        base = baseline.get(result.key)
+        if base is not None and result.seconds > base.seconds * threshold:
+            regressions.append((result, base))
+    return regressions
+
+
+def format_results(results: list[BenchmarkResult], baseline: dict[str, BenchmarkResult]) -> str:
+    lines = [f"{'benchmark':<26} {'per call':>12} {'baseline':>12} {'ratio':>7}"]
+    for result in results:
+        line = f"{result.key:<26} {result.seconds * 1e6:>10.1f}us"
+        if (base := baseline.get(result.key)) is not None:
+            line += f" {base.seconds * 1e6:>10.1f}us {result.seconds / base.seconds:>7.2f}"
+        lines.append(line)
+    return "\n".join(lines)
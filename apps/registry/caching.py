@@ -0,0 +1,102 @@
+"""
+Cached hot reads of the registry. The cache is configured via CACHE_URL and
+falls back to a local memory cache. Cached values are deleted whenever the
+domain or deployment they were read from is saved or deleted, or when the
+progress of a deployment is saved.
+"""
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Deployment, Domain, progress_saved
+
+# columns of a deployment needed to answer a poll with a 304
+poll_state_fields = ["id", "domain_id", "state", "started", "steps_count", "last_step_at"]
+
+
+def get_domain_owner_key(domain_id: int) -> str:
+    return f"registry:domain-owner:{domain_id}"
+
+
+def get_steps_fragment_key(deployment_id: int) -> str:
+    return f"registry:steps-html:{deployment_id}"
+
+
+def get_poll_state_key(deployment_id: int) -> str:
+    return f"registry:poll-state:{deployment_id}"
+
+
+def get_domain_owner_id(domain_id: int) -> int | None:
+    """
+    Primary key of the owner of the domain or None if there is no such domain.
+    """
+    key = get_domain_owner_key(domain_id)
+    owner_id = cache.get(key)
+    if owner_id is None:
+        owner_id = Domain.objects.filter(pk=domain_id).values_list("owner_id", flat=True).first()
+        if owner_id is not None:
+            cache.set(key, owner_id, settings.REGISTRY_CACHE_TIMEOUT)
+    return owner_id
+
+
+async def aget_domain_owner_id(domain_id: int) -> int | None:
+    key = get_domain_owner_key(domain_id)
+    owner_id = await cache.aget(key)
+    if owner_id is None:
+        owner_id = await Domain.objects.filter(pk=domain_id).values_list("owner_id", flat=True).afirst()
+        if owner_id is not None:
+            await cache.aset(key, owner_id, settings.REGISTRY_CACHE_TIMEOUT)
+    return owner_id
+
+
+def get_poll_state(deployment_id: int) -> Deployment | None:
+    """
+    The poll_state_fields of a deployment as an unsaved instance without data,
+    enough to check the owner and build the ETag and poll delay of its steps.
+    None if there is no such deployment.
+    """
+    key = get_poll_state_key(deployment_id)
+    values = cache.get(key)
+    if values is None:
+        values = Deployment.objects.filter(pk=deployment_id).values(*poll_state_fields).first()
+        if values is None:
+            return None
+        cache.set(key, values, settings.REGISTRY_CACHE_TIMEOUT)
+    return Deployment(**values)
+
+
+async def aget_poll_state(deployment_id: int) -> Deployment | None:
+    key = get_poll_state_key(deployment_id)
+    values = await cache.aget(key)
+    if values is None:
+        values = await Deployment.objects.filter(pk=deployment_id).values(*poll_state_fields).afirst()
+        if values is None:
+            return None
+        await cache.aset(key, values, settings.REGISTRY_CACHE_TIMEOUT)
+    return Deployment(**values)
+
+
+@receiver(post_save, sender=Domain)
+@receiver(post_delete, sender=Domain)
+def invalidate_domain(sender, instance: Domain, **kwargs) -> None:
+    cache.delete(get_domain_owner_key(instance.pk))
+
+
+@receiver(post_save, sender=Deployment)
+@receiver(post_delete, sender=Deployment)
+def invalidate_deployment(sender, instance: Deployment, created: bool = True, **kwargs) -> None:
+    """
+    A created or deleted deployment (which isn't a post_save, therefore created
+    defaults to True) must not inherit the steps of a former deployment with
+    the same primary key.
+    """
+    cache.delete(get_poll_state_key(instance.pk))
+    if created:
+        cache.delete(get_steps_fragment_key(instance.pk))
+
+
+@receiver(progress_saved, sender=Deployment)
+def invalidate_progress(sender, instance: Deployment, **kwargs) -> None:
+    cache.delete(get_poll_state_key(instance.pk))
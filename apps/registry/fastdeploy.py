@@ -1,5 +1,14 @@
 import abc
+import asyncio
 import logging
+import sys
+import threading
+import time
+import weakref
+from collections.abc import Iterable
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextvars import copy_context
+from dataclasses import dataclass
 from datetime import datetime
 from enum import Enum
 from typing import TYPE_CHECKING
@@ -8,10 +17,13 @@ if TYPE_CHECKING:
     from .models import Deployment  # pragma: no cover
 
 import httpx
+from asgiref.sync import sync_to_async
 from django.conf import settings
 from django.utils import timezone
 from pydantic import BaseModel
 
+from .metrics import time_upstream
+
 logger = logging.getLogger(__name__)
 
 
@@ -49,6 +61,39 @@ class SpecialSteps(Enum):
 Steps = list[Step]
 
 
+@dataclass(slots=True, frozen=True)
+class StepRecord:
+    """
+    Compact read-only version of a processed step. The step history is kept
+    as records with interned states, Step models are only needed where steps
+    are parsed from fastdeploy.
+    """
+
+    id: int | None
+    name: str
+    started: datetime | None = None
+    finished: datetime | None = None
+    state: str = "pending"
+    message: str = ""
+
+    @classmethod
+    def from_step(cls, step: "Step | StepRecord") -> "StepRecord":
+        return cls(step.id, step.name, step.started, step.finished, sys.intern(step.state), step.message)
+
+    def to_step(self) -> Step:
+        return Step(
+            id=self.id,
+            name=self.name,
+            started=self.started,
+            finished=self.finished,
+            state=self.state,
+            message=self.message,
+        )
+
+
+StepRecords = list[StepRecord]
+
+
 class RemoteDeployment(BaseModel):
     id: int | None = None
     steps: Steps = []
@@ -74,9 +119,44 @@ class RemoteDeployment(BaseModel):
             steps.append(SpecialSteps.END.value)
         return steps
 
+    @property
+    def last_step_id(self) -> int | None:
+        """
+        High-water mark of the steps in self, None if there are no steps yet.
+        """
+        if self.no_steps_yet:
+            return None
+        return max((s.id for s in self.steps if s.id is not None), default=SpecialSteps.START.value.id)
+
+    def get_steps_after(self, cursor: int | None, finished_seen: bool = False) -> Steps:
+        """
+        Return the steps a client which has seen all steps up to the high-water
+        mark cursor hasn't seen yet. Step ids from fastdeploy are increasing,
+        therefore steps with a larger id than the cursor are new.
+        """
+        if self.no_steps_yet:
+            return []
+        new_steps = []
+        if cursor is None:
+            new_steps.append(SpecialSteps.START.value)
+            cursor = SpecialSteps.START.value.id
+        new_steps.extend(sorted((s for s in self.steps if s.id is not None and s.id > cursor), reverse=True))
+        if self.has_finished and not finished_seen:
+            new_steps.append(SpecialSteps.END.value)
+        return new_steps
+
     def get_new_steps(self, seen: "RemoteDeployment") -> Steps:
-        seen_steps = {s.id for s in seen.steps_for_client}
-        return [s for s in self.steps_for_client if s.id not in seen_steps]
+        return self.get_steps_after(seen.last_step_id, finished_seen=seen.has_finished)
+
+
+def advance_steps_cursor(cursor: int | None, new_steps: Steps) -> int | None:
+    """
+    Move the high-water mark past new_steps. The end step doesn't count.
+    """
+    step_ids = [s.id for s in new_steps if s.id is not None and s.id >= 0]
+    if cursor is not None:
+        step_ids.append(cursor)
+    return max(step_ids, default=None)
 
 
 class DeploymentContext(BaseModel):
@@ -92,6 +172,125 @@ class AbstractClient(abc.ABC):
     def fetch_deployment(self, deployment: "Deployment") -> RemoteDeployment:
         raise NotImplementedError  # pragma: no cover
 
+    async def astart_deployment(self, deployment: "Deployment") -> RemoteDeployment:
+        return await sync_to_async(self.start_deployment)(deployment)
+
+    async def afetch_deployment(self, deployment: "Deployment") -> RemoteDeployment:
+        return await sync_to_async(self.fetch_deployment)(deployment)
+
+    def fetch_or_keep(self, deployment: "Deployment") -> RemoteDeployment:
+        """
+        Fetch deployment, but return the stored version if fetching fails, so
+        that one broken deployment doesn't fail a whole batch.
+        """
+        try:
+            return self.fetch_deployment(deployment)
+        except Exception:
+            logger.exception(f"could not fetch deployment {deployment.pk}")
+            return deployment.remote
+
+    async def afetch_or_keep(self, deployment: "Deployment") -> RemoteDeployment:
+        try:
+            return await self.afetch_deployment(deployment)
+        except Exception:
+            logger.exception(f"could not fetch deployment {deployment.pk}")
+            return deployment.remote
+
+    def fetch_deployments(
+        self, deployments: Iterable["Deployment"], *, concurrency: int | None = None
+    ) -> list[RemoteDeployment]:
+        """
+        Fetch several deployments and return them in the same order. Deployments
+        which couldn't be fetched are returned in their stored version. This
+        default fetches one deployment after the other.
+        """
+        return [self.fetch_or_keep(deployment) for deployment in deployments]
+
+    async def afetch_deployments(
+        self, deployments: Iterable["Deployment"], *, concurrency: int | None = None
+    ) -> list[RemoteDeployment]:
+        """
+        Async version of fetch_deployments fetching at most concurrency
+        deployments at a time.
+        """
+        concurrency = settings.DEPLOY_FETCH_CONCURRENCY if concurrency is None else concurrency
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def fetch(deployment: "Deployment") -> RemoteDeployment:
+            async with semaphore:
+                return await self.afetch_or_keep(deployment)
+
+        return list(await asyncio.gather(*[fetch(deployment) for deployment in deployments]))
+
+
+_http_clients: dict[str, httpx.Client] = {}
+_http_clients_lock = threading.Lock()
+
+
+def get_http_client_options() -> dict:
+    """
+    Connection pool, timeout and protocol options shared by all clients
+    talking to fastdeploy.
+    """
+    return {
+        "limits": httpx.Limits(
+            max_connections=settings.DEPLOY_HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.DEPLOY_HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=settings.DEPLOY_HTTP_KEEPALIVE_EXPIRY,
+        ),
+        "timeout": httpx.Timeout(settings.DEPLOY_HTTP_TIMEOUT, connect=settings.DEPLOY_HTTP_CONNECT_TIMEOUT),
+        "http2": settings.DEPLOY_HTTP2,
+    }
+
+
+def get_http_client(base_url: str = settings.DEPLOY_BASE_URL) -> httpx.Client:
+    """
+    Return the process wide, pooled http client for base_url. It's created
+    lazily to avoid sharing connections between forked worker processes.
+    """
+    with _http_clients_lock:
+        client = _http_clients.get(base_url)
+        if client is None or client.is_closed:
+            client = httpx.Client(base_url=base_url, **get_http_client_options())
+            _http_clients[base_url] = client
+    return client
+
+
+def close_http_clients() -> None:
+    """
+    Close all pooled http clients. Called on worker / application shutdown.
+    """
+    with _http_clients_lock:
+        clients = list(_http_clients.values())
+        _http_clients.clear()
+    for client in clients:
+        client.close()
+
+
+_async_http_clients: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
+
+def get_async_http_client(base_url: str = settings.DEPLOY_BASE_URL) -> httpx.AsyncClient:
+    """
+    Return the pooled async http client for base_url. Async clients are bound
+    to the event loop they were created in, therefore there's one pool per loop.
+    """
+    clients = _async_http_clients.setdefault(asyncio.get_running_loop(), {})
+    client = clients.get(base_url)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(base_url=base_url, **get_http_client_options())
+        clients[base_url] = client
+    return client
+
+
+async def aclose_http_clients() -> None:
+    """
+    Close all pooled async http clients of the running event loop.
+    """
+    clients = _async_http_clients.pop(asyncio.get_running_loop(), {})
+    for client in clients.values():
+        await client.aclose()
+
 
 class ProductionClient(AbstractClient):
     def __init__(
@@ -99,16 +298,28 @@ class ProductionClient(AbstractClient):
         *,
         base_url: str = settings.DEPLOY_BASE_URL,
         headers: dict = {},
+        http_client: httpx.Client | None = None,
     ):
         self.base_url = base_url
         self.headers = headers
+        self._http_client = http_client
+
+    @property
+    def http_client(self) -> httpx.Client:
+        if self._http_client is not None:
+            return self._http_client
+        return get_http_client(self.base_url)
 
-    def start_deployment(self, deployment, client=httpx.Client) -> RemoteDeployment:
+    def get_headers(self, deployment: "Deployment") -> dict:
+        return self.headers | {"authorization": f"Bearer {deployment.service_token}"}
+
+    @staticmethod
+    def get_start_payload(deployment: "Deployment") -> dict:
         domain = deployment.domain
-        context = DeploymentContext(env=domain.context)
-        headers = self.headers | {"authorization": f"Bearer {deployment.service_token}"}
-        with client(base_url=self.base_url, headers=headers) as client:
-            r = client.post("deployments/", json=context.model_dump())
+        return DeploymentContext(env=domain.context).model_dump()
+
+    @staticmethod
+    def parse_start_response(r) -> RemoteDeployment:
         if r.status_code > 400:
             logger.error(f"start deploy request status is: {r.status_code}")
             logger.error(f"response details: {r.json()['detail']}")
@@ -116,23 +327,314 @@ class ProductionClient(AbstractClient):
         deployment_id = int(r.json()["id"])
         return RemoteDeployment(id=deployment_id, no_steps_yet=True)
 
-    def fetch_deployment(self, deployment, client=httpx.Client) -> RemoteDeployment:
+    @staticmethod
+    def get_fetch_path(deployment: "Deployment") -> str:
         deployment_id = deployment.remote.id
         assert isinstance(deployment_id, int)
-        headers = self.headers | {"authorization": f"Bearer {deployment.service_token}"}
-        print("base url: ", self.base_url)
-        with client(base_url=self.base_url, headers=headers) as client:
-            r = client.get(f"deployments/{deployment_id}")
+        return f"deployments/{deployment_id}"
+
+    @staticmethod
+    def get_fetch_params(deployment: "Deployment") -> dict:
+        """
+        Ask only for steps after the high-water mark. Steps are filtered
+        by the cursor again afterwards, so it's fine if fastdeploy ignores it.
+        """
+        if deployment.steps_cursor is None:
+            return {}
+        return {"steps_after": deployment.steps_cursor}
+
+    @staticmethod
+    def parse_fetch_response(deployment: "Deployment", r) -> RemoteDeployment:
         if r.status_code != 200:
             return deployment.remote
-        remote_deployment = RemoteDeployment(**r.json())
-        remote_deployment.steps.sort(reverse=True)
-        return remote_deployment
+        return RemoteDeployment(**r.json())
+
+    @staticmethod
+    def get_bulk_fetch_batches(deployments: list["Deployment"]) -> list[list["Deployment"]]:
+        """
+        One bulk request can only use one service token, so deployments
+        are batched by token.
+        """
+        batches: dict[str | None, list["Deployment"]] = {}
+        for deployment in deployments:
+            batches.setdefault(deployment.service_token, []).append(deployment)
+        return list(batches.values())
+
+    @staticmethod
+    def get_bulk_fetch_params(batch: list["Deployment"]) -> dict:
+        return {"ids": ",".join(str(deployment.remote.id) for deployment in batch)}
+
+    @staticmethod
+    def parse_bulk_fetch_response(batch: list["Deployment"], r) -> dict[int, RemoteDeployment]:
+        if r.status_code != 200:
+            logger.error(f"bulk fetch request status is: {r.status_code}")
+            return {}
+        remote_deployments = [RemoteDeployment(**data) for data in r.json()]
+        return {remote.id: remote for remote in remote_deployments if remote.id is not None}
+
+    @staticmethod
+    def order_fetched(deployments: list["Deployment"], fetched: dict[int, RemoteDeployment]) -> list[RemoteDeployment]:
+        return [fetched.get(deployment.remote.id, deployment.remote) for deployment in deployments]
+
+    def bulk_fetch(self, deployments: list["Deployment"]) -> list[RemoteDeployment]:
+        fetched: dict[int, RemoteDeployment] = {}
+        for batch in self.get_bulk_fetch_batches(deployments):
+            params, headers = self.get_bulk_fetch_params(batch), self.get_headers(batch[0])
+            with time_upstream("bulk_fetch"):
+                r = self.http_client.get(settings.DEPLOY_BULK_FETCH_PATH, params=params, headers=headers)
+            fetched |= self.parse_bulk_fetch_response(batch, r)
+        return self.order_fetched(deployments, fetched)
 
+    def start_deployment(self, deployment) -> RemoteDeployment:
+        payload = self.get_start_payload(deployment)
+        with time_upstream("start"):
+            r = self.http_client.post("deployments/", json=payload, headers=self.get_headers(deployment))
+        return self.parse_start_response(r)
+
+    def build_fetch_request(self, deployment) -> httpx.Request:
+        path, params = self.get_fetch_path(deployment), self.get_fetch_params(deployment)
+        return self.http_client.build_request("GET", path, params=params, headers=self.get_headers(deployment))
+
+    def send_fetch_request(self, request: httpx.Request) -> httpx.Response:
+        with time_upstream("fetch"):
+            return self.http_client.send(request)
+
+    def fetch_deployment(self, deployment) -> RemoteDeployment:
+        path, params = self.get_fetch_path(deployment), self.get_fetch_params(deployment)
+        with time_upstream("fetch"):
+            r = self.http_client.get(path, params=params, headers=self.get_headers(deployment))
+        return self.parse_fetch_response(deployment, r)
+
+    def submit_fetch(self, executor: ThreadPoolExecutor, deployment) -> Future:
+        """
+        Build the request on the calling thread, because the service token may
+        have to load the domain, and only send it in the pool. Database access
+        from pool threads would open a connection per thread, which is never closed.
+        """
+        try:
+            request = self.build_fetch_request(deployment)
+        except Exception as exc:
+            future: Future = Future()
+            future.set_exception(exc)
+            return future
+        # run in a copy of the current context to add the upstream time to the current request
+        return executor.submit(copy_context().run, self.send_fetch_request, request)
+
+    @classmethod
+    def parse_or_keep(cls, deployment, future: Future) -> RemoteDeployment:
+        try:
+            return cls.parse_fetch_response(deployment, future.result())
+        except Exception:
+            logger.exception(f"could not fetch deployment {deployment.pk}")
+            return deployment.remote
+
+    def fetch_deployments(self, deployments, *, concurrency: int | None = None) -> list[RemoteDeployment]:
+        """
+        Use the bulk endpoint of fastdeploy if it's configured, otherwise
+        fetch the deployments concurrently via the pooled http client.
+        """
+        deployments = list(deployments)
+        if len(deployments) == 0:
+            return []
+        if settings.DEPLOY_BULK_FETCH_PATH:
+            return self.bulk_fetch(deployments)
+        concurrency = settings.DEPLOY_FETCH_CONCURRENCY if concurrency is None else concurrency
+        with ThreadPoolExecutor(max_workers=min(concurrency, len(deployments))) as executor:
+            futures = [self.submit_fetch(executor, deployment) for deployment in deployments]
+            return [self.parse_or_keep(deployment, future) for deployment, future in zip(deployments, futures)]
 
-def create_test_deployments():
+
+class AsyncClient(ProductionClient):
+    """
+    Production client which uses a pooled httpx.AsyncClient for the async
+    methods, so async views don't block a thread while waiting for fastdeploy.
+    The sync methods are inherited from ProductionClient.
+
+    The deployment passed to the async methods needs to have its domain
+    already loaded (select_related), because lazy loading is not possible
+    in an async context.
+    """
+
+    def __init__(self, *, async_http_client: httpx.AsyncClient | None = None, **kwargs):
+        super().__init__(**kwargs)
+        self._async_http_client = async_http_client
+
+    @property
+    def async_http_client(self) -> httpx.AsyncClient:
+        if self._async_http_client is not None:
+            return self._async_http_client
+        return get_async_http_client(self.base_url)
+
+    async def astart_deployment(self, deployment) -> RemoteDeployment:
+        payload = self.get_start_payload(deployment)
+        with time_upstream("start"):
+            r = await self.async_http_client.post("deployments/", json=payload, headers=self.get_headers(deployment))
+        return self.parse_start_response(r)
+
+    async def afetch_deployment(self, deployment) -> RemoteDeployment:
+        path, params = self.get_fetch_path(deployment), self.get_fetch_params(deployment)
+        with time_upstream("fetch"):
+            r = await self.async_http_client.get(path, params=params, headers=self.get_headers(deployment))
+        return self.parse_fetch_response(deployment, r)
+
+    async def afetch_deployments(self, deployments, *, concurrency: int | None = None) -> list[RemoteDeployment]:
+        if not settings.DEPLOY_BULK_FETCH_PATH:
+            return await super().afetch_deployments(deployments, concurrency=concurrency)
+        deployments = list(deployments)
+        fetched: dict[int, RemoteDeployment] = {}
+        for batch in self.get_bulk_fetch_batches(deployments):
+            params, headers = self.get_bulk_fetch_params(batch), self.get_headers(batch[0])
+            with time_upstream("bulk_fetch"):
+                r = await self.async_http_client.get(settings.DEPLOY_BULK_FETCH_PATH, params=params, headers=headers)
+            fetched |= self.parse_bulk_fetch_response(batch, r)
+        return self.order_fetched(deployments, fetched)
+
+
+class CoalescingClient(AbstractClient):
+    """
+    Wraps another client and coalesces fetches of the same deployment. Concurrent
+    fetches share one in-flight upstream request and its result is reused for
+    ttl seconds. This way N watchers of a deployment result in one request to
+    fastdeploy per interval instead of N.
+
+    Deployments are keyed by their primary key and steps cursor, because
+    fastdeploy only returns the steps after the cursor. Starting a deployment
+    is never coalesced.
+    """
+
+    def __init__(self, client: AbstractClient, *, ttl: float | None = None, clock=time.monotonic):
+        self.client = client
+        self.ttl = settings.DEPLOY_FETCH_COALESCE_SECONDS if ttl is None else ttl
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._results: dict[tuple, tuple[float, RemoteDeployment]] = {}
+        self._in_flight: dict[tuple, Future] = {}
+        self._tasks: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
+    @staticmethod
+    def _get_key(deployment: "Deployment") -> tuple:
+        return deployment.pk, deployment.steps_cursor
+
+    def _get_cached(self, key: tuple) -> RemoteDeployment | None:
+        fetched_at, remote = self._results.get(key, (None, None))
+        if fetched_at is None or self.clock() - fetched_at >= self.ttl:
+            return None
+        return remote
+
+    def _store(self, key: tuple, remote: RemoteDeployment) -> None:
+        now = self.clock()
+        self._results = {k: v for k, v in self._results.items() if now - v[0] < self.ttl}
+        if self.ttl > 0:
+            self._results[key] = (now, remote)
+
+    def clear(self) -> None:
+        """
+        Forget all fetched results, fetches in flight are not affected.
+        """
+        with self._lock:
+            self._results = {}
+
+    def start_deployment(self, deployment: "Deployment") -> RemoteDeployment:
+        return self.client.start_deployment(deployment)
+
+    async def astart_deployment(self, deployment: "Deployment") -> RemoteDeployment:
+        return await self.client.astart_deployment(deployment)
+
+    def fetch_deployment(self, deployment: "Deployment") -> RemoteDeployment:
+        key = self._get_key(deployment)
+        with self._lock:
+            remote = self._get_cached(key)
+            if remote is not None:
+                return remote.model_copy()
+            future = self._in_flight.get(key)
+            is_owner = future is None
+            if future is None:
+                future = self._in_flight[key] = Future()
+        if not is_owner:
+            return future.result().model_copy()
+
+        try:
+            remote = self.client.fetch_deployment(deployment)
+        except BaseException as exc:
+            with self._lock:
+                del self._in_flight[key]
+            future.set_exception(exc)
+            raise
+        with self._lock:
+            self._store(key, remote)
+            del self._in_flight[key]
+        future.set_result(remote)
+        return remote.model_copy()
+
+    async def afetch_deployment(self, deployment: "Deployment") -> RemoteDeployment:
+        key = self._get_key(deployment)
+        with self._lock:
+            remote = self._get_cached(key)
+        if remote is not None:
+            return remote.model_copy()
+
+        loop = asyncio.get_running_loop()
+        tasks = self._tasks.setdefault(loop, {})
+        task = tasks.get(key)
+        if task is None:
+            task = tasks[key] = loop.create_task(self.client.afetch_deployment(deployment))
+            task.add_done_callback(lambda done: self._on_task_done(tasks, key, done))
+        # shield the shared task from being cancelled by one of its waiters
+        remote = await asyncio.shield(task)
+        return remote.model_copy()
+
+    def _on_task_done(self, tasks: dict, key: tuple, task: asyncio.Task) -> None:
+        del tasks[key]
+        if not task.cancelled() and task.exception() is None:
+            with self._lock:
+                self._store(key, task.result())
+
+    def _get_cached_batch(self, deployments: list["Deployment"]) -> list[RemoteDeployment | None]:
+        with self._lock:
+            return [self._get_cached(self._get_key(deployment)) for deployment in deployments]
+
+    def _merge_batch(
+        self, deployments: list["Deployment"], cached: list[RemoteDeployment | None], fetched: list[RemoteDeployment]
+    ) -> list[RemoteDeployment]:
+        """
+        Fill the gaps in cached with the fetched deployments and store those.
+        Stored versions returned for failed fetches are not cached.
+        """
+        remotes, fetched_remotes = [], iter(fetched)
+        with self._lock:
+            for deployment, remote in zip(deployments, cached):
+                if remote is None:
+                    remote = next(fetched_remotes)
+                    if remote is not deployment.remote:
+                        self._store(self._get_key(deployment), remote)
+                remotes.append(remote.model_copy())
+        return remotes
+
+    def fetch_deployments(self, deployments, *, concurrency: int | None = None) -> list[RemoteDeployment]:
+        """
+        Only deployments not fetched within ttl are fetched, with one batch
+        request of the wrapped client. Batches don't wait for in-flight fetches.
+        """
+        deployments = list(deployments)
+        cached = self._get_cached_batch(deployments)
+        missing = [deployment for deployment, remote in zip(deployments, cached) if remote is None]
+        fetched = self.client.fetch_deployments(missing, concurrency=concurrency) if missing else []
+        return self._merge_batch(deployments, cached, fetched)
+
+    async def afetch_deployments(self, deployments, *, concurrency: int | None = None) -> list[RemoteDeployment]:
+        deployments = list(deployments)
+        cached = self._get_cached_batch(deployments)
+        missing = [deployment for deployment, remote in zip(deployments, cached) if remote is None]
+        fetched = await self.client.afetch_deployments(missing, concurrency=concurrency) if missing else []
+        return self._merge_batch(deployments, cached, fetched)
+
+
+def create_test_deployments(step_names: list[str] | None = None) -> list[RemoteDeployment]:
+    """
+    States of a deployment in reverse order, pop them to get the next one.
+    """
     deployments = [RemoteDeployment(id=1, no_steps_yet=True)]
-    step_names = ["first step", "second step"]
+    step_names = ["first step", "second step"] if step_names is None else step_names
     for step_id, step_name in enumerate(step_names, 1):
         steps = [Step(id=step_id, name=step_name)]
         deployments.append(RemoteDeployment(service_id=1, origin="test", user="foo", steps=steps))
@@ -161,9 +663,18 @@ class TestClient(AbstractClient):
     def fetch_deployment(self, deployment) -> RemoteDeployment:  # pragma: no cover
         return self.global_deployments[deployment.pk].pop()
 
+    def fetch_deployments(self, deployments, *, concurrency: int | None = None) -> list[RemoteDeployment]:
+        return [self.fetch_deployment(deployment) for deployment in deployments]
+
+    async def afetch_deployments(self, deployments, *, concurrency: int | None = None) -> list[RemoteDeployment]:
+        return self.fetch_deployments(deployments)
+
 
 Client: type[AbstractClient]
 if settings.DEPLOY_CLIENT == "test":  # pragma: no cover
     Client = TestClient
 else:  # pragma: no cover
-    Client = ProductionClient
+    Client = AsyncClient
+
+# process wide client sharing fetches of the same deployment between requests
+coalescing_client = CoalescingClient(Client())
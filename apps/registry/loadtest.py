@@ -0,0 +1,264 @@
+"""
+Load test for the progress pages. A local stand-in for fastdeploy plays the
+step sequences of the TestClient with a configurable latency, while simulated
+watchers open the progress page of a deployment and poll its deploy_state
+until it has finished, like the htmx poller does.
+
+Run it via the loadtest management command against a registry which uses
+the stand-in as DEPLOY_BASE_URL.
+"""
+
+import asyncio
+import json
+import math
+import re
+import secrets
+import threading
+import time
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import httpx
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.test import Client as DjangoTestClient
+from django.urls import reverse
+
+from .fastdeploy import RemoteDeployment, create_test_deployments
+from .models import Deployment, Domain
+
+
+class FastdeployStandIn:
+    """
+    Threaded http server answering like fastdeploy. Every fetch of a deployment
+    returns its next state from a TestClient step sequence, the last state
+    (finished) is repeated.
+    """
+
+    def __init__(self, latency: float = 0.0, steps: int = 5, host: str = "127.0.0.1", port: int = 0):
+        self.latency = latency
+        self.step_names = [f"step {number}" for number in range(1, steps + 1)]
+        self.sequences: dict[int, list[RemoteDeployment]] = {}
+        self.lock = threading.Lock()
+        self.next_id = 1
+        self.server = ThreadingHTTPServer((host, port), self.get_handler_class())
+        self.server.daemon_threads = True
+        self._thread: threading.Thread | None = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def start_deployment(self) -> RemoteDeployment:
+        with self.lock:
+            deployment_id, self.next_id = self.next_id, self.next_id + 1
+            self.sequences[deployment_id] = create_test_deployments(self.step_names)
+        return self.next_state(deployment_id)
+
+    def next_state(self, deployment_id: int) -> RemoteDeployment:
+        with self.lock:
+            sequence = self.sequences.setdefault(deployment_id, create_test_deployments(self.step_names))
+            state = sequence.pop() if len(sequence) > 1 else sequence[0]
+        return state.model_copy(update={"id": deployment_id})
+
+    def get_handler_class(self) -> type[BaseHTTPRequestHandler]:
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def send_json(self, data) -> None:
+                body = json.dumps(data, default=str).encode("utf8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                time.sleep(stand_in.latency)
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                self.send_json(stand_in.start_deployment().model_dump())
+
+            def do_GET(self):
+                time.sleep(stand_in.latency)
+                url = urlparse(self.path)
+                if "ids" in (params := parse_qs(url.query)):
+                    ids = [int(i) for i in params["ids"][0].split(",")]
+                    return self.send_json([stand_in.next_state(i).model_dump() for i in ids])
+                match = re.match(r"^/deployments/(\d+)/?$", url.path)
+                if match is None:
+                    return self.send_error(404)
+                self.send_json(stand_in.next_state(int(match.group(1))).model_dump())
+
+            def log_message(self, format, *args):
+                pass  # don't flood the report
+
+        return Handler
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def percentile(values: list[float], p: float) -> float:
+    """
+    Nearest-rank percentile, 0.0 for no values.
+    """
+    if len(values) == 0:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(math.ceil(p / 100 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+@dataclass
+class EndpointStats:
+    latencies: list[float] = field(default_factory=list)
+    errors: int = 0
+
+    @property
+    def requests(self) -> int:
+        return len(self.latencies) + self.errors
+
+    @property
+    def error_rate(self) -> float:
+        return self.errors / self.requests if self.requests > 0 else 0.0
+
+
+@dataclass
+class LoadTestConfig:
+    watchers: int
+    latency: float
+    duration: float = 30.0
+    poll_interval: float = 1.0
+    state_url_name: str = "deploy_state"
+
+    def __str__(self) -> str:
+        return f"{self.watchers} watchers, {self.latency * 1000:.0f}ms fastdeploy latency, {self.state_url_name}"
+
+
+@dataclass
+class LoadTestResult:
+    config: LoadTestConfig
+    elapsed: float
+    endpoints: dict[str, EndpointStats]
+    finished_watchers: int = 0
+
+    def get_rows(self) -> list[dict]:
+        rows = []
+        for name, stats in self.endpoints.items():
+            rows.append(
+                {
+                    "config": str(self.config),
+                    "endpoint": name,
+                    "requests": stats.requests,
+                    "throughput": stats.requests / self.elapsed if self.elapsed > 0 else 0.0,
+                    "p50": percentile(stats.latencies, 50),
+                    "p99": percentile(stats.latencies, 99),
+                    "error_rate": stats.error_rate,
+                }
+            )
+        return rows
+
+
+def format_report(results: list[LoadTestResult]) -> str:
+    lines = [f"{'endpoint':<20} {'requests':>8} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'errors':>7}"]
+    for result in results:
+        lines.append(f"{result.config} ({result.finished_watchers}/{result.config.watchers} finished)")
+        for row in result.get_rows():
+            lines.append(
+                f"{row['endpoint']:<20} {row['requests']:>8} {row['throughput']:>8.1f} "
+                f"{row['p50'] * 1000:>8.1f} {row['p99'] * 1000:>8.1f} {row['error_rate']:>7.1%}"
+            )
+    return "\n".join(lines)
+
+
+def create_watched_deployments(count: int, client) -> tuple[str, Domain, list[Deployment]]:
+    """
+    Create a new user with a domain and count deployments started via client.
+    Returns the session cookie of the logged in user.
+    """
+    username = f"loadtest-{secrets.token_hex(8)}"  # never an existing user
+    user = get_user_model().objects.create(username=username)
+    domain = Domain.objects.create(fqdn=f"{username}.example.com", owner=user)
+    deployments = []
+    for _ in range(count):
+        deployment = Deployment.objects.create(domain=domain)
+        deployment.start(client=client)
+        deployments.append(deployment)
+    browser = DjangoTestClient()
+    browser.force_login(user)
+    return browser.cookies[settings.SESSION_COOKIE_NAME].value, domain, deployments
+
+
+def delete_watched_deployments(domain: Domain) -> None:
+    """
+    Delete the user created by create_watched_deployments with its domain and deployments.
+    """
+    domain.owner.delete()
+
+
+async def timed_get(client: httpx.AsyncClient, stats: EndpointStats, url: str, **kwargs) -> httpx.Response | None:
+    start = time.perf_counter()
+    try:
+        response = await client.get(url, **kwargs)
+    except httpx.HTTPError:
+        stats.errors += 1
+        return None
+    if response.status_code >= 400:
+        stats.errors += 1
+        return response
+    stats.latencies.append(time.perf_counter() - start)
+    return response
+
+
+async def watch(
+    client: httpx.AsyncClient, config: LoadTestConfig, page_url: str, state_url: str, result: LoadTestResult
+) -> None:
+    """
+    Open the progress page once and poll the state of the deployment like the
+    htmx poller does, until the deployment has finished or time is up.
+    """
+    deadline = time.monotonic() + config.duration
+    await timed_get(client, result.endpoints["domain_deployments"], page_url)
+    seen, etag = 0, None
+    while time.monotonic() < deadline:
+        headers = {"HX-Request": "true"} | ({"If-None-Match": etag} if etag else {})
+        response = await timed_get(
+            client, result.endpoints[config.state_url_name], state_url, params={"seen": seen}, headers=headers
+        )
+        if response is not None and response.status_code in (200, 286):
+            seen += response.text.count("<aside>")
+            etag = response.headers.get("ETag")
+            if response.status_code == 286:
+                result.finished_watchers += 1
+                return
+        await asyncio.sleep(config.poll_interval)
+
+
+async def run_watchers(
+    config: LoadTestConfig, registry_url: str, session_id: str, domain: Domain, deployments: list[Deployment]
+) -> LoadTestResult:
+    result = LoadTestResult(
+        config=config,
+        elapsed=0.0,
+        endpoints={"domain_deployments": EndpointStats(), config.state_url_name: EndpointStats()},
+    )
+    page_url = reverse("domain_deployments", kwargs={"domain_id": domain.pk})
+    limits = httpx.Limits(max_connections=config.watchers)
+    cookies = {settings.SESSION_COOKIE_NAME: session_id}
+    async with httpx.AsyncClient(base_url=registry_url, cookies=cookies, limits=limits, timeout=30.0) as client:
+        start = time.perf_counter()
+        watchers = []
+        for number in range(config.watchers):
+            deployment = deployments[number % len(deployments)]
+            state_url = reverse(config.state_url_name, kwargs={"deployment_id": deployment.pk})
+            watchers.append(watch(client, config, page_url, state_url, result))
+        await asyncio.gather(*watchers)
+        result.elapsed = time.perf_counter() - start
+    return result
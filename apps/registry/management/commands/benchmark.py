@@ -0,0 +1,50 @@
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from ...benchmarks import (
+    BENCHMARKS,
+    SIZES,
+    format_memory_results,
+    format_results,
+    get_regressions,
+    load_baseline,
+    run_benchmarks,
+    run_memory_benchmarks,
+    save_baseline,
+)
+
+
+class Command(BaseCommand):
+    help = "Run the microbenchmarks of the poll hot paths and compare them to a stored baseline."
+
+    def add_arguments(self, parser):
+        parser.add_argument("names", nargs="*", help=f"Benchmarks to run, default all of {', '.join(BENCHMARKS)}")
+        parser.add_argument("--sizes", type=int, nargs="+", default=list(SIZES), help="Steps per deployment")
+        parser.add_argument("--repeat", type=int, default=5)
+        parser.add_argument("--min-time", type=float, default=0.2, help="Minimum seconds per benchmark")
+        parser.add_argument("--baseline", type=Path, default=settings.BASE_DIR / "benchmarks" / "baseline.json")
+        parser.add_argument("--save", action="store_true", help="Store the results as new baseline")
+        parser.add_argument("--threshold", type=float, default=1.25, help="Fail if slower than this times baseline")
+        parser.add_argument("--memory", action="store_true", help="Measure memory of the step history instead")
+
+    def handle(self, *args, **options):
+        unknown = set(options["names"]) - set(BENCHMARKS)
+        if len(unknown) > 0:
+            raise CommandError(f"unknown benchmarks: {', '.join(sorted(unknown))}")
+        if options["memory"]:
+            self.stdout.write(format_memory_results(run_memory_benchmarks(options["sizes"])))
+            return
+        results = run_benchmarks(options["names"], options["sizes"], options["repeat"], options["min_time"])
+        baseline_path = options["baseline"]
+        baseline = load_baseline(baseline_path) if baseline_path.exists() else {}
+        self.stdout.write(format_results(results, baseline))
+        if options["save"]:
+            save_baseline(baseline_path, results)
+            self.stdout.write(f"baseline stored in {baseline_path}")
+            return
+        regressions = get_regressions(results, baseline, options["threshold"])
+        if len(regressions) > 0:
+            keys = ", ".join(result.key for result, _ in regressions)
+            raise CommandError(f"slower than {options['threshold']} times the baseline: {keys}")
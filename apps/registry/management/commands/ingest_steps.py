@@ -0,0 +1,23 @@
+import asyncio
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from ...fastdeploy import Client
+from ...worker import ingest_steps, run_worker
+
+
+class Command(BaseCommand):
+    help = "Fetch new steps of all deployments in progress from fastdeploy in the background."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--interval", type=float, default=settings.DEPLOY_WORKER_INTERVAL)
+        parser.add_argument("--concurrency", type=int, default=settings.DEPLOY_WORKER_CONCURRENCY)
+        parser.add_argument("--once", action="store_true", help="Fetch new steps once and exit")
+
+    def handle(self, *args, **options):
+        if options["once"]:
+            new_steps = asyncio.run(ingest_steps(Client(), options["concurrency"]))
+            self.stdout.write(f"ingested {new_steps} new steps")
+            return
+        asyncio.run(run_worker(interval=options["interval"], concurrency=options["concurrency"]))
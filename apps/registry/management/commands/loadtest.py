@@ -0,0 +1,72 @@
+import asyncio
+from urllib.parse import urlparse
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from ...fastdeploy import ProductionClient
+from ...loadtest import (
+    FastdeployStandIn,
+    LoadTestConfig,
+    create_watched_deployments,
+    delete_watched_deployments,
+    format_report,
+    run_watchers,
+)
+
+LOADTEST_SETTINGS = "config.settings.loadtest"
+
+
+class Command(BaseCommand):
+    help = (
+        "Drive simulated progress page watchers against a running registry and report throughput, latency and "
+        "error rates. The registry has to use the fastdeploy stand-in started by this command as DEPLOY_BASE_URL."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--registry-url", default="http://127.0.0.1:8000/")
+        parser.add_argument(
+            "--fastdeploy-port",
+            type=int,
+            default=None,
+            help="Port of the fastdeploy stand-in, default the one of DEPLOY_BASE_URL, 0 for any free port",
+        )
+        parser.add_argument("--watchers", type=int, nargs="+", default=[10], help="Simulated watchers per run")
+        parser.add_argument("--latency", type=float, nargs="+", default=[0.05], help="Fastdeploy latency in seconds")
+        parser.add_argument("--steps", type=int, default=5, help="Steps of each simulated deployment")
+        parser.add_argument("--duration", type=float, default=30.0, help="Maximum seconds per run")
+        parser.add_argument("--poll-interval", type=float, default=settings.DEPLOY_POLL_INTERVAL)
+        parser.add_argument("--async-views", action="store_true", help="Poll adeploy_state instead of deploy_state")
+
+    def handle(self, *args, **options):
+        if settings.SETTINGS_MODULE != LOADTEST_SETTINGS:
+            # users, domains and deployments are created and deleted in the configured database
+            raise CommandError(f"the load test only runs with DJANGO_SETTINGS_MODULE={LOADTEST_SETTINGS}")
+        port = options["fastdeploy_port"]
+        if port is None:
+            port = urlparse(settings.DEPLOY_BASE_URL).port
+        stand_in = FastdeployStandIn(steps=options["steps"], port=port)
+        stand_in.start()
+        self.stdout.write(f"fastdeploy stand-in listening on {stand_in.base_url}")
+        client = ProductionClient(base_url=stand_in.base_url)
+        results = []
+        try:
+            for latency in options["latency"]:
+                stand_in.latency = latency
+                for watchers in options["watchers"]:
+                    config = LoadTestConfig(
+                        watchers=watchers,
+                        latency=latency,
+                        duration=options["duration"],
+                        poll_interval=options["poll_interval"],
+                        state_url_name="adeploy_state" if options["async_views"] else "deploy_state",
+                    )
+                    session_id, domain, deployments = create_watched_deployments(watchers, client)
+                    try:
+                        runner = run_watchers(config, options["registry_url"], session_id, domain, deployments)
+                        results.append(asyncio.run(runner))
+                    finally:
+                        delete_watched_deployments(domain)
+        finally:
+            stand_in.stop()
+        self.stdout.write(format_report(results))
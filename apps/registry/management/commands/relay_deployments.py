@@ -0,0 +1,17 @@
+import asyncio
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from ...relay import get_relay
+
+
+class Command(BaseCommand):
+    help = "Relay deployment events from the fastdeploy websocket into the database."
+
+    def handle(self, *args, **options):
+        relay = get_relay()
+        if relay is None:
+            raise CommandError("DEPLOY_WEBSOCKET_URL is not configured")
+        self.stdout.write(f"relaying deployment events from {settings.DEPLOY_WEBSOCKET_URL}")
+        asyncio.run(relay.run())
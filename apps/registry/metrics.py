@@ -0,0 +1,173 @@
+"""
+Per-request timings of database queries, fastdeploy calls and template
+rendering. They are sent as Server-Timing header by the MetricsMiddleware
+and collected in histograms, which are served in the Prometheus text format.
+
+Histograms are kept per process.
+"""
+
+import threading
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+
+from django.template.backends.django import DjangoTemplates
+from django.template.backends.django import Template as DjangoTemplate
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+
+class Histogram:
+    """
+    Cumulative histogram with one label, e.g. the name of a view.
+    """
+
+    def __init__(self, name: str, documentation: str, label: str, buckets: tuple = DURATION_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label = label
+        self.buckets = buckets
+        self.series: dict[str, tuple[list[int], list[float]]] = {}  # label value -> bucket counts, [sum]
+        self.lock = threading.Lock()
+
+    def observe(self, label_value: str, value: float) -> None:
+        with self.lock:
+            counts, total = self.series.setdefault(label_value, ([0] * (len(self.buckets) + 1), [0.0]))
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+            counts[-1] += 1  # +Inf
+            total[0] += value
+
+    def expose(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for label_value, (counts, total) in sorted(self.series.items()):
+                label = f'{self.label}="{label_value}"'
+                for bound, count in zip((*self.buckets, "+Inf"), counts):
+                    lines.append(f'{self.name}_bucket{{{label},le="{bound}"}} {count}')
+                lines.append(f"{self.name}_sum{{{label}}} {total[0]}")
+                lines.append(f"{self.name}_count{{{label}}} {counts[-1]}")
+        return lines
+
+
+REQUEST_DURATION = Histogram("registry_request_duration_seconds", "Time spent handling a request.", "view")
+REQUEST_DB = Histogram("registry_request_db_seconds", "Time spent in database queries per request.", "view")
+REQUEST_QUERIES = Histogram("registry_request_queries", "Database queries per request.", "view", QUERY_BUCKETS)
+REQUEST_UPSTREAM = Histogram("registry_request_upstream_seconds", "Time spent calling fastdeploy per request.", "view")
+REQUEST_RENDER = Histogram("registry_request_render_seconds", "Time spent rendering templates per request.", "view")
+UPSTREAM_DURATION = Histogram("registry_upstream_duration_seconds", "Duration of calls to fastdeploy.", "call")
+
+HISTOGRAMS = [REQUEST_DURATION, REQUEST_DB, REQUEST_QUERIES, REQUEST_UPSTREAM, REQUEST_RENDER, UPSTREAM_DURATION]
+
+
+@dataclass
+class RequestTimings:
+    """
+    Time in seconds spent per category while handling one request. Calls to
+    fastdeploy made concurrently are summed up, from several threads.
+    """
+
+    queries: int = 0
+    db: float = 0.0
+    upstream: float = 0.0
+    render: float = 0.0
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False, compare=False)
+
+    def add_upstream(self, duration: float) -> None:
+        with self.lock:
+            self.upstream += duration
+
+    def get_server_timing(self, total: float) -> str:
+        return ", ".join(
+            [
+                f'db;dur={self.db * 1000:.1f};desc="{self.queries} queries"',
+                f"upstream;dur={self.upstream * 1000:.1f}",
+                f"render;dur={self.render * 1000:.1f}",
+                f"total;dur={total * 1000:.1f}",
+            ]
+        )
+
+    def observe(self, view: str, total: float) -> None:
+        REQUEST_DURATION.observe(view, total)
+        REQUEST_DB.observe(view, self.db)
+        REQUEST_QUERIES.observe(view, self.queries)
+        REQUEST_UPSTREAM.observe(view, self.upstream)
+        REQUEST_RENDER.observe(view, self.render)
+
+
+current_timings: ContextVar[RequestTimings | None] = ContextVar("current_timings", default=None)
+
+
+def expose() -> str:
+    lines = []
+    for histogram in HISTOGRAMS:
+        lines.extend(histogram.expose())
+    return "\n".join(lines) + "\n"
+
+
+def record_query(execute, sql, params, many, context):
+    """
+    Database execute wrapper adding the duration of each query to the timings
+    of the current request.
+    """
+    timings = current_timings.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.db += time.perf_counter() - start
+        timings.queries += 1
+
+
+def install_query_recorder(sender, connection, **kwargs) -> None:
+    """
+    Receiver for connection_created. Connections are per thread, this way
+    queries of async views running in a thread pool are recorded, too.
+    """
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+@contextmanager
+def time_upstream(call: str) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start
+        UPSTREAM_DURATION.observe(call, duration)
+        timings = current_timings.get()
+        if timings is not None:
+            timings.add_upstream(duration)
+
+
+class TimedTemplate(DjangoTemplate):
+    def render(self, context=None, request=None):
+        timings = current_timings.get()
+        if timings is None:
+            return super().render(context, request)
+        start = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            timings.render += time.perf_counter() - start
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """
+    Django template backend adding the time spent rendering templates to the
+    timings of the current request. Included templates are part of the
+    template including them and not counted twice.
+    """
+
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code).template, self)
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name).template, self)
@@ -0,0 +1,57 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import HttpRequest, HttpResponse
+
+from .metrics import RequestTimings, current_timings
+
+
+def get_view_name(request: HttpRequest) -> str:
+    match = request.resolver_match
+    if match is None:
+        return "unresolved"
+    return match.url_name or match.view_name
+
+
+class MetricsMiddleware:
+    """
+    Record query count, database, fastdeploy and render time of each request,
+    add them as Server-Timing header and observe them in the histograms of
+    the view. Should be the first middleware to cover all the others.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request: HttpRequest):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timings, start = RequestTimings(), time.perf_counter()
+        token = current_timings.set(timings)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_timings.reset(token)
+        return self.finish(request, response, timings, time.perf_counter() - start)
+
+    async def __acall__(self, request: HttpRequest):
+        timings, start = RequestTimings(), time.perf_counter()
+        token = current_timings.set(timings)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_timings.reset(token)
+        return self.finish(request, response, timings, time.perf_counter() - start)
+
+    @staticmethod
+    def finish(request: HttpRequest, response: HttpResponse, timings: RequestTimings, total: float) -> HttpResponse:
+        timings.observe(get_view_name(request), total)
+        if settings.REGISTRY_SERVER_TIMING:
+            response["Server-Timing"] = timings.get_server_timing(total)
+        return response
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("registry", "0008_alter_deployment_data"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="deployment",
+            name="finished",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="deployment",
+            name="remote_id",
+            field=models.IntegerField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="deployment",
+            name="started",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="deployment",
+            name="state",
+            field=models.CharField(
+                choices=[("NW", "New"), ("RU", "Running"), ("FI", "Finished")], default="NW", max_length=2
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="deployment",
+            index=models.Index(fields=["domain", "state"], name="registry_de_domain__d2bd9d_idx"),
+        ),
+    ]
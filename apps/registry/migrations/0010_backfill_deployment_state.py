@@ -0,0 +1,45 @@
+from datetime import timezone
+
+from django.db import migrations
+from django.utils.dateparse import parse_datetime
+from django.utils.timezone import is_naive, make_aware
+
+
+def parse(value):
+    if value is None:
+        return None
+    value = parse_datetime(value)
+    if value is not None and is_naive(value):
+        value = make_aware(value, timezone.utc)
+    return value
+
+
+def backfill_deployment_state(apps, schema_editor):
+    """
+    Copy id, start and finish times and the state from the serialized
+    remote deployment into the new columns.
+    """
+    Deployment = apps.get_model("registry", "Deployment")
+    batch = []
+    for deployment in Deployment.objects.exclude(data=None).only("pk", "data").iterator(chunk_size=500):
+        data = deployment.data
+        deployment.remote_id = data.get("id")
+        deployment.started = parse(data.get("started"))
+        deployment.finished = parse(data.get("finished"))
+        deployment.state = "FI" if deployment.finished is not None else "RU"
+        batch.append(deployment)
+        if len(batch) >= 500:
+            Deployment.objects.bulk_update(batch, ["remote_id", "started", "finished", "state"])
+            batch = []
+    Deployment.objects.bulk_update(batch, ["remote_id", "started", "finished", "state"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("registry", "0009_denormalize_deployment_state"),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_deployment_state, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:11
+
+from django.db import migrations, models
+
+
+def backfill_last_step_id(apps, schema_editor):
+    """
+    Use the largest id of the processed steps as the high-water mark.
+    """
+    Deployment = apps.get_model("registry", "Deployment")
+    batch = []
+    for deployment in Deployment.objects.only("pk", "processed_steps").iterator(chunk_size=500):
+        step_ids = [step.get("id") for step in deployment.processed_steps]
+        deployment.last_step_id = max((i for i in step_ids if i is not None and i >= 0), default=None)
+        if deployment.last_step_id is None:
+            continue
+        batch.append(deployment)
+        if len(batch) >= 500:
+            Deployment.objects.bulk_update(batch, ["last_step_id"])
+            batch = []
+    Deployment.objects.bulk_update(batch, ["last_step_id"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("registry", "0010_backfill_deployment_state"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="deployment",
+            name="last_step_id",
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.RunPython(backfill_last_step_id, migrations.RunPython.noop),
+    ]
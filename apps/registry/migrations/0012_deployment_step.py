@@ -0,0 +1,112 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:13
+
+from datetime import timezone
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.utils.dateparse import parse_datetime
+from django.utils.timezone import is_naive, make_aware
+
+
+def parse(value):
+    if value is None:
+        return None
+    value = parse_datetime(value)
+    if value is not None and is_naive(value):
+        value = make_aware(value, timezone.utc)
+    return value
+
+
+def copy_processed_steps(apps, schema_editor):
+    """
+    Move the steps from the processed_steps json into DeploymentStep rows.
+    """
+    Deployment = apps.get_model("registry", "Deployment")
+    DeploymentStep = apps.get_model("registry", "DeploymentStep")
+    rows, deployments = [], []
+    for deployment in Deployment.objects.only("pk", "processed_steps").iterator(chunk_size=500):
+        for position, step in enumerate(deployment.processed_steps):
+            rows.append(
+                DeploymentStep(
+                    deployment_id=deployment.pk,
+                    position=position,
+                    step_id=step.get("id"),
+                    name=step.get("name", ""),
+                    started=parse(step.get("started")),
+                    finished=parse(step.get("finished")),
+                    state=step.get("state", "pending"),
+                    message=step.get("message", ""),
+                )
+            )
+        deployment.steps_count = len(deployment.processed_steps)
+        deployments.append(deployment)
+        if len(rows) >= 500 or len(deployments) >= 500:
+            DeploymentStep.objects.bulk_create(rows)
+            Deployment.objects.bulk_update(deployments, ["steps_count"])
+            rows, deployments = [], []
+    DeploymentStep.objects.bulk_create(rows)
+    Deployment.objects.bulk_update(deployments, ["steps_count"])
+
+
+def copy_steps_back(apps, schema_editor):
+    Deployment = apps.get_model("registry", "Deployment")
+    DeploymentStep = apps.get_model("registry", "DeploymentStep")
+    steps: dict[int, list] = {}
+    for step in DeploymentStep.objects.order_by("deployment_id", "position").iterator(chunk_size=500):
+        steps.setdefault(step.deployment_id, []).append(
+            {
+                "id": step.step_id,
+                "name": step.name,
+                "started": step.started and step.started.isoformat(),
+                "finished": step.finished and step.finished.isoformat(),
+                "state": step.state,
+                "message": step.message,
+            }
+        )
+    for deployment_id, processed_steps in steps.items():
+        Deployment.objects.filter(pk=deployment_id).update(processed_steps=processed_steps)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("registry", "0011_deployment_last_step_id"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="deployment",
+            name="steps_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name="DeploymentStep",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("position", models.PositiveIntegerField()),
+                ("step_id", models.IntegerField(blank=True, null=True)),
+                ("name", models.TextField()),
+                ("started", models.DateTimeField(blank=True, null=True)),
+                ("finished", models.DateTimeField(blank=True, null=True)),
+                ("state", models.CharField(default="pending", max_length=32)),
+                ("message", models.TextField(blank=True, default="")),
+                (
+                    "deployment",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, related_name="steps", to="registry.deployment"
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["position"],
+                "constraints": [
+                    models.UniqueConstraint(fields=("deployment", "position"), name="unique_deployment_step_position")
+                ],
+            },
+        ),
+        migrations.RunPython(copy_processed_steps, copy_steps_back),
+        migrations.RemoveField(
+            model_name="deployment",
+            name="processed_steps",
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("registry", "0012_deployment_step"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="deployment",
+            name="version",
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
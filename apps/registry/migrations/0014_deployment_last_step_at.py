@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("registry", "0013_deployment_version"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="deployment",
+            name="last_step_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
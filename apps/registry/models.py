@@ -1,17 +1,80 @@
 import secrets
 import string
+import sys
+from collections.abc import Iterator
+from datetime import datetime
+from datetime import timezone as dt_timezone
 
+from asgiref.sync import sync_to_async
 from django.conf import settings
-from django.db import models
+from django.db import models, transaction
+from django.dispatch import Signal
+from django.utils import timezone
+from django.utils.functional import cached_property
 from django.utils.translation import gettext_lazy as _
 
-from .fastdeploy import AbstractClient, Client, RemoteDeployment, Steps
+from .fastdeploy import (
+    AbstractClient,
+    Client,
+    RemoteDeployment,
+    Step,
+    StepRecord,
+    StepRecords,
+    Steps,
+    advance_steps_cursor,
+    coalescing_client,
+)
 from .serializers import RegistryJSONEncoder
 
 
-def create_secret(length: int = 32):
-    alphabet = string.ascii_letters + string.digits
-    return "".join(secrets.choice(alphabet) for _ in range(length))
+def make_step_record(
+    step_id: int | None, name: str, started: datetime | None, finished: datetime | None, state: str, message: str
+) -> StepRecord:
+    """
+    Step record from the columns of a DeploymentStep. There are only a few
+    states, so every step of the history shares the same state strings.
+    """
+    return StepRecord(step_id, name, started, finished, sys.intern(state), message)
+
+
+SECRET_ALPHABET = string.ascii_letters + string.digits
+# maps a random byte to a character, bytes at or above SECRET_BYTE_LIMIT are
+# dropped, otherwise the first characters of the alphabet would be more likely
+SECRET_BYTE_LIMIT = 256 - 256 % len(SECRET_ALPHABET)
+SECRET_TABLE = bytes(ord(SECRET_ALPHABET[b % len(SECRET_ALPHABET)]) for b in range(256))
+SECRET_REJECTED = bytes(range(SECRET_BYTE_LIMIT, 256))
+
+
+def create_secrets(count: int, length: int = 32) -> list[str]:
+    """
+    Create count secrets with one call to the CSPRNG for all of them.
+    """
+    needed = count * length
+    chars = b""
+    while len(chars) < needed:
+        # some bytes get rejected, draw a few more to almost never need a second call
+        missing = needed - len(chars)
+        raw = secrets.token_bytes(missing + missing // 16 + 16)
+        chars += raw.translate(SECRET_TABLE, SECRET_REJECTED)
+    text = chars[:needed].decode("ascii")
+    bounds = range(0, needed + 1, length)
+    return [text[start:end] for start, end in zip(bounds, bounds[1:])]
+
+
+def create_secret(length: int = 32) -> str:
+    return create_secrets(1, length)[0]
+
+
+WORDPRESS_SECRETS = (
+    "auth_key",
+    "secure_auth_key",
+    "logged_in_key",
+    "nonce_key",
+    "auth_salt",
+    "secure_auth_salt",
+    "logged_in_salt",
+    "nonce_salt",
+)
 
 
 class Domain(models.Model):
@@ -52,25 +115,27 @@ class Domain(models.Model):
             }
         return {}
 
+    @property
+    def secrets_count(self) -> int:
+        """
+        Number of secrets in the context, the database password included.
+        """
+        if self.backend == self.Backend.CAST:
+            return 2
+        elif self.backend == self.Backend.WORDPRESS:
+            return 1 + len(WORDPRESS_SECRETS)
+        return 1
+
     @staticmethod
-    def get_cast_context(base_context):
+    def get_cast_context(base_context, new_secrets: Iterator[str]):
         return {
-            "secret_key": create_secret(),
+            "secret_key": next(new_secrets),
             "settings_file_name": base_context["site_id"],
         }
 
     @staticmethod
-    def get_wordpress_context():
-        return {
-            "auth_key": create_secret(),
-            "secure_auth_key": create_secret(),
-            "logged_in_key": create_secret(),
-            "nonce_key": create_secret(),
-            "auth_salt": create_secret(),
-            "secure_auth_salt": create_secret(),
-            "logged_in_salt": create_secret(),
-            "nonce_salt": create_secret(),
-        }
+    def get_wordpress_context(new_secrets: Iterator[str]):
+        return dict(zip(WORDPRESS_SECRETS, new_secrets))
 
     @property
     def context(self):
@@ -79,33 +144,61 @@ class Domain(models.Model):
         underscored_fqdn = fqdn.replace(".", "_")
         site_id = f"{prefix}_{underscored_fqdn}"
         user_name = f"{prefix}_{self.pk}"
+        new_secrets = iter(create_secrets(self.secrets_count))
         base = {
             "fqdn": fqdn,
             "site_id": site_id,
             "user_name": user_name,
             "database_name": site_id,
             "database_user": site_id,
-            "database_password": create_secret(),
+            "database_password": next(new_secrets),
             "port": str(10000 + self.pk),
         }
         additional_context = {}
         if self.backend == self.Backend.CAST:
-            additional_context = self.get_cast_context(base)
+            additional_context = self.get_cast_context(base, new_secrets)
         elif self.backend == self.Backend.WORDPRESS:
-            additional_context = self.get_wordpress_context()
+            additional_context = self.get_wordpress_context(new_secrets)
         return base | additional_context
 
 
+def make_aware(value: datetime | None) -> datetime | None:
+    if value is not None and timezone.is_naive(value):
+        return timezone.make_aware(value, dt_timezone.utc)
+    return value
+
+
+# sent after save_progress wrote a deployment, which bypasses post_save
+progress_saved = Signal()
+
+
+class DeploymentQuerySet(models.QuerySet):
+    def in_progress(self):
+        return self.filter(state=Deployment.State.RUNNING)
+
+    def finished(self):
+        return self.filter(state=Deployment.State.FINISHED)
+
+
 class Deployment(models.Model):
     """
     Deployments have a domain for which they are deployed. They store
     a serialized version of the RemoteDeployment model fetched from fastdeploy.
+
+    The id, start and finish times and the state of the remote deployment are
+    denormalized into indexed columns on save, to be able to query for them.
+    Processed steps are appended to the DeploymentStep table.
     """
 
     class Target(models.TextChoices):
         DEPLOY = "DP", _("Deploy")
         REMOVE = "RM", _("Remove")
 
+    class State(models.TextChoices):
+        NEW = "NW", _("New")
+        RUNNING = "RU", _("Running")
+        FINISHED = "FI", _("Finished")
+
     target = models.CharField(
         max_length=2,
         choices=Target.choices,
@@ -113,20 +206,191 @@ class Deployment(models.Model):
     )
 
     data = models.JSONField(encoder=RegistryJSONEncoder, null=True)
-    processed_steps = models.JSONField(encoder=RegistryJSONEncoder, default=list)
     domain = models.ForeignKey(Domain, on_delete=models.CASCADE)
 
+    remote_id = models.IntegerField(null=True, blank=True, db_index=True)
+    last_step_id = models.IntegerField(null=True, blank=True)  # high-water mark of processed_steps
+    steps_count = models.PositiveIntegerField(default=0)  # number of processed_steps
+    last_step_at = models.DateTimeField(null=True, blank=True)  # when steps were appended the last time
+    started = models.DateTimeField(null=True, blank=True)
+    finished = models.DateTimeField(null=True, blank=True)
+    state = models.CharField(
+        max_length=2,
+        choices=State.choices,
+        default=State.NEW,
+    )
+    version = models.PositiveIntegerField(default=0)  # incremented on every write
+
+    objects = DeploymentQuerySet.as_manager()
+
+    # columns derived from data by update_remote_fields
+    remote_fields = ["remote_id", "started", "finished", "state"]
+    # columns which change when steps are appended
+    steps_fields = ["steps_count", "last_step_id", "last_step_at"]
+    # columns to reload to see the progress stored by others
+    progress_fields = ["data", *remote_fields, *steps_fields, "version"]
+
+    class Meta:
+        indexes = [models.Index(fields=["domain", "state"])]
+
+    def update_remote_fields(self) -> None:
+        remote = self.remote
+        if remote is None:
+            self.remote_id, self.started, self.finished = None, None, None
+            self.state = self.State.NEW
+            return
+        self.remote_id = remote.id
+        self.started = make_aware(remote.started)
+        self.finished = make_aware(remote.finished)
+        self.state = self.State.FINISHED if remote.has_finished else self.State.RUNNING
+
+    def save(self, *args, **kwargs):
+        self.update_remote_fields()
+        self.version += 1
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None:
+            update_fields = {*update_fields, "version"}
+            if "data" in update_fields:
+                update_fields.update(self.remote_fields)
+            kwargs["update_fields"] = update_fields
+        super().save(*args, **kwargs)
+
     @property
     def remote(self):
+        """
+        Parsed version of data. Parsing is cached until data gets reassigned,
+        for example by refresh_from_db. Treat the result as read-only and
+        assign a modified copy to data instead.
+        """
         if self.data is None:
             return None
-        return RemoteDeployment.model_validate(self.data)
+        if isinstance(self.data, RemoteDeployment):
+            return self.data
+        source, remote = self.__dict__.get("_remote_cache", (None, None))
+        if source is not self.data:
+            remote = RemoteDeployment.model_validate(self.data)
+            self.__dict__["_remote_cache"] = (self.data, remote)
+        return remote
 
     def start(self, client: AbstractClient = Client()):
         self.data = client.start_deployment(self)
         self.save()
 
-    def get_new_steps(self, client: AbstractClient = Client()) -> Steps:
+    @property
+    def steps_cursor(self) -> int | None:
+        """
+        Id of the last processed step. Falls back to the stored remote deployment
+        for rows which were processed before the high-water mark was tracked.
+        """
+        if self.last_step_id is not None:
+            return self.last_step_id
+        if self.remote is None:
+            return None
+        return self.remote.last_step_id
+
+    @cached_property
+    def processed_steps(self) -> StepRecords:
+        """
+        All processed steps. Uses the steps loaded by prefetch_related("steps") if there are any.
+        """
+        return [step.to_record() for step in self.steps.all()]
+
+    def get_processed_steps(self, position: int = 0) -> StepRecords:
+        """
+        Processed steps starting at position, fetched with one indexed query
+        without creating model instances for the rows.
+        """
+        rows = self.steps.filter(position__gte=position).values_list(*DeploymentStep.record_fields)
+        return [make_step_record(*row) for row in rows]
+
+    async def aget_processed_steps(self, position: int = 0) -> StepRecords:
+        rows = self.steps.filter(position__gte=position).values_list(*DeploymentStep.record_fields)
+        return [make_step_record(*row) async for row in rows]
+
+    def refresh_from_db(self, *args, **kwargs):
+        self.__dict__.pop("processed_steps", None)
+        super().refresh_from_db(*args, **kwargs)
+
+    def process_remote(self, remote: RemoteDeployment) -> tuple[list["DeploymentStep"], list[str]]:
+        """
+        Only steps after the high-water mark are new, so there's no need
+        to compare them to all the steps processed before. Returns the
+        unsaved rows for the new steps and the names of the changed columns.
+
+        The steps are stored in DeploymentStep only, data keeps the rest
+        of the remote deployment.
+        """
+        old_remote = self.remote
+        old_values = {name: getattr(self, name) for name in [*self.remote_fields, *self.steps_fields]}
+        cursor = self.steps_cursor
+        finished_seen = self.remote is not None and self.remote.has_finished
+        new_steps = remote.get_steps_after(cursor, finished_seen=finished_seen)
+        rows = self.append_steps(new_steps)
+        self.last_step_id = advance_steps_cursor(cursor, new_steps)
+        self.data = remote.model_copy(update={"steps": []})
+        self.update_remote_fields()
+        changed = [name for name, value in old_values.items() if getattr(self, name) != value]
+        # compare the parsed models instead of encoding both of them
+        if self.data != old_remote:
+            changed.insert(0, "data")
+        return rows, changed
+
+    def append_steps(self, steps: Steps | StepRecords) -> list["DeploymentStep"]:
+        """
+        Append steps to the processed steps. Returns the unsaved rows, which
+        have to be stored together with the deployment by save_progress.
+        """
+        rows = [DeploymentStep.from_step(self, self.steps_count + i, step) for i, step in enumerate(steps)]
+        if "processed_steps" in self.__dict__:
+            self.processed_steps.extend(StepRecord.from_step(step) for step in steps)
+        self.steps_count += len(steps)
+        if len(steps) > 0:
+            self.last_step_at = timezone.now()
+        return rows
+
+    def save_progress(self, rows: list["DeploymentStep"], changed: list[str]) -> bool:
+        """
+        Write only the changed columns and append rows, unless the deployment
+        was written by someone else since it was loaded. Returns False in that
+        case, nothing is written then.
+        """
+        if len(changed) == 0:
+            return True
+        values = {name: getattr(self, name) for name in changed}
+        with transaction.atomic():
+            deployments = Deployment.objects.filter(pk=self.pk, version=self.version)
+            if deployments.update(version=models.F("version") + 1, **values) == 0:
+                return False
+            DeploymentStep.objects.bulk_create(rows)
+        self.version += 1
+        progress_saved.send(sender=Deployment, instance=self)
+        return True
+
+    def apply_remote(self, remote: RemoteDeployment) -> StepRecords:
+        """
+        Store a new version of the remote deployment, append the steps which
+        weren't processed yet and return them. Nothing is written if nothing
+        changed.
+
+        If a concurrent poller has already stored a newer version, return the
+        steps it has appended instead.
+        """
+        position = self.steps_count
+        rows, changed = self.process_remote(remote)
+        if not self.save_progress(rows, changed):
+            self.refresh_from_db()
+            return self.get_processed_steps(position)
+        return [row.to_record() for row in rows]
+
+    async def aapply_remote(self, remote: RemoteDeployment) -> StepRecords:
+        position = self.steps_count
+        rows, changed = self.process_remote(remote)
+        if not await sync_to_async(self.save_progress)(rows, changed):
+            await self.arefresh_from_db()
+            return await self.aget_processed_steps(position)
+        return [row.to_record() for row in rows]
+
+    def get_new_steps(self, client: AbstractClient = coalescing_client) -> StepRecords:
         """
         If the deployment has finished, it's possible to return early that
         there are no new steps.
@@ -137,12 +401,48 @@ class Deployment(models.Model):
         if self.remote.has_finished:
             return []
 
-        deployment = client.fetch_deployment(self)
-        new_steps = deployment.get_new_steps(self.remote)
-        self.processed_steps.extend(new_steps)
-        self.data = deployment  # deployment is the new remote
-        self.save()
-        return new_steps
+        return self.apply_remote(client.fetch_deployment(self))
+
+    async def aget_new_steps(self, client: AbstractClient = coalescing_client) -> StepRecords:
+        """
+        Async version of get_new_steps. The domain has to be loaded already
+        via select_related, because it's needed for the service token.
+        """
+        if self.remote.has_finished:
+            return []
+
+        return await self.aapply_remote(await client.afetch_deployment(self))
+
+    def refresh_steps(self) -> None:
+        """
+        Bring processed_steps up to date. If steps are ingested by the background
+        worker or the relay, it's enough to reload them from the database.
+        """
+        if steps_are_ingested():
+            self.refresh_from_db(fields=self.progress_fields)
+        else:
+            self.get_new_steps()
+
+    async def arefresh_steps(self) -> None:
+        if steps_are_ingested():
+            await self.arefresh_from_db(fields=self.progress_fields)
+        else:
+            await self.aget_new_steps()
+
+    def get_poll_delay(self, now: datetime | None = None) -> int:
+        """
+        Seconds until clients should poll for new steps again. Starts with
+        DEPLOY_POLL_INTERVAL and doubles every time the deployment has been
+        idle for as long as the current delay, up to DEPLOY_POLL_MAX_INTERVAL.
+        """
+        delay, max_delay = max(settings.DEPLOY_POLL_INTERVAL, 1), settings.DEPLOY_POLL_MAX_INTERVAL
+        last_activity = self.last_step_at or self.started
+        if last_activity is None:
+            return delay
+        idle = ((now or timezone.now()) - last_activity).total_seconds()
+        while delay < max_delay and delay * 2 <= idle:
+            delay = min(delay * 2, max_delay)
+        return delay
 
     @property
     def has_finished(self):
@@ -164,3 +464,99 @@ class Deployment(models.Model):
         elif self.target == self.Target.REMOVE:
             return service_tokens["remove"]
         return None
+
+
+def steps_are_ingested() -> bool:
+    """
+    Whether new steps are written to the database by the background worker or
+    the relay of fastdeploy's websocket. Requests only have to read them then,
+    instead of fetching deployments from the REST api.
+    """
+    return settings.DEPLOY_STEPS_WORKER or bool(settings.DEPLOY_WEBSOCKET_URL)
+
+
+def fetch_new_steps(
+    deployments: list[Deployment], client: AbstractClient = coalescing_client, concurrency: int | None = None
+) -> list[StepRecords]:
+    """
+    Like Deployment.get_new_steps for several deployments, but fetching
+    all of them with one batch of requests.
+    """
+    running = [deployment for deployment in deployments if not deployment.has_finished]
+    remotes = client.fetch_deployments(running, concurrency=concurrency)
+    new_steps = {deployment.pk: deployment.apply_remote(remote) for deployment, remote in zip(running, remotes)}
+    return [new_steps.get(deployment.pk, []) for deployment in deployments]
+
+
+async def afetch_new_steps(
+    deployments: list[Deployment], client: AbstractClient = coalescing_client, concurrency: int | None = None
+) -> list[StepRecords]:
+    """
+    Async version of fetch_new_steps. The domains of the deployments have to
+    be loaded already via select_related.
+    """
+    running = [deployment for deployment in deployments if not deployment.has_finished]
+    remotes = await client.afetch_deployments(running, concurrency=concurrency)
+    new_steps = {deployment.pk: await deployment.aapply_remote(remote) for deployment, remote in zip(running, remotes)}
+    return [new_steps.get(deployment.pk, []) for deployment in deployments]
+
+
+def get_processed_steps_after(positions: dict[int, int]) -> dict[int, StepRecords]:
+    """
+    Processed steps of several deployments, keyed by deployment id, starting
+    at the position given for each of them. Fetched with one indexed query.
+    """
+    steps: dict[int, StepRecords] = {deployment_id: [] for deployment_id in positions}
+    if len(positions) == 0:
+        return steps
+    condition = models.Q()
+    for deployment_id, position in positions.items():
+        condition |= models.Q(deployment_id=deployment_id, position__gte=position)
+    rows = DeploymentStep.objects.filter(condition).order_by("deployment_id", "position")
+    for deployment_id, *fields in rows.values_list("deployment_id", *DeploymentStep.record_fields):
+        steps[deployment_id].append(make_step_record(*fields))
+    return steps
+
+
+class DeploymentStep(models.Model):
+    """
+    A processed step of a deployment. Steps are only ever appended, position
+    is the index of the step in the processed steps of its deployment.
+    """
+
+    deployment = models.ForeignKey(Deployment, on_delete=models.CASCADE, related_name="steps")
+    position = models.PositiveIntegerField()
+    step_id = models.IntegerField(null=True, blank=True)
+    name = models.TextField()
+    started = models.DateTimeField(null=True, blank=True)
+    finished = models.DateTimeField(null=True, blank=True)
+    state = models.CharField(max_length=32, default="pending")
+    message = models.TextField(blank=True, default="")
+
+    # columns of a StepRecord, in order
+    record_fields = ["step_id", "name", "started", "finished", "state", "message"]
+
+    class Meta:
+        ordering = ["position"]
+        constraints = [
+            models.UniqueConstraint(fields=["deployment", "position"], name="unique_deployment_step_position"),
+        ]
+
+    def __str__(self):
+        return f"{self.deployment_id}: {self.name}"
+
+    @classmethod
+    def from_step(cls, deployment: Deployment, position: int, step: Step) -> "DeploymentStep":
+        return cls(
+            deployment=deployment,
+            position=position,
+            step_id=step.id,
+            name=step.name,
+            started=make_aware(step.started),
+            finished=make_aware(step.finished),
+            state=step.state,
+            message=step.message,
+        )
+
+    def to_record(self) -> StepRecord:
+        return make_step_record(self.step_id, self.name, self.started, self.finished, self.state, self.message)
@@ -0,0 +1,68 @@
+from dataclasses import dataclass, field
+
+from django.db.models import QuerySet
+from django.http import HttpRequest
+
+
+@dataclass
+class KeysetPage:
+    """
+    A page of objects ordered by primary key. Instead of page numbers the
+    neighbouring pages are addressed by the primary key they start after
+    (next) or end before (previous), so no page needs an offset or a count.
+    """
+
+    object_list: list = field(default_factory=list)
+    next_cursor: int | None = None
+    previous_cursor: int | None = None
+
+    @property
+    def has_next(self) -> bool:
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self) -> bool:
+        return self.previous_cursor is not None
+
+
+def get_cursor(request: HttpRequest, name: str) -> int | None:
+    try:
+        return int(request.GET[name])
+    except (KeyError, ValueError):
+        return None
+
+
+def get_keyset_page(
+    queryset: QuerySet, per_page: int, after: int | None = None, before: int | None = None
+) -> KeysetPage:
+    """
+    Fetch per_page objects after or before the cursor, and one more to find out
+    whether there is a next or previous page.
+    """
+    if before is not None:
+        rows = list(queryset.filter(pk__lt=before).order_by("-pk")[: per_page + 1])
+        object_list = rows[:per_page][::-1]
+        # an empty page before the first object links to the objects from the cursor on
+        next_cursor = object_list[-1].pk if len(object_list) > 0 else before - 1
+        previous_cursor = object_list[0].pk if len(rows) > per_page else None
+        return KeysetPage(object_list=object_list, next_cursor=next_cursor, previous_cursor=previous_cursor)
+
+    if after is not None:
+        queryset = queryset.filter(pk__gt=after)
+    rows = list(queryset.order_by("pk")[: per_page + 1])
+    object_list = rows[:per_page]
+    page = KeysetPage(object_list=object_list)
+    if len(rows) > per_page:
+        page.next_cursor = object_list[-1].pk
+    if after is not None:
+        page.previous_cursor = object_list[0].pk if len(object_list) > 0 else after + 1
+    return page
+
+
+def paginate(request: HttpRequest, queryset: QuerySet, per_page: int) -> KeysetPage:
+    """
+    Page of the queryset requested via the ?after= or ?before= cursors.
+    """
+    return get_keyset_page(
+        queryset, per_page, after=get_cursor(request, "after"), before=get_cursor(request, "before")
+    )
@@ -0,0 +1,165 @@
+import asyncio
+import json
+import logging
+from dataclasses import dataclass
+
+from django.conf import settings
+from websockets.asyncio.client import connect
+from websockets.exceptions import WebSocketException
+
+from .fastdeploy import RemoteDeployment, Step, StepRecords
+from .models import Deployment
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class StepsUpdate:
+    """
+    New steps of a deployment. Position is the index of the first new step
+    in the processed steps of the deployment.
+    """
+
+    position: int
+    steps: StepRecords
+    finished: bool
+
+
+def merge_step(remote: RemoteDeployment, step: Step) -> None:
+    steps = [s for s in remote.steps if s.id != step.id or step.id is None]
+    steps.append(step)
+    remote.steps = steps
+
+
+class DeploymentRelay:
+    """
+    Keep one websocket connection to fastdeploy per process and relay its
+    deployment events instead of polling the REST api.
+
+    After connecting, the access token is sent as the first message. Then
+    fastdeploy sends json events with a "type" of either "step" (a step of
+    the deployment "deployment_id") or "deployment" (the deployment "id"
+    itself changed, e.g. it has finished). New steps are stored as
+    DeploymentSteps and published to the local watchers of the
+    deployment.
+    """
+
+    def __init__(self, url: str, token: str | None = None, reconnect_delay: float = 1.0):
+        self.url = url
+        self.token = token
+        self.reconnect_delay = reconnect_delay
+        self.connected = False
+        self.watchers: dict[int, set[asyncio.Queue]] = {}
+        self._task: asyncio.Task | None = None
+
+    def subscribe(self, deployment_id: int) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue()
+        self.watchers.setdefault(deployment_id, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, deployment_id: int, queue: asyncio.Queue) -> None:
+        queues = self.watchers.get(deployment_id, set())
+        queues.discard(queue)
+        if len(queues) == 0:
+            self.watchers.pop(deployment_id, None)
+
+    def publish(self, deployment_id: int, update: StepsUpdate) -> None:
+        for queue in self.watchers.get(deployment_id, set()):
+            queue.put_nowait(update)
+
+    async def handle_event(self, event: dict) -> StepsUpdate | None:
+        event_type = event.get("type")
+        if event_type == "step":
+            remote_id = event.get("deployment_id")
+        elif event_type == "deployment":
+            remote_id = event.get("id")
+        else:
+            return None
+
+        deployment = await Deployment.objects.filter(remote_id=remote_id).afirst()
+        if deployment is None or deployment.remote is None:
+            return None
+        remote = deployment.remote.model_copy()
+        if event_type == "step":
+            merge_step(remote, Step.model_validate(event))
+        else:
+            remote.finished = RemoteDeployment.model_validate(event).finished
+        remote.no_steps_yet = False
+
+        position = deployment.steps_count
+        new_steps = await deployment.aapply_remote(remote)
+        update = StepsUpdate(position=position, steps=new_steps, finished=remote.has_finished)
+        self.publish(deployment.pk, update)
+        return update
+
+    async def listen(self) -> None:
+        async with connect(self.url) as websocket:
+            await websocket.send(json.dumps({"access_token": self.token}))
+            self.connected = True
+            try:
+                async for message in websocket:
+                    try:
+                        await self.handle_event(json.loads(message))
+                    except Exception:
+                        # drop the broken event, but keep relaying the others
+                        logger.exception("could not handle deployment event")
+            finally:
+                self.connected = False
+
+    async def run(self) -> None:
+        """
+        Listen for events and reconnect whenever the connection is lost.
+        """
+        while True:
+            try:
+                await self.listen()
+            except (OSError, WebSocketException, json.JSONDecodeError) as exc:
+                logger.warning(f"deployment websocket connection lost: {exc}")
+            await asyncio.sleep(self.reconnect_delay)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def wait_for_steps(
+        self, deployment: Deployment, queue: asyncio.Queue, timeout: float, cursor: int
+    ) -> StepRecords:
+        """
+        Return the next relayed steps after cursor. Reload the deployment from the
+        database if the update doesn't fit to the steps already seen or nothing
+        happened within timeout, because some steps might have been relayed before
+        subscribing.
+        """
+        try:
+            update = await asyncio.wait_for(queue.get(), timeout=timeout)
+        except asyncio.TimeoutError:
+            update = None
+        if update is None or update.finished or update.position > cursor:
+            await deployment.arefresh_from_db(fields=deployment.progress_fields)
+            return await deployment.aget_processed_steps(cursor)
+        deployment.steps_count = max(deployment.steps_count, update.position + len(update.steps))
+        skip = cursor - update.position
+        return update.steps[skip:]
+
+
+relay: DeploymentRelay | None = None
+
+
+def get_relay() -> DeploymentRelay | None:
+    """
+    Return the process wide relay if a websocket url for fastdeploy is configured.
+    """
+    global relay
+    if relay is None and settings.DEPLOY_WEBSOCKET_URL:
+        relay = DeploymentRelay(settings.DEPLOY_WEBSOCKET_URL, token=settings.DEPLOY_WEBSOCKET_TOKEN)
+    return relay
@@ -4,6 +4,17 @@ from .fastdeploy import RemoteDeployment, Step
 
 
 class RegistryJSONEncoder(DjangoJSONEncoder):
+    """
+    RemoteDeployments and Steps are encoded by pydantic's compiled serializer
+    directly, instead of being dumped to a dict which is then encoded again.
+    Models nested in other values still take the slower default path.
+    """
+
+    def encode(self, o):
+        if isinstance(o, (RemoteDeployment, Step)):
+            return o.model_dump_json()
+        return super().encode(o)
+
     def default(self, o):
         if isinstance(o, (RemoteDeployment, Step)):
             return o.model_dump()
@@ -0,0 +1,43 @@
+import asyncio
+
+from ..asgi import LifespanMiddleware
+from ..fastdeploy import get_http_client
+from ..relay import get_relay
+
+
+def run_lifespan(app):
+    messages = iter([{"type": "lifespan.startup"}, {"type": "lifespan.shutdown"}])
+    sent = []
+
+    async def receive():
+        return next(messages)
+
+    async def send(message):
+        sent.append(message["type"])
+
+    asyncio.run(app({"type": "lifespan"}, receive, send))
+    return sent
+
+
+def test_lifespan_shutdown_closes_http_clients():
+    http_client = get_http_client("http://fastdeploy/")
+    sent = run_lifespan(LifespanMiddleware(None))
+    assert sent == ["lifespan.startup.complete", "lifespan.shutdown.complete"]
+    assert http_client.is_closed
+
+
+def test_lifespan_starts_and_stops_relay(settings, monkeypatch):
+    monkeypatch.setattr("apps.registry.relay.relay", None)
+    settings.DEPLOY_WEBSOCKET_URL = "ws://localhost:1/deployments/ws"
+    run_lifespan(LifespanMiddleware(None))
+    assert get_relay()._task is None
+
+
+def test_lifespan_passes_http_to_app():
+    called = []
+
+    async def app(scope, receive, send):
+        called.append(scope["type"])
+
+    asyncio.run(LifespanMiddleware(app)({"type": "http"}, None, None))
+    assert called == ["http"]
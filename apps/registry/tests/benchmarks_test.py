@@ -0,0 +1,63 @@
+import pytest
+from django.core.management import CommandError, call_command
+
+from ..benchmarks import (
+    BENCHMARKS,
+    BenchmarkResult,
+    format_memory_results,
+    format_results,
+    get_regressions,
+    load_baseline,
+    make_remote_deployment,
+    run_benchmarks,
+    run_memory_benchmarks,
+    save_baseline,
+)
+
+
+def test_make_remote_deployment():
+    remote = make_remote_deployment(20)
+    assert [s.id for s in remote.steps] == list(range(1, 21))
+    assert remote.steps[9].started is None
+    assert remote.has_finished
+
+
+@pytest.mark.parametrize("name", BENCHMARKS)
+def test_benchmarks_run(name):
+    BENCHMARKS[name](10)()  # smoke test the benchmarked function
+    [result] = run_benchmarks([name], sizes=[10], repeat=1, min_time=0.0)
+    assert result.key == f"{name}[10]"
+    assert result.seconds > 0
+
+
+def test_memory_benchmarks(capsys):
+    results = {result.name: result for result in run_memory_benchmarks(sizes=[100])}
+    assert results["step_records"].bytes < results["steps"].bytes
+    assert "step_records[100]" in format_memory_results(list(results.values()))
+
+    call_command("benchmark", memory=True, sizes=[10])
+    assert "steps[10]" in capsys.readouterr().out
+
+
+def test_baseline_round_trip_and_regressions(tmp_path):
+    path = tmp_path / "benchmarks" / "baseline.json"
+    save_baseline(path, [BenchmarkResult("sort", 10, 1.0), BenchmarkResult("parse", 10, 1.0)])
+    baseline = load_baseline(path)
+    assert baseline["sort[10]"] == BenchmarkResult("sort", 10, 1.0)
+
+    results = [BenchmarkResult("sort", 10, 1.2), BenchmarkResult("parse", 10, 1.3), BenchmarkResult("encode", 10, 9.0)]
+    assert get_regressions(results, baseline, threshold=1.25) == [(results[1], baseline["parse[10]"])]
+    assert "1.30" in format_results(results, baseline)
+
+
+def test_benchmark_command(tmp_path, capsys):
+    path = tmp_path / "baseline.json"
+    options = {"sizes": [10], "repeat": 1, "min_time": 0.0, "baseline": path}
+    call_command("benchmark", "sort", save=True, **options)
+    assert load_baseline(path).keys() == {"sort[10]"}
+
+    call_command("benchmark", "sort", threshold=1e9, **options)
+    with pytest.raises(CommandError):
+        call_command("benchmark", "sort", threshold=0.0, **options)
+    with pytest.raises(CommandError):
+        call_command("benchmark", "unknown", **options)
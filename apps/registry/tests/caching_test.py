@@ -0,0 +1,71 @@
+import pytest
+from asgiref.sync import async_to_sync
+from django.core.cache import cache
+
+from ..caching import (
+    aget_domain_owner_id,
+    aget_poll_state,
+    get_domain_owner_id,
+    get_poll_state,
+    get_steps_fragment_key,
+)
+from ..fastdeploy import RemoteDeployment, Step
+from ..models import Deployment
+
+
+@pytest.mark.django_db
+def test_get_domain_owner_id_is_cached(domain, django_assert_num_queries):
+    with django_assert_num_queries(1):
+        assert get_domain_owner_id(domain.pk) == domain.owner_id
+        assert get_domain_owner_id(domain.pk) == domain.owner_id
+    with django_assert_num_queries(0):
+        assert async_to_sync(aget_domain_owner_id)(domain.pk) == domain.owner_id
+
+
+@pytest.mark.django_db
+def test_get_domain_owner_id_unknown_domain():
+    assert get_domain_owner_id(0) is None
+
+
+@pytest.mark.django_db
+def test_domain_owner_invalidated_on_save_and_delete(domain, other_user):
+    get_domain_owner_id(domain.pk)
+    domain.owner = other_user
+    domain.save()
+    assert get_domain_owner_id(domain.pk) == other_user.pk
+
+    domain_id = domain.pk
+    domain.delete()
+    assert get_domain_owner_id(domain_id) is None
+
+
+@pytest.mark.django_db
+def test_new_deployment_does_not_inherit_steps_fragment(domain):
+    cache.set(get_steps_fragment_key(1_000), (1, "<aside>former</aside>"))
+    Deployment.objects.create(pk=1_000, domain=domain)
+    assert cache.get(get_steps_fragment_key(1_000)) is None
+
+
+@pytest.mark.django_db
+def test_get_poll_state_is_cached(deployment, django_assert_num_queries):
+    with django_assert_num_queries(1):
+        state = get_poll_state(deployment.pk)
+        assert (state.pk, state.domain_id, state.steps_count) == (deployment.pk, deployment.domain_id, 0)
+        assert get_poll_state(deployment.pk).steps_count == 0
+    with django_assert_num_queries(0):
+        assert async_to_sync(aget_poll_state)(deployment.pk).domain_id == deployment.domain_id
+    assert get_poll_state(0) is None
+
+
+@pytest.mark.django_db
+def test_poll_state_invalidated_on_progress_save_and_delete(deployment):
+    deployment.data = RemoteDeployment(id=1)
+    deployment.save()
+    assert get_poll_state(deployment.pk).state == Deployment.State.RUNNING
+
+    deployment.apply_remote(RemoteDeployment(id=1, steps=[Step(id=1, name="new")]))
+    assert get_poll_state(deployment.pk).steps_count == 1
+
+    deployment_id = deployment.pk
+    deployment.delete()
+    assert get_poll_state(deployment_id) is None
@@ -1,11 +1,25 @@
 from datetime import datetime
 
 import pytest
+from django.core.cache import cache
 
-from ..fastdeploy import RemoteDeployment, Step
+from ..fastdeploy import RemoteDeployment, Step, coalescing_client
 from ..models import Deployment, Domain
 
 
+@pytest.fixture(autouse=True)
+def clear_cache():
+    """
+    Cached fragments and coalesced fetches are keyed by primary key, which may
+    be reused between tests.
+    """
+    cache.clear()
+    coalescing_client.clear()
+    yield
+    cache.clear()
+    coalescing_client.clear()
+
+
 @pytest.fixture
 def user(django_user_model):
     username, password = "user1", "password"
@@ -14,6 +28,14 @@ def user(django_user_model):
     return user
 
 
+@pytest.fixture
+def other_user(django_user_model):
+    username, password = "user2", "password"
+    user = django_user_model.objects.create_user(username=username, password=password)
+    user._password = password
+    return user
+
+
 @pytest.fixture
 def domain(user):
     model = Domain.objects.create(fqdn="foo.staging.django-cast.com", owner=user)
@@ -1,10 +1,28 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta
 
 import httpx
 import pytest
 from django.utils import timezone
 
-from ..fastdeploy import ProductionClient, RemoteDeployment, SpecialSteps, Step
+from ..fastdeploy import (
+    AbstractClient,
+    AsyncClient,
+    CoalescingClient,
+    ProductionClient,
+    RemoteDeployment,
+    SpecialSteps,
+    Step,
+    StepRecord,
+    aclose_http_clients,
+    advance_steps_cursor,
+    close_http_clients,
+    get_async_http_client,
+    get_http_client,
+)
+from ..metrics import RequestTimings, current_timings
 
 NEW = Step(id=2, name="new")
 NOT_NEW = Step(id=2, name="not new")
@@ -31,6 +49,34 @@ def test_get_new_step(deployment, seen, expected):
     assert deployment.get_new_steps(seen) == expected
 
 
+def test_get_steps_after_cursor():
+    now = timezone.now()
+    steps = [Step(id=i, name=str(i), started=now + timedelta(seconds=i)) for i in (3, 1, 2)]
+    deployment = RemoteDeployment(steps=steps, finished=timezone.now())
+    assert deployment.last_step_id == 3
+    assert [s.id for s in deployment.get_steps_after(None)] == [0, 3, 2, 1, -1]
+    assert [s.id for s in deployment.get_steps_after(1)] == [3, 2, -1]
+    assert deployment.get_steps_after(3, finished_seen=True) == []
+
+
+def test_last_step_id():
+    assert RemoteDeployment(no_steps_yet=True).last_step_id is None
+    assert RemoteDeployment().last_step_id == SpecialSteps.START.value.id
+
+
+def test_advance_steps_cursor():
+    assert advance_steps_cursor(None, []) is None
+    assert advance_steps_cursor(None, [SpecialSteps.START.value]) == 0
+    assert advance_steps_cursor(2, [Step(id=4, name="four"), SpecialSteps.END.value]) == 4
+
+
+def test_step_record_round_trip():
+    step = Step(id=1, name="one", started=timezone.now(), state="".join(["run", "ning"]), message="msg")
+    record = StepRecord.from_step(step)
+    assert record.to_step() == step
+    assert record.state is StepRecord.from_step(Step(name="two", state="".join(["runn", "ing"]))).state
+
+
 def test_sort_steps():
     start_none = Step(name="start_none", started=None)
     start_now = Step(name="start_none", started=timezone.now())
@@ -56,18 +102,19 @@ class Response:
 
 
 class OkHttpxClient(httpx.Client):
-    def get(self, path):
+    def get(self, path, params=None, headers=None):
+        self.last_params = params
         return Response(200)
 
-    def post(self, path, json={}):
+    def post(self, path, json={}, headers=None):
         return Response(200)
 
 
 class BrokenHttpxClient(httpx.Client):
-    def get(self, path):
+    def get(self, path, params=None, headers=None):
         return Response(401)
 
-    def post(self, path, json={}):
+    def post(self, path, json={}, headers=None):
         return Response(401, json={"detail": "Could not validate credentials"})
 
 
@@ -77,9 +124,11 @@ class Remote:
 
 
 class Deployment:
-    def __init__(self, deployment_id):
+    def __init__(self, deployment_id, steps_cursor=None, service_token="asdf"):
+        self.pk = deployment_id
         self.remote = Remote(deployment_id)
-        self.service_token = "asdf"
+        self.service_token = service_token
+        self.steps_cursor = steps_cursor
 
 
 class Domain:
@@ -89,37 +138,323 @@ class Domain:
 
 def test_production_client_fetch_deployment_broken():
     """Response status is not ok"""
-    client = ProductionClient()
+    client = ProductionClient(http_client=BrokenHttpxClient())
     deployment = Deployment(1)
-    fetched_deployment = client.fetch_deployment(deployment, client=BrokenHttpxClient)
+    fetched_deployment = client.fetch_deployment(deployment)
     assert isinstance(fetched_deployment, Remote)
 
 
 def test_production_client_fetch_deployment_ok():
     """Response status is ok"""
-    client = ProductionClient()
+    client = ProductionClient(http_client=OkHttpxClient())
     deployment = Deployment(1)
-    fetched_deployment = client.fetch_deployment(deployment, client=OkHttpxClient)
+    fetched_deployment = client.fetch_deployment(deployment)
     assert isinstance(fetched_deployment, RemoteDeployment)
 
 
+def test_production_client_fetch_deployment_steps_after_cursor():
+    http_client = OkHttpxClient()
+    client = ProductionClient(http_client=http_client)
+    client.fetch_deployment(Deployment(1))
+    assert http_client.last_params == {}
+
+    client.fetch_deployment(Deployment(1, steps_cursor=3))
+    assert http_client.last_params == {"steps_after": 3}
+
+
 def test_production_client_start_deployment_unauthorized():
-    client = ProductionClient()
+    client = ProductionClient(http_client=BrokenHttpxClient())
     deployment = Deployment(1)
     deployment.domain = Domain()
     with pytest.raises(Exception):
-        client.start_deployment(deployment, client=BrokenHttpxClient)
+        client.start_deployment(deployment)
 
 
 def test_production_client_start_deployment():
     """Start deployment test, mainly for coverage"""
-    client = ProductionClient()
+    client = ProductionClient(http_client=OkHttpxClient())
     deployment = Deployment(1)
     deployment.domain = Domain()
-    started_deployment = client.start_deployment(deployment, client=OkHttpxClient)
+    started_deployment = client.start_deployment(deployment)
     assert isinstance(started_deployment, RemoteDeployment)
 
 
+def test_production_client_sends_service_token():
+    """Service token is sent per request, the pooled client is shared"""
+    seen_headers = []
+
+    def handler(request):
+        seen_headers.append(request.headers["authorization"])
+        return httpx.Response(200, json={"id": 1})
+
+    http_client = httpx.Client(base_url="http://fastdeploy/", transport=httpx.MockTransport(handler))
+    client = ProductionClient(http_client=http_client, headers={"x-foo": "bar"})
+    deployment = Deployment(1)
+    fetched_deployment = client.fetch_deployment(deployment)
+    assert fetched_deployment.id == 1
+    assert seen_headers == ["Bearer asdf"]
+
+
+def test_pooled_http_client_is_reused(settings):
+    settings.DEPLOY_HTTP_MAX_CONNECTIONS = 7
+    close_http_clients()
+    http_client = get_http_client("http://fastdeploy/")
+    assert get_http_client("http://fastdeploy/") is http_client
+    assert get_http_client("http://other/") is not http_client
+    assert ProductionClient(base_url="http://fastdeploy/").http_client is http_client
+    assert http_client._transport._pool._max_connections == 7
+
+    close_http_clients()
+    assert http_client.is_closed
+    assert get_http_client("http://fastdeploy/") is not http_client
+    close_http_clients()
+
+
+def test_async_client_fetch_deployment():
+    def handler(request):
+        assert request.headers["authorization"] == "Bearer asdf"
+        return httpx.Response(200, json={"id": 1, "steps": [{"id": 1, "name": "first"}]})
+
+    async def fetch():
+        async_http_client = httpx.AsyncClient(base_url="http://fastdeploy/", transport=httpx.MockTransport(handler))
+        client = AsyncClient(async_http_client=async_http_client)
+        return await client.afetch_deployment(Deployment(1))
+
+    fetched_deployment = asyncio.run(fetch())
+    assert fetched_deployment.id == 1
+    assert fetched_deployment.steps[0].name == "first"
+
+
+def test_async_client_start_deployment_unauthorized():
+    def handler(request):
+        return httpx.Response(401, json={"detail": "Could not validate credentials"})
+
+    async def start():
+        async_http_client = httpx.AsyncClient(base_url="http://fastdeploy/", transport=httpx.MockTransport(handler))
+        client = AsyncClient(async_http_client=async_http_client)
+        deployment = Deployment(1)
+        deployment.domain = Domain()
+        return await client.astart_deployment(deployment)
+
+    with pytest.raises(httpx.HTTPStatusError):
+        asyncio.run(start())
+
+
+def test_pooled_async_http_client_per_event_loop():
+    async def get_and_close():
+        http_client = get_async_http_client("http://fastdeploy/")
+        assert get_async_http_client("http://fastdeploy/") is http_client
+        assert AsyncClient(base_url="http://fastdeploy/").async_http_client is http_client
+        await aclose_http_clients()
+        assert http_client.is_closed
+        return http_client
+
+    assert asyncio.run(get_and_close()) is not asyncio.run(get_and_close())
+
+
+def test_sync_client_async_fallback():
+    """Clients without native async support are run in a thread"""
+    client = ProductionClient(http_client=OkHttpxClient())
+    fetched_deployment = asyncio.run(client.afetch_deployment(Deployment(1)))
+    assert isinstance(fetched_deployment, RemoteDeployment)
+
+
+class CountingClient(AbstractClient):
+    def __init__(self, release=None):
+        self.fetches = 0
+        self.release = release
+
+    def start_deployment(self, deployment):
+        return RemoteDeployment(id=deployment.pk, no_steps_yet=True)
+
+    def fetch_deployment(self, deployment):
+        self.fetches += 1
+        if self.release is not None:
+            self.release.wait(timeout=5)
+        return RemoteDeployment(id=deployment.pk, steps=[Step(id=self.fetches, name="step")])
+
+    async def afetch_deployment(self, deployment):
+        self.fetches += 1
+        await asyncio.sleep(0.01)
+        return RemoteDeployment(id=deployment.pk)
+
+
+class PkDeployment:
+    def __init__(self, pk, steps_cursor=None):
+        self.pk = pk
+        self.steps_cursor = steps_cursor
+        self.remote = None
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def fastdeploy_handler(requests):
+    """Return deployments by id, deployment 2 is broken"""
+
+    def handler(request):
+        requests.append(request)
+        if request.url.path == "/deployments/bulk":
+            ids = [int(i) for i in request.url.params["ids"].split(",")]
+            return httpx.Response(200, json=[{"id": i} for i in ids if i != 2])
+        deployment_id = int(request.url.path.split("/")[-1])
+        if deployment_id == 2:
+            raise httpx.ConnectError("fastdeploy is down")
+        return httpx.Response(200, json={"id": deployment_id})
+
+    return handler
+
+
+def test_production_client_fetch_deployments_concurrently():
+    requests: list[httpx.Request] = []
+    transport = httpx.MockTransport(fastdeploy_handler(requests))
+    client = ProductionClient(http_client=httpx.Client(base_url="http://fastdeploy/", transport=transport))
+    deployments = [Deployment(i) for i in (3, 2, 1)]
+    fetched = client.fetch_deployments(deployments, concurrency=2)
+    assert [f.id for f in fetched] == [3, 2, 1]
+    assert isinstance(fetched[0], RemoteDeployment)
+    assert fetched[1] is deployments[1].remote  # failed fetch returns the stored version
+    assert len(requests) == 3
+    assert client.fetch_deployments([]) == []
+
+
+def test_production_client_fetch_deployments_bulk(settings):
+    """One bulk request per service token"""
+    settings.DEPLOY_BULK_FETCH_PATH = "deployments/bulk"
+    requests: list[httpx.Request] = []
+    transport = httpx.MockTransport(fastdeploy_handler(requests))
+    client = ProductionClient(http_client=httpx.Client(base_url="http://fastdeploy/", transport=transport))
+    deployments = [Deployment(1), Deployment(2), Deployment(3, service_token="other")]
+    fetched = client.fetch_deployments(deployments)
+    assert [f.id for f in fetched] == [1, 2, 3]
+    assert fetched[1] is deployments[1].remote  # missing in the bulk response
+    assert [(r.url.params["ids"], r.headers["authorization"]) for r in requests] == [
+        ("1,2", "Bearer asdf"),
+        ("3", "Bearer other"),
+    ]
+
+
+def test_async_client_fetch_deployments(settings):
+    requests: list[httpx.Request] = []
+
+    async def fetch():
+        transport = httpx.MockTransport(fastdeploy_handler(requests))
+        client = AsyncClient(async_http_client=httpx.AsyncClient(base_url="http://fastdeploy/", transport=transport))
+        deployments = [Deployment(1), Deployment(2)]
+        return await client.afetch_deployments(deployments), deployments
+
+    fetched, deployments = asyncio.run(fetch())
+    assert fetched[0].id == 1 and fetched[1] is deployments[1].remote
+    assert len(requests) == 2
+
+    settings.DEPLOY_BULK_FETCH_PATH = "deployments/bulk"
+    fetched, deployments = asyncio.run(fetch())
+    assert fetched[0].id == 1 and fetched[1] is deployments[1].remote
+    assert len(requests) == 3
+
+
+def test_coalescing_client_reuses_result_within_ttl():
+    clock = Clock()
+    client = CountingClient()
+    coalescing = CoalescingClient(client, ttl=1.0, clock=clock)
+    first = coalescing.fetch_deployment(PkDeployment(1))
+    assert coalescing.fetch_deployment(PkDeployment(1)) == first
+    coalescing.fetch_deployment(PkDeployment(2))
+    assert client.fetches == 2
+
+    clock.now = 1.0  # cached result expired
+    assert coalescing.fetch_deployment(PkDeployment(1)) != first
+    assert client.fetches == 3
+
+
+def test_coalescing_client_clear():
+    client = CountingClient()
+    coalescing = CoalescingClient(client, ttl=1.0, clock=Clock())
+    coalescing.fetch_deployment(PkDeployment(1))
+    coalescing.clear()
+    coalescing.fetch_deployment(PkDeployment(1))
+    assert client.fetches == 2
+
+
+def test_coalescing_client_keys_by_steps_cursor():
+    """Results only containing steps after a cursor can't be shared with other cursors"""
+    client = CountingClient()
+    coalescing = CoalescingClient(client, ttl=1.0, clock=Clock())
+    coalescing.fetch_deployment(PkDeployment(1, steps_cursor=1))
+    coalescing.fetch_deployment(PkDeployment(1, steps_cursor=2))
+    assert client.fetches == 2
+
+
+def test_coalescing_client_shares_in_flight_fetch():
+    """Only one of the concurrent threads fetches, the others wait for its result"""
+    release = threading.Event()
+    client = CountingClient(release=release)
+    coalescing = CoalescingClient(client, ttl=0)
+    with ThreadPoolExecutor(max_workers=5) as executor:
+        futures = [executor.submit(coalescing.fetch_deployment, PkDeployment(1)) for _ in range(5)]
+        while not coalescing._in_flight:
+            pass
+        release.set()
+        results = [f.result() for f in futures]
+    assert client.fetches == 1
+    assert all(result == results[0] for result in results)
+    assert coalescing._results == {}  # ttl=0 only shares in-flight requests
+
+
+def test_coalescing_client_propagates_errors():
+    class BrokenClient(CountingClient):
+        def fetch_deployment(self, deployment):
+            raise httpx.ConnectError("down")
+
+    coalescing = CoalescingClient(BrokenClient(), ttl=1.0)
+    with pytest.raises(httpx.ConnectError):
+        coalescing.fetch_deployment(PkDeployment(1))
+    assert coalescing._in_flight == {}
+
+
+def test_coalescing_client_async_shares_in_flight_fetch():
+    client = CountingClient()
+    coalescing = CoalescingClient(client, ttl=1.0)
+
+    async def fetch_concurrently():
+        return await asyncio.gather(*[coalescing.afetch_deployment(PkDeployment(1)) for _ in range(10)])
+
+    results = asyncio.run(fetch_concurrently())
+    assert len(results) == 10
+    assert client.fetches == 1
+
+    # result is cached for the next poll
+    asyncio.run(coalescing.afetch_deployment(PkDeployment(1)))
+    assert client.fetches == 1
+
+
+def test_coalescing_client_fetch_deployments_batch():
+    """Cached deployments are not fetched again, the others in one batch"""
+    client = CountingClient()
+    coalescing = CoalescingClient(client, ttl=1.0, clock=Clock())
+    first = coalescing.fetch_deployment(PkDeployment(1))
+    fetched = coalescing.fetch_deployments([PkDeployment(1), PkDeployment(2), PkDeployment(3)])
+    assert fetched[0] == first
+    assert client.fetches == 3
+    assert coalescing.fetch_deployments([PkDeployment(2), PkDeployment(3)]) == fetched[1:]
+    assert client.fetches == 3
+
+    fetched = asyncio.run(coalescing.afetch_deployments([PkDeployment(3), PkDeployment(4)]))
+    assert [f.id for f in fetched] == [3, 4]
+    assert client.fetches == 4
+
+
+def test_coalescing_client_does_not_coalesce_start():
+    coalescing = CoalescingClient(CountingClient())
+    assert coalescing.start_deployment(PkDeployment(1)).no_steps_yet
+    assert asyncio.run(coalescing.astart_deployment(PkDeployment(1))).no_steps_yet
+
+
 def test_getting_production_client(settings):
     from apps.registry.fastdeploy import ProductionClient, TestClient
 
@@ -131,3 +466,42 @@ def test_getting_production_client(settings):
     from apps.registry.fastdeploy import Client
 
     assert isinstance(Client, type(ProductionClient))
+
+
+def test_production_client_fetch_deployments_records_upstream_time():
+    """Fetches running in the thread pool add to the timings of the current request"""
+    transport = httpx.MockTransport(fastdeploy_handler([]))
+    client = ProductionClient(http_client=httpx.Client(base_url="http://fastdeploy/", transport=transport))
+    timings = RequestTimings()
+    token = current_timings.set(timings)
+    try:
+        client.fetch_deployments([Deployment(1), Deployment(3)], concurrency=2)
+    finally:
+        current_timings.reset(token)
+    assert timings.upstream > 0
+
+
+class ThreadCheckingDeployment(Deployment):
+    """Remembers the threads reading the service token, which may load the domain"""
+
+    def __init__(self, deployment_id):
+        super().__init__(deployment_id)
+        self.token_threads = set()
+
+    @property
+    def service_token(self):
+        self.token_threads.add(threading.get_ident())
+        return "asdf"
+
+    @service_token.setter
+    def service_token(self, value):
+        pass
+
+
+def test_production_client_fetch_deployments_resolves_tokens_on_calling_thread():
+    transport = httpx.MockTransport(fastdeploy_handler([]))
+    client = ProductionClient(http_client=httpx.Client(base_url="http://fastdeploy/", transport=transport))
+    deployments = [ThreadCheckingDeployment(i) for i in (1, 2, 3)]
+    fetched = client.fetch_deployments(deployments, concurrency=3)
+    assert [f.id for f in fetched] == [1, 2, 3]
+    assert {thread for d in deployments for thread in d.token_threads} == {threading.get_ident()}
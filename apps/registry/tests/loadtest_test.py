@@ -0,0 +1,100 @@
+import asyncio
+
+import httpx
+import pytest
+from django.contrib.auth import get_user_model
+from django.core.management import CommandError, call_command
+
+from ..fastdeploy import ProductionClient
+from ..loadtest import (
+    EndpointStats,
+    FastdeployStandIn,
+    LoadTestConfig,
+    LoadTestResult,
+    create_watched_deployments,
+    delete_watched_deployments,
+    format_report,
+    percentile,
+    run_watchers,
+)
+from ..models import Deployment
+
+
+@pytest.fixture
+def stand_in():
+    stand_in = FastdeployStandIn(steps=2)
+    stand_in.start()
+    yield stand_in
+    stand_in.stop()
+
+
+def test_percentile():
+    values = [0.1 * i for i in range(1, 101)]
+    assert percentile(values, 50) == pytest.approx(5.0)
+    assert percentile(values, 99) == pytest.approx(9.9)
+    assert percentile([], 99) == 0.0
+
+
+@pytest.mark.django_db
+def test_stand_in_plays_step_sequence(stand_in, deployment):
+    client = ProductionClient(http_client=httpx.Client(base_url=stand_in.base_url))
+    deployment.start(client=client)
+    assert deployment.remote.no_steps_yet
+    names = []
+    for _ in range(4):
+        remote = client.fetch_deployment(deployment)
+        assert remote.id == deployment.remote.id
+        names.extend(step.name for step in remote.steps)
+        if remote.has_finished:
+            break
+    assert names == ["step 1", "step 2"]
+    assert remote.has_finished
+    assert client.fetch_deployment(deployment).has_finished  # finished state is repeated
+
+
+def test_stand_in_bulk_fetch(stand_in):
+    r = httpx.get(f"{stand_in.base_url}deployments/bulk", params={"ids": "7,8"})
+    assert [d["id"] for d in r.json()] == [7, 8]
+
+
+def test_format_report():
+    config = LoadTestConfig(watchers=2, latency=0.05)
+    endpoints = {"deploy_state": EndpointStats(latencies=[0.01, 0.02, 0.03], errors=1)}
+    report = format_report([LoadTestResult(config=config, elapsed=2.0, endpoints=endpoints, finished_watchers=1)])
+    assert "2 watchers, 50ms fastdeploy latency, deploy_state (1/2 finished)" in report
+    assert "deploy_state" in report.splitlines()[-1]
+    assert "25.0%" in report  # error rate
+    assert "     2.0 " in report  # 4 requests in 2 seconds
+
+
+@pytest.mark.django_db(transaction=True)
+def test_run_watchers_against_registry(settings, live_server, stand_in):
+    settings.DEPLOY_STEPS_WORKER = True  # the registry under test reads steps from the database only
+    client = ProductionClient(http_client=httpx.Client(base_url=stand_in.base_url))
+    session_id, domain, deployments = create_watched_deployments(2, client)
+    config = LoadTestConfig(watchers=3, latency=0.0, duration=0.5, poll_interval=0.1)
+
+    result = asyncio.run(run_watchers(config, live_server.url, session_id, domain, deployments))
+
+    assert result.endpoints["domain_deployments"].requests == 3
+    assert result.endpoints["deploy_state"].requests > 3
+    assert all(stats.errors == 0 for stats in result.endpoints.values())
+    delete_watched_deployments(domain)
+    assert not Deployment.objects.filter(pk__in=[d.pk for d in deployments]).exists()
+
+
+@pytest.mark.django_db
+def test_watched_deployments_only_delete_their_own_user(user, deployment, stand_in):
+    client = ProductionClient(http_client=httpx.Client(base_url=stand_in.base_url))
+    _, first, _ = create_watched_deployments(1, client)
+    _, second, _ = create_watched_deployments(1, client)
+    assert first.owner != second.owner
+
+    delete_watched_deployments(first)
+    assert set(get_user_model().objects.all()) == {user, second.owner}
+    assert Deployment.objects.filter(pk=deployment.pk).exists()
+
+
+def test_loadtest_command_needs_loadtest_settings():
+    with pytest.raises(CommandError, match="config.settings.loadtest"):
+        call_command("loadtest")
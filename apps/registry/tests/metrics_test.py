@@ -0,0 +1,65 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from ..metrics import (
+    REQUEST_QUERIES,
+    UPSTREAM_DURATION,
+    Histogram,
+    RequestTimings,
+    current_timings,
+    expose,
+    time_upstream,
+)
+
+
+def test_histogram_expose():
+    histogram = Histogram("test_seconds", "Test.", "view", buckets=(0.1, 1.0))
+    histogram.observe("home", 0.05)
+    histogram.observe("home", 0.5)
+    histogram.observe("home", 5.0)
+    assert histogram.expose() == [
+        "# HELP test_seconds Test.",
+        "# TYPE test_seconds histogram",
+        'test_seconds_bucket{view="home",le="0.1"} 1',
+        'test_seconds_bucket{view="home",le="1.0"} 2',
+        'test_seconds_bucket{view="home",le="+Inf"} 3',
+        'test_seconds_sum{view="home"} 5.55',
+        'test_seconds_count{view="home"} 3',
+    ]
+
+
+def test_server_timing():
+    timings = RequestTimings(queries=3, db=0.0123, upstream=0.1, render=0.002)
+    assert timings.get_server_timing(0.2) == (
+        'db;dur=12.3;desc="3 queries", upstream;dur=100.0, render;dur=2.0, total;dur=200.0'
+    )
+
+
+def test_time_upstream_adds_to_current_request():
+    timings = RequestTimings()
+    token = current_timings.set(timings)
+    try:
+        with time_upstream("test_call"):
+            pass
+    finally:
+        current_timings.reset(token)
+    assert timings.upstream > 0
+    assert 'registry_upstream_duration_seconds_count{call="test_call"} 1' in UPSTREAM_DURATION.expose()
+
+
+def test_request_timings_add_upstream_from_threads():
+    timings = RequestTimings()
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        list(executor.map(lambda _: timings.add_upstream(0.5), range(1_000)))
+    assert timings.upstream == 500
+
+    with time_upstream("test_call"):  # outside of a request
+        pass
+    assert 'registry_upstream_duration_seconds_count{call="test_call"} 2' in UPSTREAM_DURATION.expose()
+
+
+def test_expose_contains_all_histograms():
+    REQUEST_QUERIES.observe("test_view", 3)
+    text = expose()
+    assert text.endswith("\n")
+    assert "# TYPE registry_request_duration_seconds histogram" in text
+    assert 'registry_request_queries_bucket{view="test_view",le="5"} 1' in text
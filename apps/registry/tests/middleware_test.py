@@ -0,0 +1,42 @@
+import re
+
+import pytest
+from asgiref.sync import async_to_sync
+from django.urls import reverse
+
+from ..metrics import REQUEST_DURATION, REQUEST_QUERIES, REQUEST_RENDER
+
+
+def get_queries(response) -> int:
+    return int(re.search(r'db;dur=[\d.]+;desc="(\d+) queries"', response["Server-Timing"]).group(1))
+
+
+@pytest.fixture(autouse=True)
+def server_timing(settings):
+    settings.REGISTRY_SERVER_TIMING = True
+
+
+@pytest.mark.django_db
+def test_server_timing_header(client, user):
+    client.force_login(user)
+    r = client.get(reverse("domains"))
+    assert get_queries(r) == 3
+    assert re.search(r"upstream;dur=[\d.]+, render;dur=[\d.]+, total;dur=[\d.]+$", r["Server-Timing"])
+    assert 'registry_request_queries_count{view="domains"}' in "\n".join(REQUEST_QUERIES.expose())
+    assert 'registry_request_render_seconds_count{view="domains"}' in "\n".join(REQUEST_RENDER.expose())
+
+
+@pytest.mark.django_db
+def test_server_timing_header_async_view(settings, async_client, user, deployment):
+    settings.DEPLOY_STEPS_WORKER = True
+    async_client.force_login(user)
+    r = async_to_sync(async_client.get)(reverse("adeploy_state", kwargs={"deployment_id": deployment.pk}))
+    assert get_queries(r) > 0  # queries run in a thread are recorded, too
+
+
+@pytest.mark.django_db
+def test_server_timing_header_disabled(settings, client):
+    settings.REGISTRY_SERVER_TIMING = False
+    r = client.get(reverse("home"))
+    assert "Server-Timing" not in r
+    assert 'registry_request_duration_seconds_count{view="home"}' in "\n".join(REQUEST_DURATION.expose())
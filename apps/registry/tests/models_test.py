@@ -1,8 +1,25 @@
+import secrets
+from datetime import datetime, timedelta, timezone
+from importlib import import_module
+from unittest.mock import patch
+
 import pytest
+from asgiref.sync import async_to_sync
+from django.apps import apps as django_apps
 from django.conf import settings
-
-from ..fastdeploy import RemoteDeployment, SpecialSteps
-from ..models import Deployment, Domain
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test.utils import CaptureQueriesContext
+
+from ..fastdeploy import RemoteDeployment, SpecialSteps, Step, StepRecord
+from ..models import (
+    SECRET_ALPHABET,
+    Deployment,
+    Domain,
+    afetch_new_steps,
+    create_secrets,
+    fetch_new_steps,
+)
 
 # Tests for Domain model
 
@@ -17,6 +34,31 @@ def test_domain_get_service_token():
     assert domain.service_tokens == {}
 
 
+def test_create_secrets():
+    new_secrets = create_secrets(3, length=20)
+    assert [len(secret) for secret in new_secrets] == [20, 20, 20]
+    assert set("".join(new_secrets)) <= set(SECRET_ALPHABET)
+    assert len(set(new_secrets)) == 3
+
+
+def test_create_secrets_rejects_biased_bytes():
+    """Bytes which would make the first characters more likely are dropped, missing ones drawn again"""
+    draws = [bytes([0, 61, 62, 247, 248, 255] * 4), bytes(range(48))]
+    with patch("apps.registry.models.secrets.token_bytes", side_effect=draws) as token_bytes:
+        [secret] = create_secrets(1, length=32)
+    assert secret == ("a9a9" * 4) + SECRET_ALPHABET[:16]
+    assert token_bytes.call_count == 2
+
+
+@pytest.mark.parametrize("backend", [Domain.Backend.CAST, Domain.Backend.WORDPRESS, "foo"])
+def test_domain_context_draws_secrets_once(backend):
+    domain = Domain(pk=1, backend=backend, fqdn="example.com")
+    with patch("apps.registry.models.secrets.token_bytes", wraps=secrets.token_bytes) as token_bytes:
+        context = domain.context
+    assert token_bytes.call_count == 1
+    assert len({value for value in context.values() if len(value) == 32}) == domain.secrets_count
+
+
 # Tests for Deployment model
 
 
@@ -30,6 +72,9 @@ class StubClient:
     def fetch_deployment(self, _):
         return self.deployment
 
+    async def afetch_deployment(self, _):
+        return self.deployment
+
 
 @pytest.mark.django_db
 def test_deployment_remote_serialization(domain, remote_deployment):
@@ -68,7 +113,7 @@ def test_deployment_get_new_steps(domain):
     remote_deployment.no_steps_yet = False
     client = StubClient(remote_deployment)
     new_steps = deployment.get_new_steps(client=client)
-    assert new_steps == [SpecialSteps.START.value]
+    assert new_steps == [StepRecord.from_step(SpecialSteps.START.value)]
     assert not deployment.remote.has_finished
 
     # start step is already seen
@@ -77,6 +122,61 @@ def test_deployment_get_new_steps(domain):
     assert new_steps == []
 
 
+@pytest.mark.django_db
+def test_deployment_aget_new_steps(domain):
+    remote_deployment = RemoteDeployment(id=1, no_steps_yet=True)
+    deployment = Deployment.objects.create(domain=domain, data=remote_deployment)
+    deployment.refresh_from_db()
+    remote_deployment.no_steps_yet = False
+    client = StubClient(remote_deployment)
+    new_steps = async_to_sync(deployment.aget_new_steps)(client=client)
+    assert new_steps == [StepRecord.from_step(SpecialSteps.START.value)]
+
+    # start step is already seen
+    deployment.refresh_from_db()
+    assert deployment.processed_steps == [StepRecord.from_step(SpecialSteps.START.value)]
+    new_steps = async_to_sync(deployment.aget_new_steps)(client=client)
+    assert new_steps == []
+
+
+@pytest.mark.django_db
+def test_deployment_aget_empty_new_steps_on_finished(finished_deployment):
+    new_steps = async_to_sync(finished_deployment.aget_new_steps)()
+    assert new_steps == []
+
+
+@pytest.mark.django_db
+def test_deployment_refresh_steps_ingested_by_worker(settings, deployment, remote_deployment):
+    settings.DEPLOY_STEPS_WORKER = True
+    deployment.data = remote_deployment
+    deployment.save()
+    Deployment.objects.get(pk=deployment.pk).apply_remote(
+        remote_deployment.model_copy(update={"steps": [Step(id=5, name="new")]})
+    )
+
+    deployment.refresh_steps()
+    assert len(deployment.processed_steps) == 1
+    deployment.processed_steps = []
+    async_to_sync(deployment.arefresh_steps)()
+    assert len(deployment.processed_steps) == 1
+
+
+@pytest.mark.django_db
+def test_deployment_refresh_steps_ingested_by_relay(settings, deployment, remote_deployment):
+    settings.DEPLOY_STEPS_WORKER = False
+    settings.DEPLOY_WEBSOCKET_URL = "wss://deploy.example.com/deployments/ws"
+    deployment.data = remote_deployment
+    deployment.save()
+    Deployment.objects.get(pk=deployment.pk).apply_remote(
+        remote_deployment.model_copy(update={"steps": [Step(id=5, name="new")]})
+    )
+
+    with patch("apps.registry.models.Deployment.get_new_steps") as get_new_steps:
+        deployment.refresh_steps()
+    get_new_steps.assert_not_called()
+    assert len(deployment.processed_steps) == 1
+
+
 @pytest.mark.django_db
 def test_deployment_in_progress(domain, remote_deployment):
     deployment = Deployment(domain=domain)
@@ -88,6 +188,186 @@ def test_deployment_in_progress(domain, remote_deployment):
     assert deployment.in_progress
 
 
+@pytest.mark.django_db
+def test_deployment_state_columns(domain, remote_deployment):
+    deployment = Deployment.objects.create(domain=domain)
+    assert deployment.state == Deployment.State.NEW
+    assert list(Deployment.objects.in_progress()) == []
+
+    deployment.data = remote_deployment
+    deployment.save()
+    assert deployment.remote_id == remote_deployment.id
+    assert deployment.started is None
+    assert list(Deployment.objects.in_progress()) == [deployment]
+
+    finished = remote_deployment.model_copy(update={"finished": datetime(2022, 7, 22, 10)})
+    deployment.apply_remote(finished)
+    assert deployment.finished == datetime(2022, 7, 22, 10, tzinfo=timezone.utc)
+    assert list(Deployment.objects.in_progress()) == []
+    assert list(Deployment.objects.finished()) == [deployment]
+
+
+@pytest.mark.django_db
+def test_backfill_deployment_state(domain):
+    backfill = import_module("apps.registry.migrations.0010_backfill_deployment_state").backfill_deployment_state
+    running = Deployment.objects.create(domain=domain)
+    finished = Deployment.objects.create(domain=domain)
+    new = Deployment.objects.create(domain=domain)
+    Deployment.objects.filter(pk=running.pk).update(data={"id": 1, "started": "2022-07-22T09:00:00"})
+    Deployment.objects.filter(pk=finished.pk).update(data={"id": 2, "finished": "2022-07-22T10:00:00+00:00"})
+
+    backfill(django_apps, None)
+
+    running.refresh_from_db()
+    assert (running.remote_id, running.state) == (1, Deployment.State.RUNNING)
+    assert running.started == datetime(2022, 7, 22, 9, tzinfo=timezone.utc)
+    finished.refresh_from_db()
+    assert (finished.remote_id, finished.state) == (2, Deployment.State.FINISHED)
+    new.refresh_from_db()
+    assert new.state == Deployment.State.NEW
+
+
+@pytest.mark.django_db
+def test_deployment_steps_after_high_water_mark(domain):
+    deployment = Deployment.objects.create(domain=domain, data=RemoteDeployment(id=1, no_steps_yet=True))
+    assert deployment.steps_cursor is None
+
+    # fastdeploy only returns steps after the cursor, older ones aren't needed
+    first = RemoteDeployment(id=1, steps=[Step(id=2, name="two"), Step(id=1, name="one")])
+    assert [s.id for s in deployment.apply_remote(first)] == [0, 1, 2]
+    assert deployment.steps_cursor == 2
+    second = RemoteDeployment(id=1, steps=[Step(id=2, name="two"), Step(id=3, name="three")])
+    assert [s.id for s in deployment.apply_remote(second)] == [3]
+
+    deployment.refresh_from_db()
+    assert deployment.last_step_id == 3
+    assert [s.id for s in deployment.processed_steps] == [0, 1, 2, 3]
+    assert deployment.get_processed_steps(3) == [StepRecord(id=3, name="three")]
+
+
+@pytest.mark.django_db
+def test_deployment_apply_unchanged_remote_skips_write(domain):
+    remote = RemoteDeployment(id=1, started=datetime(2022, 7, 22, 9, 0, 0, 123456), steps=[Step(id=1, name="one")])
+    deployment = Deployment.objects.create(domain=domain, data=RemoteDeployment(id=1, no_steps_yet=True))
+    deployment.apply_remote(remote)
+
+    deployment = Deployment.objects.get(pk=deployment.pk)
+    with CaptureQueriesContext(connection) as queries:
+        assert deployment.apply_remote(remote.model_copy()) == []
+    assert len(queries) == 0
+
+
+@pytest.mark.django_db
+def test_deployment_data_round_trip(domain):
+    """Microseconds survive, DjangoJSONEncoder used to cut them to milliseconds"""
+    remote = RemoteDeployment(id=1, started=datetime(2022, 7, 22, 9, 0, 0, 123456), context={"b": 1, "a": 2})
+    deployment = Deployment.objects.create(domain=domain, data=remote)
+    assert Deployment.objects.get(pk=deployment.pk).remote == remote
+
+
+@pytest.mark.django_db
+def test_deployment_apply_remote_writes_changed_columns_only(domain):
+    deployment = Deployment.objects.create(domain=domain, data=RemoteDeployment(id=1))
+    with CaptureQueriesContext(connection) as queries:
+        deployment.apply_remote(RemoteDeployment(id=1, steps=[Step(id=1, name="one")]))
+    [update] = [q["sql"] for q in queries if q["sql"].startswith("UPDATE")]
+    assert '"steps_count"' in update and '"version"' in update
+    assert '"data"' not in update and '"state"' not in update
+
+
+@pytest.mark.django_db
+def test_deployment_concurrent_pollers_dont_clobber_each_other(domain):
+    deployment = Deployment.objects.create(domain=domain, data=RemoteDeployment(id=1, no_steps_yet=True))
+    first, second = Deployment.objects.get(pk=deployment.pk), Deployment.objects.get(pk=deployment.pk)
+    remote = RemoteDeployment(id=1, steps=[Step(id=1, name="one")])
+
+    assert [s.id for s in first.apply_remote(remote)] == [0, 1]
+    # the second poller loses the race and gets the steps the first one stored
+    assert [s.id for s in second.apply_remote(remote.model_copy())] == [0, 1]
+    assert second.version == first.version
+
+    deployment.refresh_from_db()
+    assert deployment.steps_count == 2
+    assert [s.id for s in deployment.processed_steps] == [0, 1]
+
+
+@pytest.mark.django_db
+def test_deployment_save_update_fields_include_derived_columns(domain, remote_deployment):
+    deployment = Deployment.objects.create(domain=domain)
+    deployment.data = remote_deployment
+    deployment.save(update_fields=["data"])
+    deployment = Deployment.objects.get(pk=deployment.pk)
+    assert (deployment.state, deployment.remote_id, deployment.version) == (Deployment.State.RUNNING, 1, 2)
+
+
+class BatchClient(StubClient):
+    def __init__(self):
+        self.batches = []
+
+    def fetch_deployments(self, deployments, *, concurrency=None):
+        self.batches.append([d.pk for d in deployments])
+        return [RemoteDeployment(id=d.remote_id, steps=[Step(id=1, name="one")]) for d in deployments]
+
+    async def afetch_deployments(self, deployments, *, concurrency=None):
+        return self.fetch_deployments(deployments)
+
+
+@pytest.mark.django_db
+def test_fetch_new_steps_of_several_deployments(domain):
+    running = [Deployment.objects.create(domain=domain, data=RemoteDeployment(id=i)) for i in (1, 2)]
+    finished = Deployment.objects.create(
+        domain=domain, data=RemoteDeployment(id=3, finished=datetime.now(timezone.utc))
+    )
+    client = BatchClient()
+
+    new_steps = fetch_new_steps([running[0], finished, running[1]], client=client)
+    assert [[s.id for s in steps] for steps in new_steps] == [[1], [], [1]]
+    assert client.batches == [[running[0].pk, running[1].pk]]
+
+    assert async_to_sync(afetch_new_steps)(running, client=client) == [[], []]
+    assert len(client.batches) == 2
+
+
+def test_deployment_poll_delay_backs_off_while_idle(settings):
+    settings.DEPLOY_POLL_INTERVAL, settings.DEPLOY_POLL_MAX_INTERVAL = 1, 30
+    now = datetime(2022, 7, 22, 9, tzinfo=timezone.utc)
+    deployment = Deployment()
+    assert deployment.get_poll_delay(now) == 1  # not started yet
+
+    deployment.started = now
+    delays = [deployment.get_poll_delay(now + timedelta(seconds=idle)) for idle in [0, 1, 2, 5, 9, 20, 40, 600]]
+    assert delays == [1, 1, 2, 4, 8, 16, 30, 30]
+
+    deployment.last_step_at = now + timedelta(seconds=600)  # new steps -> poll often again
+    assert deployment.get_poll_delay(now + timedelta(seconds=600)) == 1
+
+
+@pytest.mark.django_db(transaction=True)
+def test_migrate_processed_steps(domain):
+    """The processed steps json gets copied into DeploymentSteps, the high-water mark backfilled"""
+    executor = MigrationExecutor(connection)
+    executor.migrate([("registry", "0010_backfill_deployment_state")])
+    old_apps = executor.loader.project_state([("registry", "0010_backfill_deployment_state")]).apps
+    steps = [
+        {"id": 0, "name": "start"},
+        {"id": 7, "name": "seven", "started": "2022-07-22T09:00:00"},
+        {"id": -1, "name": "end"},
+    ]
+    processed = old_apps.get_model("registry", "Deployment").objects.create(domain_id=domain.pk, processed_steps=steps)
+    unprocessed = old_apps.get_model("registry", "Deployment").objects.create(domain_id=domain.pk)
+
+    executor = MigrationExecutor(connection)
+    executor.loader.build_graph()
+    executor.migrate(executor.loader.graph.leaf_nodes())
+
+    deployment = Deployment.objects.get(pk=processed.pk)
+    assert (deployment.last_step_id, deployment.steps_count) == (7, 3)
+    assert [s.name for s in deployment.processed_steps] == ["start", "seven", "end"]
+    assert deployment.processed_steps[1].started == datetime(2022, 7, 22, 9, tzinfo=timezone.utc)
+    deployment = Deployment.objects.get(pk=unprocessed.pk)
+    assert (deployment.last_step_id, deployment.steps_count, deployment.processed_steps) == (None, 0, [])
+
+
 def test_deployment_service_token_cast():
     domain = Domain(backend=Domain.Backend.CAST)
     deployment = Deployment(domain=domain)
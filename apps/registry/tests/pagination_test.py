@@ -0,0 +1,63 @@
+import pytest
+from django.test import RequestFactory
+
+from ..models import Deployment
+from ..pagination import get_keyset_page, paginate
+
+
+@pytest.fixture
+def deployments(domain):
+    return [Deployment.objects.create(domain=domain) for _ in range(5)]
+
+
+def pks(page):
+    return [obj.pk for obj in page.object_list]
+
+
+@pytest.mark.django_db
+def test_keyset_page_walks_forward_and_back(deployments):
+    queryset = Deployment.objects.all()
+    ids = [d.pk for d in deployments]
+
+    first = get_keyset_page(queryset, 2)
+    assert pks(first) == ids[:2]
+    assert not first.has_previous and first.next_cursor == ids[1]
+
+    second = get_keyset_page(queryset, 2, after=first.next_cursor)
+    assert pks(second) == ids[2:4]
+    assert second.previous_cursor == ids[2] and second.next_cursor == ids[3]
+
+    last = get_keyset_page(queryset, 2, after=second.next_cursor)
+    assert pks(last) == ids[4:]
+    assert not last.has_next
+
+    back = get_keyset_page(queryset, 2, before=last.previous_cursor)
+    assert pks(back) == pks(second)
+    assert back.previous_cursor == ids[2] and back.next_cursor == ids[3]
+
+    assert not get_keyset_page(queryset, 2, before=second.previous_cursor).has_previous
+
+
+@pytest.mark.django_db
+def test_keyset_page_does_not_count(deployments, django_assert_num_queries):
+    with django_assert_num_queries(1) as captured:
+        get_keyset_page(Deployment.objects.all(), 2, after=deployments[2].pk)
+    assert "COUNT(" not in captured.captured_queries[0]["sql"].upper()
+    assert "OFFSET" not in captured.captured_queries[0]["sql"].upper()
+
+
+@pytest.mark.django_db
+def test_keyset_page_beyond_the_ends(deployments):
+    queryset = Deployment.objects.all()
+    after_last = get_keyset_page(queryset, 2, after=deployments[-1].pk)
+    assert after_last.object_list == [] and after_last.previous_cursor == deployments[-1].pk + 1
+
+    before_first = get_keyset_page(queryset, 2, before=deployments[0].pk)
+    assert before_first.object_list == [] and before_first.next_cursor == deployments[0].pk - 1
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("query", ["after=x", "before=", ""])
+def test_paginate_ignores_invalid_cursors(deployments, query):
+    request = RequestFactory().get(f"/?{query}")
+    assert pks(paginate(request, Deployment.objects.all(), 2)) == [d.pk for d in deployments[:2]]
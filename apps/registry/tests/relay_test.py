@@ -0,0 +1,153 @@
+import asyncio
+import json
+
+import pytest
+from asgiref.sync import async_to_sync
+from websockets.asyncio.server import serve
+
+from ..fastdeploy import RemoteDeployment, SpecialSteps, Step, StepRecord
+from ..relay import DeploymentRelay, StepsUpdate, get_relay
+
+
+class FastdeployStandIn:
+    """
+    Local stand-in for the fastdeploy deployments websocket. Records the
+    first (authentication) message and sends the given events.
+    """
+
+    def __init__(self, events):
+        self.events = events
+        self.auth_messages = []
+
+    async def handler(self, websocket):
+        self.auth_messages.append(json.loads(await websocket.recv()))
+        for event in self.events:
+            await websocket.send(json.dumps(event))
+        await websocket.wait_closed()
+
+    def serve(self):
+        return serve(self.handler, "localhost", 0)
+
+
+@pytest.fixture
+def remote_deployment_started(deployment):
+    deployment.data = RemoteDeployment(id=42, no_steps_yet=True)
+    deployment.save()
+    return deployment
+
+
+@pytest.mark.django_db
+def test_relay_stores_and_publishes_steps(remote_deployment_started):
+    deployment = remote_deployment_started
+    events = [
+        {"type": "step", "deployment_id": 42, "id": 1, "name": "first", "state": "running"},
+        {"type": "step", "deployment_id": 42, "id": 1, "name": "first", "state": "success"},
+        {"type": "unknown"},
+        {"type": "deployment", "id": 42, "finished": "2022-07-22T10:00:00"},
+    ]
+    fastdeploy = FastdeployStandIn(events)
+
+    async def relay_events():
+        async with fastdeploy.serve() as server:
+            port = server.sockets[0].getsockname()[1]
+            relay = DeploymentRelay(f"ws://localhost:{port}", token="secret")
+            queue = relay.subscribe(deployment.pk)
+            relay.start()
+            updates = [await asyncio.wait_for(queue.get(), timeout=5) for _ in range(3)]
+            assert relay.connected
+            await relay.stop()
+            return updates
+
+    first, second, third = async_to_sync(relay_events)()
+    assert fastdeploy.auth_messages == [{"access_token": "secret"}]
+    assert [s.name for s in first.steps] == [SpecialSteps.START.value.name, "first"]
+    assert (first.position, second.position, second.steps) == (0, 2, [])
+    assert third == StepsUpdate(position=2, steps=[StepRecord.from_step(SpecialSteps.END.value)], finished=True)
+
+    deployment.refresh_from_db()
+    assert deployment.has_finished
+    assert [s.name for s in deployment.processed_steps] == [
+        SpecialSteps.START.value.name,
+        "first",
+        "Deployment is done!",
+    ]
+
+
+@pytest.mark.django_db
+def test_relay_drops_invalid_events(remote_deployment_started):
+    """A broken event is logged and dropped, the connection stays up for the next one"""
+    deployment = remote_deployment_started
+    events = [
+        {"type": "step", "deployment_id": 42, "id": "not a number", "name": "invalid"},
+        "not json {",
+        {"type": "step", "deployment_id": 42, "id": 1, "name": "valid"},
+    ]
+    fastdeploy = FastdeployStandIn(events)
+
+    async def relay_events():
+        async with fastdeploy.serve() as server:
+            port = server.sockets[0].getsockname()[1]
+            relay = DeploymentRelay(f"ws://localhost:{port}")
+            queue = relay.subscribe(deployment.pk)
+            relay.start()
+            update = await asyncio.wait_for(queue.get(), timeout=5)
+            connected = relay.connected
+            await relay.stop()
+            return update, connected
+
+    update, connected = async_to_sync(relay_events)()
+    assert connected
+    assert [s.name for s in update.steps] == [SpecialSteps.START.value.name, "valid"]
+
+
+@pytest.mark.django_db
+def test_relay_ignores_unknown_deployments(remote_deployment_started):
+    relay = DeploymentRelay("ws://localhost")
+    event = {"type": "step", "deployment_id": 23, "id": 1, "name": "first"}
+    assert async_to_sync(relay.handle_event)(event) is None
+
+
+@pytest.mark.django_db
+def test_relay_wait_for_steps(remote_deployment_started):
+    deployment = remote_deployment_started
+    relay = DeploymentRelay("ws://localhost")
+    first, second = Step(id=1, name="first"), Step(id=2, name="second")
+
+    async def wait(update, cursor, timeout=1):
+        queue = relay.subscribe(deployment.pk)
+        relay.publish(deployment.pk, update)
+        steps = await relay.wait_for_steps(deployment, queue, timeout, cursor)
+        relay.unsubscribe(deployment.pk, queue)
+        return steps
+
+    assert async_to_sync(wait)(StepsUpdate(position=0, steps=[first], finished=False), 0) == [first]
+    assert deployment.steps_count == 1
+
+    # overlapping update only returns the steps after the cursor
+    assert async_to_sync(wait)(StepsUpdate(position=0, steps=[first, second], finished=False), 1) == [second]
+    assert relay.watchers == {}
+
+    # missed steps or nothing happening -> reload from database
+    assert async_to_sync(wait)(StepsUpdate(position=5, steps=[first], finished=False), 2) == []
+    assert deployment.steps_count == 0
+
+
+def test_relay_reconnects_after_connection_errors():
+    relay = DeploymentRelay("ws://localhost:1", reconnect_delay=0)
+
+    async def run_briefly():
+        relay.start()
+        await asyncio.sleep(0.05)
+        assert not relay.connected
+        await relay.stop()
+        await relay.stop()  # stopping twice is fine
+
+    async_to_sync(run_briefly)()
+
+
+def test_get_relay_only_if_configured(settings, monkeypatch):
+    monkeypatch.setattr("apps.registry.relay.relay", None)
+    settings.DEPLOY_WEBSOCKET_URL = None
+    assert get_relay() is None
+    settings.DEPLOY_WEBSOCKET_URL = "ws://localhost:8001/deployments/ws"
+    assert get_relay() is get_relay()
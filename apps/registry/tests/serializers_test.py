@@ -1,4 +1,9 @@
-from ..fastdeploy import RemoteDeployment
+import json
+from datetime import datetime, timezone
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from ..fastdeploy import RemoteDeployment, Step
 from ..serializers import RegistryJSONEncoder
 
 
@@ -7,3 +12,23 @@ def test_json_serializer(remote_deployment):
     encoded = serializer.encode(remote_deployment)
     decoded = RemoteDeployment.model_validate_json(encoded)
     assert decoded == remote_deployment
+
+
+def test_models_are_encoded_by_pydantic(remote_deployment):
+    assert json.dumps(remote_deployment, cls=RegistryJSONEncoder) == remote_deployment.model_dump_json()
+    step = remote_deployment.steps[0]
+    assert json.dumps(step, cls=RegistryJSONEncoder) == step.model_dump_json()
+
+
+def test_nested_models_take_the_default_path(remote_deployment):
+    encoded = json.dumps({"remote": remote_deployment}, cls=RegistryJSONEncoder)
+    assert RemoteDeployment.model_validate(json.loads(encoded)["remote"]) == remote_deployment
+
+
+def test_rows_encoded_by_django_json_encoder_still_parse():
+    """Rows written before the pydantic fast path used DjangoJSONEncoder's datetime format"""
+    started = datetime(2022, 7, 22, 9, 0, 0, 123000, tzinfo=timezone.utc)
+    remote = RemoteDeployment(id=1, started=started, steps=[Step(id=1, name="one", started=started)])
+    legacy = json.dumps(remote.model_dump(), cls=DjangoJSONEncoder)
+    assert '"2022-07-22T09:00:00.123Z"' in legacy
+    assert RemoteDeployment.model_validate(json.loads(legacy)) == remote
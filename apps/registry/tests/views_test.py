@@ -1,11 +1,23 @@
-from unittest.mock import patch
+from datetime import timedelta
+from unittest.mock import AsyncMock, patch
 
 import pytest
+from asgiref.sync import async_to_sync, sync_to_async
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
-
-from ..fastdeploy import SpecialSteps
-from ..models import Domain
-from ..views import render_partial_or_full
+from django.utils import timezone
+from django.utils.cache import has_vary_header
+
+from .. import fastdeploy
+from ..fastdeploy import RemoteDeployment, SpecialSteps, Step
+from ..models import Deployment, DeploymentStep, Domain
+from ..views import (
+    build_steps_html,
+    format_event,
+    get_steps_fragment,
+    render_partial_or_full,
+)
 
 
 def test_get_home(client):
@@ -18,6 +30,16 @@ def test_get_fade_out(client):
     assert r.status_code == 200
 
 
+def store_steps(deployment, steps):
+    """
+    Append steps and save them together with the rest of the deployment.
+    """
+    rows = deployment.append_steps(steps)
+    with transaction.atomic():
+        deployment.save()
+        DeploymentStep.objects.bulk_create(rows)
+
+
 @pytest.mark.django_db
 @pytest.mark.parametrize(
     "method, url",
@@ -27,6 +49,9 @@ def test_get_fade_out(client):
         ("get", reverse("domain_deployments", kwargs={"domain_id": 1})),
         ("post", reverse("domain_deployments", kwargs={"domain_id": 1})),
         ("get", reverse("deploy_state", kwargs={"deployment_id": 1})),
+        ("get", reverse("adeploy_state", kwargs={"deployment_id": 1})),
+        ("get", reverse("domain_state", kwargs={"domain_id": 1})),
+        ("get", reverse("adomain_state", kwargs={"domain_id": 1})),
     ],
 )
 def test_get_login_required_not_authenticated(client, method, url):
@@ -114,12 +139,236 @@ def test_get_login_required_deploy_state_authenticated(client, deployment):
     assert "aside" in r.content.decode("utf8")
 
 
-@pytest.fixture
-def other_user(django_user_model):
-    username, password = "user2", "password"
-    user = django_user_model.objects.create_user(username=username, password=password)
-    user._password = password
-    return user
+@pytest.mark.django_db
+def test_deploy_state_parses_remote_deployment_once(client, user, deployment):
+    """
+    Accessing Deployment.remote via has_finished, get_new_steps etc. used to
+    parse the deployment json for every access, now it's parsed once per request.
+    """
+    fastdeploy.TestClient().start_deployment(deployment)
+    deployment.data = RemoteDeployment(id=1, no_steps_yet=True)
+    deployment.save()
+    client.force_login(user)
+    url = reverse("deploy_state", kwargs={"deployment_id": deployment.pk})
+    model_validate = RemoteDeployment.model_validate
+    with patch.object(RemoteDeployment, "model_validate", side_effect=model_validate) as parse:
+        r = client.get(url)
+    assert r.status_code == 200
+    assert parse.call_count == 1
+
+
+@pytest.mark.django_db
+def test_deploy_state_sends_steps_after_seen(settings, client, user, deployment, remote_deployment):
+    """With a background worker, deploy_state only reads the steps from the database"""
+    settings.DEPLOY_STEPS_WORKER = True
+    deployment.data = remote_deployment
+    store_steps(deployment, [SpecialSteps.START.value, remote_deployment.steps[0]])
+    client.force_login(user)
+    url = reverse("deploy_state", kwargs={"deployment_id": deployment.pk})
+    with patch("apps.registry.models.Deployment.get_new_steps") as get_new_steps:
+        r = client.get(url, {"seen": 1})
+    get_new_steps.assert_not_called()
+    assert r.content.decode("utf8") == "<aside>step name</aside>"
+    assert client.get(url, {"seen": 2}).content == b""
+    assert client.get(url).content == b""  # clients not telling what they've seen get nothing new
+
+
+@pytest.mark.django_db
+def test_deploy_state_reads_relayed_steps(settings, client, user, deployment, remote_deployment):
+    """With the websocket relay configured, deploy_state doesn't poll fastdeploy either"""
+    settings.DEPLOY_STEPS_WORKER = False
+    settings.DEPLOY_WEBSOCKET_URL = "wss://deploy.example.com/deployments/ws"
+    deployment.data = remote_deployment
+    store_steps(deployment, [SpecialSteps.START.value, remote_deployment.steps[0]])
+    client.force_login(user)
+    url = reverse("deploy_state", kwargs={"deployment_id": deployment.pk})
+    with patch("apps.registry.models.Deployment.get_new_steps") as get_new_steps:
+        r = client.get(url, {"seen": 1})
+    get_new_steps.assert_not_called()
+    assert r.content.decode("utf8") == "<aside>step name</aside>"
+
+
+@pytest.mark.django_db
+def test_adeploy_state_sends_steps_after_seen(settings, async_client, user, deployment, remote_deployment):
+    settings.DEPLOY_STEPS_WORKER = True
+    deployment.data = remote_deployment
+    store_steps(deployment, [SpecialSteps.START.value])
+    async_client.force_login(user)
+    url = reverse("adeploy_state", kwargs={"deployment_id": deployment.pk})
+    r = async_to_sync(async_client.get)(url, {"seen": "0"})
+    assert r.content.decode("utf8") == "<aside>Starting deployment...</aside>"
+
+
+@pytest.mark.django_db
+def test_deploy_state_etag_not_modified(settings, client, user, deployment, remote_deployment):
+    """Clients presenting the current step count as ETag get a 304 without fetching"""
+    settings.DEPLOY_STEPS_WORKER = True
+    deployment.data = remote_deployment
+    store_steps(deployment, [SpecialSteps.START.value])
+    client.force_login(user)
+    url = reverse("deploy_state", kwargs={"deployment_id": deployment.pk})
+    r = client.get(url, {"seen": 1})
+    assert (r.status_code, r["ETag"]) == (200, '"1-1"')
+
+    r = client.get(url, {"seen": 1}, headers={"If-None-Match": '"1-1"'})
+    assert (r.status_code, r.content, r["ETag"]) == (304, b"", '"1-1"')
+
+    store_steps(deployment, [remote_deployment.steps[0]])
+    r = client.get(url, {"seen": 1}, headers={"If-None-Match": '"1-1"'})
+    assert (r.status_code, r["ETag"]) == (200, '"2-1"')
+    assert r.content.decode("utf8") == "<aside>step name</aside>"
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("url_name", ["deploy_state", "adeploy_state"])
+def test_deploy_state_not_modified_from_cache(settings, client, async_client, user, deployment, url_name):
+    """Polls of clients knowing the current state only load the session and the user"""
+    settings.DEPLOY_STEPS_WORKER = True
+    deployment.data = RemoteDeployment(id=1)
+    store_steps(deployment, [SpecialSteps.START.value])
+    if url_name.startswith("a"):
+        async_client.force_login(user)
+        get = async_to_sync(async_client.get)
+    else:
+        client.force_login(user)
+        get = client.get
+    url = reverse(url_name, kwargs={"deployment_id": deployment.pk})
+    etag = get(url, {"seen": 1})["ETag"]
+    get(url, {"seen": 1}, headers={"If-None-Match": etag})  # warm up the cache
+    with CaptureQueriesContext(connection) as captured:
+        r = get(url, {"seen": 1}, headers={"If-None-Match": etag})
+    assert (r.status_code, len(captured)) == (304, 2)
+
+    Deployment.objects.get(pk=deployment.pk).apply_remote(RemoteDeployment(id=1, steps=[Step(id=1, name="new")]))
+    r = get(url, {"seen": 1}, headers={"If-None-Match": etag})
+    assert r.status_code == 200
+    assert r.content.decode("utf8") == "<aside>new</aside>"
+
+
+@pytest.mark.django_db
+def test_deploy_state_cached_not_modified_checks_owner(settings, client, other_user, deployment, remote_deployment):
+    settings.DEPLOY_STEPS_WORKER = True
+    deployment.data = remote_deployment
+    store_steps(deployment, [SpecialSteps.START.value])
+    client.force_login(other_user)
+    url = reverse("deploy_state", kwargs={"deployment_id": deployment.pk})
+    assert client.get(url, headers={"If-None-Match": '"1-1"'}).status_code == 403
+
+
+@pytest.mark.django_db
+def test_deploy_state_suggests_next_poll_delay(settings, client, user, deployment, remote_deployment):
+    """htmx gets a new poller, which waits longer the longer nothing happened"""
+    settings.DEPLOY_STEPS_WORKER = True
+    deployment.data = remote_deployment
+    store_steps(deployment, [SpecialSteps.START.value])
+    client.force_login(user)
+    url = reverse("deploy_state", kwargs={"deployment_id": deployment.pk})
+    headers = {"HX-Request": "true"}
+    html = client.get(url, {"seen": 1}, headers=headers).content.decode("utf8")
+    assert 'hx-swap-oob="true"' in html
+    assert 'hx-trigger="load delay:1s"' in html
+
+    deployment.last_step_at = timezone.now() - timedelta(minutes=10)
+    deployment.save()
+    r = client.get(url, {"seen": 1}, headers=headers)
+    assert 'hx-trigger="load delay:30s"' in r.content.decode("utf8")
+    assert r["ETag"] == '"1-30"'
+    assert "hx-swap-oob" not in client.get(url, {"seen": 1}).content.decode("utf8")  # not requested by htmx
+
+
+@pytest.mark.django_db
+def test_adeploy_state_etag_finished_stops_polling(async_client, user, finished_deployment):
+    """Finished deployments aren't answered with 304, htmx needs the stop polling status"""
+    store_steps(finished_deployment, [SpecialSteps.START.value])
+    async_client.force_login(user)
+    url = reverse("adeploy_state", kwargs={"deployment_id": finished_deployment.pk})
+    etag = async_to_sync(async_client.get)(url, {"seen": 0})["ETag"]
+    r = async_to_sync(async_client.get)(url, {"seen": 0}, headers={"If-None-Match": etag})
+    assert (r.status_code, r["ETag"]) == (286, etag)
+    assert r.content.decode("utf8") == "<aside>Starting deployment...</aside>"
+
+
+@pytest.mark.django_db
+def test_deploy_state_varies_on_htmx(settings, client, user, deployment, remote_deployment):
+    """Only htmx gets a poller, so caches must not mix up both responses"""
+    settings.DEPLOY_STEPS_WORKER = True
+    deployment.data = remote_deployment
+    store_steps(deployment, [SpecialSteps.START.value])
+    client.force_login(user)
+    url = reverse("deploy_state", kwargs={"deployment_id": deployment.pk})
+    r = client.get(url, {"seen": 1}, headers={"HX-Request": "true"})
+    assert has_vary_header(r, "HX-Request")
+    r = client.get(url, {"seen": 1}, headers={"If-None-Match": r["ETag"]})
+    assert r.status_code == 304
+    assert has_vary_header(r, "HX-Request")
+
+
+def start_deployment(domain, steps, remote_id=1):
+    deployment = Deployment.objects.create(domain=domain, data=RemoteDeployment(id=remote_id))
+    store_steps(deployment, steps)
+    return deployment
+
+
+@pytest.mark.django_db
+def test_domain_state_sends_steps_of_all_running_deployments(settings, client, user, domain, remote_deployment):
+    settings.DEPLOY_STEPS_WORKER = True
+    step = remote_deployment.steps[0]
+    first = start_deployment(domain, [SpecialSteps.START.value, step])
+    second = start_deployment(domain, [SpecialSteps.START.value])
+    client.force_login(user)
+    url = reverse("domain_state", kwargs={"domain_id": domain.pk})
+
+    r = client.get(url, {f"seen-{first.pk}": 1, f"seen-{second.pk}": 1}, headers={"HX-Request": "true"})
+    html = r.content.decode("utf8")
+    assert r.status_code == 200
+    assert f'<div id="progress-end-{first.pk}" hx-swap-oob="beforebegin"><aside>step name</aside></div>' in html
+    assert f"progress-end-{second.pk}" not in html  # nothing new
+    assert f'id="domain-poller-{domain.pk}"' in html
+
+    # the number of queries doesn't depend on the number of deployments
+    with CaptureQueriesContext(connection) as two_deployments:
+        client.get(url)
+    start_deployment(domain, [SpecialSteps.START.value])
+    with CaptureQueriesContext(connection) as three_deployments:
+        html = client.get(url).content.decode("utf8")
+    assert html.count("hx-swap-oob") == 3
+    assert len(three_deployments) == len(two_deployments)
+
+
+@pytest.mark.django_db
+def test_domain_state_refreshes_deployments_in_one_batch(client, user, domain):
+    deployments = [start_deployment(domain, [], remote_id=i) for i in (1, 2)]
+    client.force_login(user)
+    url = reverse("domain_state", kwargs={"domain_id": domain.pk})
+    with patch("apps.registry.views.fetch_new_steps") as fetch_new_steps:
+        client.get(url)
+    [refreshed] = [call.args[0] for call in fetch_new_steps.call_args_list]
+    assert [d.pk for d in refreshed] == [d.pk for d in deployments]
+
+
+@pytest.mark.django_db
+def test_domain_state_finished_stops_polling(settings, client, user, domain, finished_deployment):
+    """Watched deployments which have finished get their last steps"""
+    settings.DEPLOY_STEPS_WORKER = True
+    store_steps(finished_deployment, [SpecialSteps.END.value])
+    client.force_login(user)
+    url = reverse("domain_state", kwargs={"domain_id": domain.pk})
+    r = client.get(url, {f"seen-{finished_deployment.pk}": 0, "seen-x": 1})
+    assert r.status_code == 286
+    assert "Deployment is done!" in r.content.decode("utf8")
+    assert client.get(url).content == b""
+
+
+@pytest.mark.django_db
+def test_adomain_state(settings, async_client, user, domain):
+    settings.DEPLOY_STEPS_WORKER = True
+    deployment = start_deployment(domain, [SpecialSteps.START.value])
+    async_client.force_login(user)
+    url = reverse("adomain_state", kwargs={"domain_id": domain.pk})
+    r = async_to_sync(async_client.get)(url, headers={"HX-Request": "true"})
+    html = r.content.decode("utf8")
+    assert f'<div id="progress-end-{deployment.pk}" hx-swap-oob="beforebegin">' in html
+    assert url in html  # next poll goes to the async view again
 
 
 @pytest.mark.django_db
@@ -138,6 +387,23 @@ def test_get_deploy_state_not_authorized(client, deployment, other_user):
     assert r.status_code == 403
 
 
+@pytest.mark.django_db
+@pytest.mark.parametrize("url_name", ["domain_state", "adomain_state"])
+def test_domain_state_not_authorized(async_client, domain, other_user, url_name):
+    async_client.force_login(other_user)
+    url = reverse(url_name, kwargs={"domain_id": domain.pk})
+    r = async_to_sync(async_client.get)(url)
+    assert r.status_code == 403
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("url_name", ["domain_state", "adomain_state"])
+def test_domain_state_unknown_domain(async_client, user, url_name):
+    async_client.force_login(user)
+    r = async_to_sync(async_client.get)(reverse(url_name, kwargs={"domain_id": 0}))
+    assert r.status_code == 404
+
+
 @pytest.mark.django_db
 def test_get_deployment_state_finished_has_stop_polling_status(client, user, finished_deployment, remote_deployment):
     """
@@ -151,6 +417,305 @@ def test_get_deployment_state_finished_has_stop_polling_status(client, user, fin
     assert r.status_code == 286
 
 
+def test_adeploy_state_authenticated(async_client, deployment):
+    async_client.force_login(deployment.domain.owner)
+    url = reverse("adeploy_state", kwargs={"deployment_id": deployment.pk})
+    steps = [SpecialSteps.START.value]
+    with patch("apps.registry.models.Deployment.aget_new_steps", new=AsyncMock(return_value=steps)):
+        r = async_to_sync(async_client.get)(url)
+    assert r.status_code == 200
+    assert "aside" in r.content.decode("utf8")
+
+
+@pytest.mark.django_db
+def test_adeploy_state_not_authorized(async_client, deployment, other_user):
+    async_client.force_login(other_user)
+    url = reverse("adeploy_state", kwargs={"deployment_id": deployment.pk})
+    r = async_to_sync(async_client.get)(url)
+    assert r.status_code == 403
+
+
+@pytest.mark.django_db
+def test_adeploy_state_finished_has_stop_polling_status(async_client, user, finished_deployment):
+    async_client.force_login(user)
+    url = reverse("adeploy_state", kwargs={"deployment_id": finished_deployment.pk})
+    r = async_to_sync(async_client.get)(url)
+    assert r.status_code == 286
+
+
+@pytest.mark.django_db
+def test_domain_deployments_progress_transport(settings, async_client, client, user, finished_deployment):
+    """Polling via WSGI, server sent events or polling the async view via ASGI, one poller per domain"""
+    finished_deployment.data["finished"] = None
+    finished_deployment.save()
+    domain_id = finished_deployment.domain.pk
+    url = reverse("domain_deployments", kwargs={"domain_id": domain_id})
+    sync_url = reverse("domain_state", kwargs={"domain_id": domain_id})
+    async_url = reverse("adomain_state", kwargs={"domain_id": domain_id})
+    events_url = reverse("deploy_events", kwargs={"deployment_id": finished_deployment.pk})
+
+    client.force_login(user)
+    html = client.get(url).content.decode("utf8")
+    assert sync_url in html
+    assert events_url not in html
+    assert reverse("deploy_state", kwargs={"deployment_id": finished_deployment.pk}) not in html
+
+    async_client.force_login(user)
+    html = async_to_sync(async_client.get)(url).content.decode("utf8")
+    assert f"connect:{events_url}?seen=0" in html
+    assert async_url not in html
+
+    settings.DEPLOY_PROGRESS_EVENTS = False
+    html = async_to_sync(async_client.get)(url).content.decode("utf8")
+    assert async_url in html
+    assert events_url not in html
+
+
+def finish_deployment(deployment):
+    """Replacement for Deployment.get_new_steps finishing the deployment"""
+    remote = deployment.remote.model_copy()
+    remote.finished = timezone.now()
+    deployment.data = remote
+    store_steps(deployment, [SpecialSteps.END.value])
+    return [SpecialSteps.END.value]
+
+
+async def afinish_deployment(deployment):
+    return await sync_to_async(finish_deployment)(deployment)
+
+
+@pytest.mark.django_db
+def test_deploy_events_streams_steps_until_finished(settings, client, user, deployment, remote_deployment):
+    settings.DEPLOY_EVENTS_INTERVAL = 0
+    deployment.data = remote_deployment
+    store_steps(deployment, [SpecialSteps.START.value])
+    client.force_login(user)
+    url = reverse("deploy_events", kwargs={"deployment_id": deployment.pk})
+    with patch("apps.registry.models.Deployment.get_new_steps", autospec=True, side_effect=finish_deployment):
+        r = client.get(url)
+        events = b"".join(r.streaming_content).decode("utf8")
+    assert r["Content-Type"] == "text/event-stream"
+    assert events == (
+        "event: step\nid: 1\ndata: <aside>Starting deployment...</aside>\n\n"
+        "event: step\nid: 2\ndata: <aside>Deployment is done!</aside>\n\n"
+    )
+
+
+@pytest.mark.django_db
+def test_deploy_events_keepalive_and_cursor(settings, client, user, deployment, remote_deployment):
+    settings.DEPLOY_EVENTS_INTERVAL = 0
+    deployment.data = remote_deployment
+    store_steps(deployment, [SpecialSteps.START.value])
+    client.force_login(user)
+    url = reverse("deploy_events", kwargs={"deployment_id": deployment.pk})
+    with patch("apps.registry.models.Deployment.get_new_steps", autospec=True, side_effect=finish_deployment):
+        r = client.get(url, headers={"Last-Event-ID": "1"})
+        events = b"".join(r.streaming_content).decode("utf8")
+    assert events.startswith(": keepalive\n\n")
+    assert "Starting deployment" not in events
+    assert "id: 2\n" in events
+
+
+@pytest.mark.django_db
+def test_deploy_events_async_stream(settings, async_client, user, deployment, remote_deployment):
+    settings.DEPLOY_EVENTS_INTERVAL = 0
+    deployment.data = remote_deployment
+    deployment.save()
+    async_client.force_login(user)
+    url = reverse("deploy_events", kwargs={"deployment_id": deployment.pk})
+
+    async def get_events():
+        r = await async_client.get(url)
+        return "".join([chunk.decode("utf8") async for chunk in r.streaming_content])
+
+    with patch("apps.registry.models.Deployment.aget_new_steps", autospec=True, side_effect=afinish_deployment):
+        events = async_to_sync(get_events)()
+    assert events.endswith("event: step\nid: 1\ndata: <aside>Deployment is done!</aside>\n\n")
+
+
+class ConnectedRelay:
+    connected = True
+
+    def subscribe(self, deployment_id):
+        return "queue"
+
+    def unsubscribe(self, deployment_id, queue):
+        self.unsubscribed = deployment_id
+
+    async def wait_for_steps(self, deployment, queue, timeout, cursor):
+        return await afinish_deployment(deployment)
+
+
+@pytest.mark.django_db
+def test_deploy_events_async_stream_uses_relay(async_client, user, deployment, remote_deployment):
+    """Steps are relayed from the fastdeploy websocket, no polling"""
+    deployment.data = remote_deployment
+    deployment.save()
+    async_client.force_login(user)
+    url = reverse("deploy_events", kwargs={"deployment_id": deployment.pk})
+    relay = ConnectedRelay()
+
+    async def get_events():
+        r = await async_client.get(url)
+        return "".join([chunk.decode("utf8") async for chunk in r.streaming_content])
+
+    with patch("apps.registry.views.get_relay", return_value=relay):
+        with patch("apps.registry.models.Deployment.aget_new_steps") as aget_new_steps:
+            events = async_to_sync(get_events)()
+    aget_new_steps.assert_not_called()
+    assert "Deployment is done!" in events
+    assert relay.unsubscribed == deployment.pk
+
+
+@pytest.mark.django_db
+def test_deploy_events_finished_and_seen_stops_reconnects(client, user, finished_deployment):
+    client.force_login(user)
+    url = reverse("deploy_events", kwargs={"deployment_id": finished_deployment.pk})
+    r = client.get(url, headers={"Last-Event-ID": "asdf"})
+    assert r.status_code == 204
+
+
+@pytest.mark.django_db
+def test_deploy_events_not_authorized(client, deployment, other_user):
+    client.force_login(other_user)
+    r = client.get(reverse("deploy_events", kwargs={"deployment_id": deployment.pk}))
+    assert r.status_code == 403
+
+
+def test_build_steps_html_escapes_step_names():
+    html = build_steps_html([Step(name="<script>alert(1)</script>")])
+    assert html == "<aside>&lt;script&gt;alert(1)&lt;/script&gt;</aside>"
+
+
+@pytest.mark.django_db
+def test_get_steps_fragment_appends_only_new_steps(deployment, django_assert_num_queries):
+    store_steps(deployment, [SpecialSteps.START.value])
+    assert get_steps_fragment(deployment) == "<aside>Starting deployment...</aside>"
+    with django_assert_num_queries(0):
+        get_steps_fragment(deployment)  # cached for this high-water mark
+
+    store_steps(deployment, [Step(name="a & b")])
+    with patch.object(Deployment, "get_processed_steps", wraps=deployment.get_processed_steps) as get_steps:
+        html = get_steps_fragment(deployment)
+    get_steps.assert_called_once_with(1)
+    assert html == "<aside>Starting deployment...</aside><aside>a &amp; b</aside>"
+
+
+@pytest.mark.django_db
+def test_domain_deployments_renders_cached_steps(client, user, domain):
+    deployment = start_deployment(domain, [SpecialSteps.START.value, Step(name="<b>bold</b>")])
+    client.force_login(user)
+    url = reverse("domain_deployments", kwargs={"domain_id": domain.pk})
+
+    html = client.get(url).content.decode("utf8")
+    assert "<aside>&lt;b&gt;bold&lt;/b&gt;</aside>" in html
+    assert get_steps_fragment(deployment) in html
+
+
+@pytest.mark.django_db
+def test_domain_deployments_keyset_pagination(settings, client, user, domain):
+    settings.REGISTRY_PAGE_SIZE = 2
+    ids = [Deployment.objects.create(domain=domain).pk for _ in range(3)]
+    client.force_login(user)
+    url = reverse("domain_deployments", kwargs={"domain_id": domain.pk})
+
+    html = client.get(url).content.decode("utf8")
+    assert f'href="?after={ids[1]}"' in html
+    assert "?before=" not in html
+
+    html = client.get(url, {"after": ids[1]}).content.decode("utf8")
+    assert f'href="?before={ids[2]}"' in html
+    assert "?after=" not in html
+
+
+@pytest.fixture
+def running_deployments(domain, remote_deployment):
+    steps = [SpecialSteps.START.value, remote_deployment.steps[0]]
+    return [start_deployment(domain, steps, remote_id=remote_id) for remote_id in (1, 2)]
+
+
+def get_view_url(url_name, domain, deployment):
+    if url_name.startswith(("deploy_", "adeploy_")):
+        return reverse(url_name, kwargs={"deployment_id": deployment.pk})
+    if url_name.startswith(("domain_", "adomain_")):
+        return reverse(url_name, kwargs={"domain_id": domain.pk})
+    return reverse(url_name)
+
+
+class PollClient(fastdeploy.AbstractClient):
+    """
+    Fastdeploy answering every fetch with one new step of the deployment.
+    """
+
+    def start_deployment(self, deployment):
+        raise NotImplementedError
+
+    def fetch_deployment(self, deployment):
+        step_id = deployment.steps_count + 1
+        return RemoteDeployment(id=deployment.remote_id, steps=[Step(id=step_id, name=f"step {step_id}")])
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize(
+    "url_name, worker, queries",
+    [
+        ("home", True, 2),
+        ("domains", True, 3),
+        ("domain_deployments", True, 6),
+        ("deploy_state", True, 4),
+        ("adeploy_state", True, 4),
+        ("domain_state", True, 4),
+        ("adomain_state", True, 4),
+        # views fetch from fastdeploy and store the new steps themselves, one
+        # transaction (savepoint, update, insert, release) per deployment
+        ("deploy_state", False, 8),
+        ("adeploy_state", False, 8),
+        ("domain_state", False, 12),
+        ("adomain_state", False, 12),
+    ],
+)
+def test_view_query_counts(
+    settings, client, async_client, user, domain, running_deployments, url_name, worker, queries
+):
+    """
+    Fixed number of queries per view with a warm cache, two of them load the
+    session and the user. Add a query here only on purpose.
+    """
+    settings.DEPLOY_STEPS_WORKER = worker
+    if url_name.startswith("a"):
+        async_client.force_login(user)
+        get = async_to_sync(async_client.get)
+    else:
+        client.force_login(user)
+        get = client.get
+    url = get_view_url(url_name, domain, running_deployments[0])
+    params = {"seen": 1, **{f"seen-{d.pk}": 1 for d in running_deployments}}
+    with patch.object(fastdeploy.coalescing_client, "client", PollClient()):
+        get(url, params)  # warm up the cache
+        with CaptureQueriesContext(connection) as captured:
+            r = get(url, params)
+    assert r.status_code in (200, 286)
+    assert len(captured) == queries, "\n".join(q["sql"][:140] for q in captured)
+
+
+@pytest.mark.django_db
+def test_metrics_endpoint(settings, client):
+    url = reverse("metrics")
+    assert client.get(url).status_code == 404  # disabled without token
+
+    settings.REGISTRY_METRICS_TOKEN = "secret"
+    assert client.get(url, headers={"Authorization": "Bearer wrong"}).status_code == 403
+    client.get(reverse("home"))
+    r = client.get(url, headers={"Authorization": "Bearer secret"})
+    assert r.status_code == 200
+    assert r["Content-Type"].startswith("text/plain; version=0.0.4")
+    assert 'registry_request_duration_seconds_count{view="home"}' in r.content.decode("utf8")
+
+
+def test_format_event_multiline_data():
+    assert format_event("step", "a\nb", 3) == "event: step\nid: 3\ndata: a\ndata: b\n\n"
+
+
 class Request:
     META = {"CSRF_COOKIE": "asdf"}
 
@@ -0,0 +1,101 @@
+import asyncio
+from io import StringIO
+from unittest.mock import patch
+
+import pytest
+from asgiref.sync import async_to_sync
+from django.core.management import call_command
+
+from ..fastdeploy import AbstractClient, RemoteDeployment, Step
+from ..models import Deployment
+from ..worker import ingest_steps, run_worker
+
+
+class WorkerClient(AbstractClient):
+    def __init__(self, broken=()):
+        self.broken = broken
+        self.running = 0
+        self.max_running = 0
+
+    def start_deployment(self, deployment):
+        raise NotImplementedError
+
+    def fetch_deployment(self, deployment):
+        raise NotImplementedError
+
+    async def afetch_deployment(self, deployment):
+        if deployment.remote_id in self.broken:
+            raise ConnectionError("fastdeploy is down")
+        self.running += 1
+        self.max_running = max(self.running, self.max_running)
+        await asyncio.sleep(0.01)
+        self.running -= 1
+        return RemoteDeployment(id=deployment.remote_id, steps=[Step(id=1, name="first")])
+
+
+@pytest.fixture
+def deployments_in_progress(domain):
+    return [Deployment.objects.create(domain=domain, data=RemoteDeployment(id=remote_id)) for remote_id in range(1, 6)]
+
+
+@pytest.mark.django_db
+def test_ingest_steps_stores_new_steps(deployments_in_progress):
+    finished = Deployment.objects.create(domain=deployments_in_progress[0].domain, data=RemoteDeployment(id=9))
+    finished.apply_remote(RemoteDeployment(id=9, finished="2022-07-22T10:00:00"))
+    client = WorkerClient(broken={2})
+
+    new_steps = async_to_sync(ingest_steps)(client, 2)
+
+    assert new_steps == 4  # one deployment is broken and the finished one is skipped
+    assert client.max_running == 2
+    for deployment in deployments_in_progress:
+        deployment.refresh_from_db()
+        expected = [] if deployment.remote_id == 2 else ["first"]
+        assert [step.name for step in deployment.processed_steps] == expected
+
+
+@pytest.mark.django_db
+def test_run_worker_until_cancelled(deployments_in_progress):
+    client = WorkerClient()
+
+    async def run_briefly():
+        task = asyncio.create_task(run_worker(client=client, interval=0, concurrency=5))
+        await asyncio.sleep(0.1)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    async_to_sync(run_briefly)()
+    deployment = Deployment.objects.get(pk=deployments_in_progress[0].pk)
+    assert len(deployment.processed_steps) == 1
+
+
+@pytest.mark.django_db
+def test_run_worker_survives_errors(deployments_in_progress):
+    calls = []
+
+    async def ingest_steps_failing_once(client, concurrency):
+        calls.append(client)
+        if len(calls) == 1:
+            raise ConnectionError("database is down")
+        return await ingest_steps(client, concurrency)
+
+    async def run_briefly():
+        task = asyncio.create_task(run_worker(client=WorkerClient(), interval=0, concurrency=5))
+        await asyncio.sleep(0.1)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    with patch("apps.registry.worker.ingest_steps", ingest_steps_failing_once):
+        async_to_sync(run_briefly)()
+    assert len(calls) > 1
+    deployment = Deployment.objects.get(pk=deployments_in_progress[0].pk)
+    assert len(deployment.processed_steps) == 1
+
+
+@pytest.mark.django_db
+def test_ingest_steps_command_once():
+    out = StringIO()
+    call_command("ingest_steps", "--once", stdout=out)
+    assert "ingested 0 new steps" in out.getvalue()
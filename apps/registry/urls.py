@@ -12,4 +12,9 @@ urlpatterns: list[Any] = [
     path("domain-deployments/<int:domain_id>/", views.domain_deployments, name="domain_deployments"),
     path("fade_out/", views.fade_out, name="fade_out"),
     path("deploy-state/<int:deployment_id>/", views.deploy_state, name="deploy_state"),
+    path("deploy-state/<int:deployment_id>/async/", views.adeploy_state, name="adeploy_state"),
+    path("deploy-events/<int:deployment_id>/", views.deploy_events, name="deploy_events"),
+    path("domain-state/<int:domain_id>/", views.domain_state, name="domain_state"),
+    path("domain-state/<int:domain_id>/async/", views.adomain_state, name="adomain_state"),
+    path("metrics/", views.metrics, name="metrics"),
 ]
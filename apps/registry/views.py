@@ -1,16 +1,53 @@
+import asyncio
+import time
+from collections.abc import AsyncIterator, Iterator
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
-from django.core.paginator import Paginator
-from django.http import HttpRequest, HttpResponse, HttpResponseRedirect
-from django.shortcuts import get_object_or_404, render
+from django.core.cache import cache
+from django.db.models import Q
+from django.http import (
+    Http404,
+    HttpRequest,
+    HttpResponse,
+    HttpResponseNotModified,
+    HttpResponseRedirect,
+    StreamingHttpResponse,
+)
+from django.shortcuts import aget_object_or_404, get_object_or_404, render
+from django.template.loader import render_to_string
 from django.urls import reverse
+from django.utils.cache import patch_vary_headers
+from django.utils.crypto import constant_time_compare
+from django.utils.html import format_html_join
+from django.utils.http import parse_etags
+from django.utils.safestring import mark_safe
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_GET
 from django_htmx.http import HTMX_STOP_POLLING
 
-from .fastdeploy import Steps
+from .caching import (
+    aget_domain_owner_id,
+    aget_poll_state,
+    get_domain_owner_id,
+    get_poll_state,
+    get_steps_fragment_key,
+)
+from .fastdeploy import StepRecords
 from .forms import DeploymentForm, DomainForm
-from .models import Deployment, Domain
+from .metrics import expose
+from .models import (
+    Deployment,
+    Domain,
+    afetch_new_steps,
+    fetch_new_steps,
+    get_processed_steps_after,
+    steps_are_ingested,
+)
+from .pagination import paginate
+from .relay import get_relay
 
 
 @require_GET
@@ -18,26 +55,394 @@ def home(request: HttpRequest) -> HttpResponse:
     return render(request, "home.html")
 
 
-def build_steps_html(steps: Steps) -> str:
-    lines = []
-    for step in steps:
-        lines.append(f"<aside>{step.name}</aside>")
-    return "".join(lines)
+def build_steps_html(steps: StepRecords) -> str:
+    return format_html_join("", "<aside>{}</aside>", ((step.name,) for step in steps))
+
+
+def get_steps_fragment(deployment: Deployment) -> str:
+    """
+    Rendered html of all processed steps of the deployment. The fragment is
+    cached together with the step high-water mark it was rendered for, so the
+    history is rendered only once and afterwards just the new steps are
+    appended.
+    """
+    key = get_steps_fragment_key(deployment.pk)
+    rendered, html = cache.get(key, (0, ""))
+    if rendered > deployment.steps_count:
+        # the cached fragment is ahead of this instance, don't render steps the client won't count as seen
+        rendered, html = 0, ""
+    if rendered < deployment.steps_count:
+        new_steps = deployment.get_processed_steps(rendered)[: deployment.steps_count - rendered]
+        html += build_steps_html(new_steps)
+        rendered += len(new_steps)
+        cache.set(key, (rendered, html))
+    return mark_safe(html)
+
+
+def get_seen_steps(request: HttpRequest) -> int | None:
+    """
+    Number of processed steps the client has already rendered, if it told us.
+    """
+    try:
+        return max(int(request.GET["seen"]), 0)
+    except (KeyError, ValueError):
+        return None
+
+
+def get_steps_to_send(deployment: Deployment, seen: int | None, new_steps: StepRecords) -> StepRecords:
+    """
+    Clients passing the number of steps they've seen get all steps after that,
+    others only the steps which were new for this request.
+    """
+    if seen is None:
+        return new_steps
+    return deployment.get_processed_steps(seen)
+
+
+async def aget_steps_to_send(deployment: Deployment, seen: int | None, new_steps: StepRecords) -> StepRecords:
+    if seen is None:
+        return new_steps
+    return await deployment.aget_processed_steps(seen)
+
+
+def get_steps_etag(deployment: Deployment, poll_delay: int) -> str:
+    """
+    The number of processed steps is the version of the progress of a deployment.
+    The suggested poll delay is part of the response, therefore part of the ETag.
+    """
+    return f'"{deployment.steps_count}-{poll_delay}"'
+
+
+def is_not_modified(request: HttpRequest, deployment: Deployment, etag: str) -> bool:
+    """
+    Clients already knowing the current version don't need the steps again.
+    Finished deployments are always sent, because the status code tells htmx
+    to stop polling.
+    """
+    if deployment.has_finished:
+        return False
+    return etag in parse_etags(request.headers.get("If-None-Match", ""))
+
+
+def not_modified(etag: str) -> HttpResponse:
+    response = HttpResponseNotModified()
+    response["ETag"] = etag
+    patch_vary_headers(response, ["HX-Request"])  # like the full response it stands for
+    return response
+
+
+def build_poller_html(request: HttpRequest, deployment: Deployment, poll_delay: int) -> str:
+    """
+    Replace the poller of the progress page, which then polls again after poll_delay seconds.
+    """
+    context = {
+        "deployment": deployment,
+        "poll_delay": poll_delay,
+        "deploy_state_url_name": request.resolver_match.url_name,
+        "oob": True,
+    }
+    return render_to_string("progress_poller.html", context)
+
+
+def steps_response(request: HttpRequest, deployment: Deployment, steps: StepRecords, poll_delay: int) -> HttpResponse:
+    """
+    Respond with steps and, for htmx, a poller for the next request. Clients which
+    already know the current state get a 304, unless the deployment has finished.
+
+    The version is only known after new steps were ingested. Without the steps
+    worker or the relay the views fetch from fastdeploy first, so a 304 saves rendering, but
+    not the (coalesced) upstream call.
+    """
+    etag = get_steps_etag(deployment, poll_delay)
+    if is_not_modified(request, deployment, etag):
+        return not_modified(etag)
+    html = build_steps_html(steps)
+    if deployment.has_finished:
+        response = HttpResponse(status=HTMX_STOP_POLLING, content=html)
+    else:
+        if request.htmx:
+            html += build_poller_html(request, deployment, poll_delay)
+        response = HttpResponse(status=200, content=html)
+    response["ETag"] = etag
+    response["Cache-Control"] = "no-cache"  # revalidate on every poll
+    patch_vary_headers(response, ["HX-Request"])  # the poller is only sent to htmx
+    return response
+
+
+def get_poll_state_etag(state: Deployment | None, owner_id: int | None, user_id: int) -> str | None:
+    """
+    ETag of the cached poll state of a deployment, if it's enough to answer
+    with a 304. Everything else, including 403 and 404, is left to the view.
+    """
+    if state is None or state.state == Deployment.State.FINISHED or owner_id != user_id:
+        return None
+    return get_steps_etag(state, state.get_poll_delay())
+
+
+def get_cached_not_modified(request: HttpRequest, deployment_id: int) -> HttpResponse | None:
+    """
+    Answer polls of clients already knowing the current state from the cache,
+    without loading the deployment. Only if steps are ingested, otherwise the
+    deployment has to be fetched from fastdeploy to know whether it changed.
+    """
+    if not steps_are_ingested() or "If-None-Match" not in request.headers:
+        return None
+    state = get_poll_state(deployment_id)
+    owner_id = get_domain_owner_id(state.domain_id) if state is not None else None
+    etag = get_poll_state_etag(state, owner_id, request.user.pk)
+    if etag is None or etag not in parse_etags(request.headers["If-None-Match"]):
+        return None
+    return not_modified(etag)
+
+
+async def aget_cached_not_modified(request: HttpRequest, deployment_id: int) -> HttpResponse | None:
+    if not steps_are_ingested() or "If-None-Match" not in request.headers:
+        return None
+    state = await aget_poll_state(deployment_id)
+    owner_id = await aget_domain_owner_id(state.domain_id) if state is not None else None
+    etag = get_poll_state_etag(state, owner_id, (await request.auser()).pk)
+    if etag is None or etag not in parse_etags(request.headers["If-None-Match"]):
+        return None
+    return not_modified(etag)
 
 
 @login_required
 @require_GET
 def deploy_state(request: HttpRequest, deployment_id: int) -> HttpResponse:
-    deployment = get_object_or_404(Deployment, pk=deployment_id)
-    domain = deployment.domain
-    if domain.owner != request.user:
+    if (response := get_cached_not_modified(request, deployment_id)) is not None:
+        return response
+    # the domain is needed for the owner check and the service token of the deployment
+    deployment = get_object_or_404(Deployment.objects.select_related("domain"), pk=deployment_id)
+    if deployment.domain.owner_id != request.user.pk:
         return HttpResponse(status=403)
-    new_steps = deployment.get_new_steps()
-    html = build_steps_html(new_steps)
-    if deployment.has_finished:
+    seen = get_seen_steps(request)
+    if steps_are_ingested():
+        new_steps: StepRecords = []  # steps are ingested by the background worker or the relay
+    else:
+        new_steps = deployment.get_new_steps()
+    steps = get_steps_to_send(deployment, seen, new_steps)
+    return steps_response(request, deployment, steps, deployment.get_poll_delay())
+
+
+@login_required
+@require_GET
+async def adeploy_state(request: HttpRequest, deployment_id: int) -> HttpResponse:
+    """
+    Async version of deploy_state. Doesn't block a worker while waiting
+    for fastdeploy when served via ASGI.
+    """
+    if (response := await aget_cached_not_modified(request, deployment_id)) is not None:
+        return response
+    deployment = await aget_object_or_404(Deployment.objects.select_related("domain"), pk=deployment_id)
+    user = await request.auser()
+    if deployment.domain.owner_id != user.pk:
+        return HttpResponse(status=403)
+    seen = get_seen_steps(request)
+    if steps_are_ingested():
+        new_steps: StepRecords = []  # steps are ingested by the background worker or the relay
+    else:
+        new_steps = await deployment.aget_new_steps()
+    steps = await aget_steps_to_send(deployment, seen, new_steps)
+    return steps_response(request, deployment, steps, deployment.get_poll_delay())
+
+
+def get_seen_per_deployment(request: HttpRequest) -> dict[int, int]:
+    """
+    Number of processed steps the client has already rendered per deployment,
+    passed as seen-<deployment id> parameters.
+    """
+    seen = {}
+    for name, value in request.GET.items():
+        prefix, _, deployment_id = name.partition("-")
+        if prefix == "seen" and deployment_id.isdigit() and value.isdigit():
+            seen[int(deployment_id)] = int(value)
+    return seen
+
+
+def build_oob_steps_html(deployment: Deployment, steps: StepRecords) -> str:
+    """
+    Out-of-band swap inserting steps in front of the end of the deployments progress.
+    """
+    return f'<div id="progress-end-{deployment.pk}" hx-swap-oob="beforebegin">{build_steps_html(steps)}</div>'
+
+
+def domain_state_response(
+    request: HttpRequest, domain_id: int, deployments: list[Deployment], steps: dict[int, StepRecords]
+) -> HttpResponse:
+    html = "".join(build_oob_steps_html(d, steps[d.pk]) for d in deployments if len(steps[d.pk]) > 0)
+    running = [deployment for deployment in deployments if not deployment.has_finished]
+    if len(running) == 0:
         return HttpResponse(status=HTMX_STOP_POLLING, content=html)
+    if request.htmx:
+        context = {
+            "domain_id": domain_id,
+            "poll_delay": min(deployment.get_poll_delay() for deployment in running),
+            "domain_state_url_name": request.resolver_match.url_name,
+            "oob": True,
+        }
+        html += render_to_string("domain_poller.html", context)
+    return HttpResponse(status=200, content=html)
+
+
+def get_watched_deployments(seen: dict[int, int]) -> Q:
+    # deployments the client is watching might have finished in the meantime
+    return Q(state=Deployment.State.RUNNING) | Q(pk__in=seen.keys())
+
+
+@login_required
+@require_GET
+def domain_state(request: HttpRequest, domain_id: int) -> HttpResponse:
+    """
+    Send the new steps of all running deployments of a domain in one response,
+    instead of every progress section polling for its own deployment. Running
+    deployments are refreshed with one batch of requests to fastdeploy.
+    """
+    owner_id = get_domain_owner_id(domain_id)
+    if owner_id is None:
+        raise Http404
+    if owner_id != request.user.pk:
+        return HttpResponse(status=403)
+    seen = get_seen_per_deployment(request)
+    watched = Deployment.objects.filter(get_watched_deployments(seen), domain_id=domain_id).select_related("domain")
+    deployments = list(watched.order_by("pk"))
+    if not steps_are_ingested():
+        fetch_new_steps(deployments)
+    steps = get_processed_steps_after({d.pk: seen.get(d.pk, 0) for d in deployments})
+    return domain_state_response(request, domain_id, deployments, steps)
+
+
+@login_required
+@require_GET
+async def adomain_state(request: HttpRequest, domain_id: int) -> HttpResponse:
+    owner_id = await aget_domain_owner_id(domain_id)
+    if owner_id is None:
+        raise Http404
+    user = await request.auser()
+    if owner_id != user.pk:
+        return HttpResponse(status=403)
+    seen = get_seen_per_deployment(request)
+    watched = Deployment.objects.filter(get_watched_deployments(seen), domain_id=domain_id).select_related("domain")
+    deployments = [d async for d in watched.order_by("pk")]
+    if not steps_are_ingested():
+        await afetch_new_steps(deployments)
+    positions = {d.pk: seen.get(d.pk, 0) for d in deployments}
+    steps = await sync_to_async(get_processed_steps_after)(positions)
+    return domain_state_response(request, domain_id, deployments, steps)
+
+
+def format_event(event: str, data: str, event_id: int) -> str:
+    """
+    Format a server sent event. Every line of data needs its own data field.
+    """
+    lines = [f"event: {event}", f"id: {event_id}"]
+    lines.extend(f"data: {line}" for line in data.splitlines() or [""])
+    return "\n".join(lines) + "\n\n"
+
+
+KEEPALIVE_EVENT = ": keepalive\n\n"
+
+
+def get_unsent_steps_event(unsent: StepRecords, cursor: int) -> tuple[str | None, int]:
+    """
+    Return an event for the processed steps after cursor (if any) and the new cursor.
+    The cursor is the number of processed steps the client has already seen.
+    """
+    if len(unsent) == 0:
+        return None, cursor
+    cursor += len(unsent)
+    return format_event("step", build_steps_html(unsent), cursor), cursor
+
+
+def stream_steps(deployment: Deployment, cursor: int) -> Iterator[str]:
+    while True:
+        event, cursor = get_unsent_steps_event(deployment.get_processed_steps(cursor), cursor)
+        yield event or KEEPALIVE_EVENT
+        if deployment.has_finished:
+            return
+        time.sleep(settings.DEPLOY_EVENTS_INTERVAL)
+        deployment.refresh_steps()
+
+
+async def astream_steps(deployment: Deployment, cursor: int) -> AsyncIterator[str]:
+    """
+    Wait for steps relayed from the fastdeploy websocket if it's connected,
+    otherwise poll for new steps.
+    """
+    relay = get_relay()
+    queue = relay.subscribe(deployment.pk) if relay is not None else None
+    try:
+        unsent = await deployment.aget_processed_steps(cursor)
+        while True:
+            event, cursor = get_unsent_steps_event(unsent, cursor)
+            yield event or KEEPALIVE_EVENT
+            if deployment.has_finished:
+                return
+            if relay is not None and queue is not None and relay.connected:
+                unsent = await relay.wait_for_steps(deployment, queue, settings.DEPLOY_EVENTS_KEEPALIVE, cursor)
+            else:
+                await asyncio.sleep(settings.DEPLOY_EVENTS_INTERVAL)
+                await deployment.arefresh_steps()
+                unsent = await deployment.aget_processed_steps(cursor)
+    finally:
+        if relay is not None and queue is not None:
+            relay.unsubscribe(deployment.pk, queue)
+
+
+def get_event_cursor(request: HttpRequest) -> int:
+    """
+    Reconnecting EventSources send the id of the last event they've seen, initial
+    connections pass the number of steps already rendered as "seen" parameter.
+    """
+    try:
+        return max(int(request.headers["Last-Event-ID"]), 0)
+    except (KeyError, ValueError):
+        return get_seen_steps(request) or 0
+
+
+def is_asgi_request(request: HttpRequest) -> bool:
+    return hasattr(request, "scope")
+
+
+@login_required
+@require_GET
+def deploy_events(request: HttpRequest, deployment_id: int) -> HttpResponse:
+    """
+    Stream new steps of a deployment as server sent events until it has finished.
+    """
+    deployment = get_object_or_404(Deployment.objects.select_related("domain"), pk=deployment_id)
+    if deployment.domain.owner_id != request.user.pk:
+        return HttpResponse(status=403)
+    cursor = get_event_cursor(request)
+    if deployment.has_finished and cursor >= deployment.steps_count:
+        # 204 tells the EventSource to stop reconnecting
+        return HttpResponse(status=204)
+    if is_asgi_request(request):
+        events: Iterator[str] | AsyncIterator[str] = astream_steps(deployment, cursor)
     else:
-        return HttpResponse(status=200, content=html)
+        events = stream_steps(deployment, cursor)
+    response = StreamingHttpResponse(events, content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+def get_progress_context(request: HttpRequest) -> dict:
+    """
+    Progress pages served via ASGI get new steps pushed as server sent events
+    or poll the async views. Via WSGI a long lived event stream would block a
+    whole worker, therefore the sync views are polled instead.
+    """
+    if not is_asgi_request(request):
+        return {
+            "deploy_state_url_name": "deploy_state",
+            "domain_state_url_name": "domain_state",
+            "deploy_events": False,
+        }
+    return {
+        "deploy_state_url_name": "adeploy_state",
+        "domain_state_url_name": "adomain_state",
+        "deploy_events": settings.DEPLOY_PROGRESS_EVENTS,
+    }
 
 
 @csrf_exempt
@@ -45,6 +450,20 @@ def fade_out(request: HttpRequest) -> HttpResponse:
     return HttpResponse(status=200, content="")
 
 
+@require_GET
+def metrics(request: HttpRequest) -> HttpResponse:
+    """
+    Histograms of this process in the Prometheus text format. Scrapers have to
+    send REGISTRY_METRICS_TOKEN as bearer token.
+    """
+    token = settings.REGISTRY_METRICS_TOKEN
+    if not token:
+        raise Http404
+    if not constant_time_compare(request.headers.get("Authorization", ""), f"Bearer {token}"):
+        return HttpResponse(status=403)
+    return HttpResponse(expose(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
 def render_partial_or_full(request, template_name: str, context: dict):
     if request.htmx:
         base_template = "_partial.html"
@@ -70,9 +489,7 @@ def domains(request: HttpRequest) -> HttpResponse:
 
     assert not request.user.is_anonymous  # type guard for mypy
     registered_domains = Domain.objects.filter(owner=request.user).order_by("pk")
-    get_params = dict(request.GET)
-    page_num = get_params.get("page", "1")
-    page = Paginator(object_list=registered_domains, per_page=2).get_page(page_num)
+    page = paginate(request, registered_domains, settings.REGISTRY_PAGE_SIZE)
     context = {"form": form, "page": page}
     return render_partial_or_full(request, "domains.html", context)
 
@@ -80,7 +497,7 @@ def domains(request: HttpRequest) -> HttpResponse:
 @login_required
 def domain_deployments(request: HttpRequest, domain_id: int) -> HttpResponse:
     domain = get_object_or_404(Domain, pk=domain_id)
-    if domain.owner != request.user:
+    if domain.owner_id != request.user.pk:
         return HttpResponse(status=403)
     if request.method == "POST":
         form = DeploymentForm(request.POST, initial={"domain": domain})
@@ -98,14 +515,19 @@ def domain_deployments(request: HttpRequest, domain_id: int) -> HttpResponse:
         form = DeploymentForm(initial={"target": Deployment.Target.DEPLOY.value, "domain": domain})
 
     deployments = Deployment.objects.filter(domain=domain).order_by("pk")
-    in_progress = [d for d in deployments if d.in_progress]
-    get_params = dict(request.GET)
-    page_num = get_params.get("page", "1")
-    page = Paginator(object_list=deployments, per_page=2).get_page(page_num)
+    in_progress = list(deployments.in_progress())
+    for deployment in in_progress:
+        deployment.steps_html = get_steps_fragment(deployment)
+    page = paginate(request, deployments, settings.REGISTRY_PAGE_SIZE)
     context = {
         "form": form,
         "domain": domain,
         "deployments_in_progress": in_progress,
         "page": page,
-    }
+    } | get_progress_context(request)
+    # one poller for all running deployments instead of one per deployment
+    context["domain_poller"] = not context["deploy_events"]
+    context["domain_poll_delay"] = min(
+        (d.get_poll_delay() for d in in_progress), default=settings.DEPLOY_POLL_INTERVAL
+    )
     return render_partial_or_full(request, "domain_deployments.html", context)
@@ -0,0 +1,46 @@
+import asyncio
+import logging
+
+from django.conf import settings
+
+from .fastdeploy import AbstractClient, Client
+from .models import Deployment, afetch_new_steps
+
+logger = logging.getLogger(__name__)
+
+
+async def ingest_steps(client: AbstractClient, concurrency: int) -> int:
+    """
+    Fetch the state of all deployments in progress from fastdeploy in one batch,
+    at most concurrency at a time, and store their new steps. Returns the number
+    of new steps.
+    """
+    deployments = [d async for d in Deployment.objects.in_progress().select_related("domain")]
+    results = await afetch_new_steps(deployments, client=client, concurrency=concurrency)
+    return sum(len(new_steps) for new_steps in results)
+
+
+async def run_worker(
+    client: AbstractClient | None = None,
+    interval: float | None = None,
+    concurrency: int | None = None,
+) -> None:
+    """
+    Ingest new steps every interval seconds until cancelled. Errors are
+    logged and don't stop the worker.
+    """
+    client = Client() if client is None else client
+    interval = settings.DEPLOY_WORKER_INTERVAL if interval is None else interval
+    concurrency = settings.DEPLOY_WORKER_CONCURRENCY if concurrency is None else concurrency
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        try:
+            new_steps = await ingest_steps(client, concurrency)
+        except Exception:
+            # e.g. the database is briefly unavailable, try again next interval
+            logger.exception("could not ingest new steps")
+        else:
+            if new_steps > 0:
+                logger.info(f"ingested {new_steps} new steps")
+        await asyncio.sleep(max(interval - (loop.time() - started), 0))
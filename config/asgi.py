@@ -13,4 +13,9 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings.production")
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# needs configured settings, therefore imported after get_asgi_application
+from apps.registry.asgi import LifespanMiddleware  # noqa: E402
+
+application = LifespanMiddleware(django_application)
@@ -0,0 +1,15 @@
+"""
+Gunicorn configuration for cast_registry.
+
+Used via `gunicorn -c config/gunicorn.py config.wsgi`.
+
+For more information on this file, see
+https://docs.gunicorn.org/en/stable/settings.html#server-hooks
+"""
+
+
+def worker_exit(server, worker):
+    """Close pooled connections to fastdeploy when a worker exits."""
+    from apps.registry.fastdeploy import close_http_clients
+
+    close_http_clients()
@@ -63,6 +63,7 @@ INSTALLED_APPS = [
 LOGIN_REDIRECT_URL = "/"
 
 MIDDLEWARE = [
+    "apps.registry.middleware.MetricsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "whitenoise.middleware.WhiteNoiseMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
@@ -79,7 +80,7 @@ ROOT_URLCONF = "config.urls"
 
 TEMPLATES = [
     {
-        "BACKEND": "django.template.backends.django.DjangoTemplates",
+        "BACKEND": "apps.registry.metrics.TimedDjangoTemplates",
         "DIRS": [BASE_DIR / "templates"],
         "APP_DIRS": True,
         "OPTIONS": {
@@ -106,6 +107,14 @@ DATABASES = {
     "default": env.db("DATABASE_URL", default="postgres:///cast_registry"),
 }
 
+# Cache
+# https://docs.djangoproject.com/en/4.0/ref/settings/#caches
+# for example redis://localhost:6379/0, the local memory cache is per process
+
+CACHES = {
+    "default": env.cache("CACHE_URL", default="locmemcache://"),
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/4.0/ref/settings/#auth-password-validators
 
@@ -177,6 +186,42 @@ INTERNAL_IPS = [
 # 4. Project Settings
 
 DEPLOY_BASE_URL = env("DEPLOY_BASE_URL", default="/deploy/")
+# pooled http connections to fastdeploy
+DEPLOY_HTTP_MAX_CONNECTIONS = env.int("DEPLOY_HTTP_MAX_CONNECTIONS", default=100)
+DEPLOY_HTTP_MAX_KEEPALIVE_CONNECTIONS = env.int("DEPLOY_HTTP_MAX_KEEPALIVE_CONNECTIONS", default=20)
+DEPLOY_HTTP_KEEPALIVE_EXPIRY = env.float("DEPLOY_HTTP_KEEPALIVE_EXPIRY", default=30.0)
+DEPLOY_HTTP_TIMEOUT = env.float("DEPLOY_HTTP_TIMEOUT", default=10.0)
+DEPLOY_HTTP_CONNECT_TIMEOUT = env.float("DEPLOY_HTTP_CONNECT_TIMEOUT", default=5.0)
+DEPLOY_HTTP2 = env.bool("DEPLOY_HTTP2", default=True)
+# polls of the same deployment within this window share one fetch from fastdeploy
+DEPLOY_FETCH_COALESCE_SECONDS = env.float("DEPLOY_FETCH_COALESCE_SECONDS", default=1.0)
+# fetch at most this many deployments at a time when refreshing several of them
+DEPLOY_FETCH_CONCURRENCY = env.int("DEPLOY_FETCH_CONCURRENCY", default=10)
+# path of a fastdeploy endpoint returning several deployments at once (?ids=1,2), if available
+DEPLOY_BULK_FETCH_PATH = env("DEPLOY_BULK_FETCH_PATH", default=None)
+# progress pages poll this often, backing off up to the max interval while nothing happens
+DEPLOY_POLL_INTERVAL = env.int("DEPLOY_POLL_INTERVAL", default=1)
+DEPLOY_POLL_MAX_INTERVAL = env.int("DEPLOY_POLL_MAX_INTERVAL", default=30)
+# push new steps to progress pages via server sent events (ASGI only)
+DEPLOY_PROGRESS_EVENTS = env.bool("DEPLOY_PROGRESS_EVENTS", default=True)
+DEPLOY_EVENTS_INTERVAL = env.float("DEPLOY_EVENTS_INTERVAL", default=1.0)
+DEPLOY_EVENTS_KEEPALIVE = env.float("DEPLOY_EVENTS_KEEPALIVE", default=15.0)
+# relay deployment events from the fastdeploy websocket instead of polling (disabled if no url)
+DEPLOY_WEBSOCKET_URL = env("DEPLOY_WEBSOCKET_URL", default=None)
+DEPLOY_WEBSOCKET_TOKEN = env("DEPLOY_WEBSOCKET_TOKEN", default=None)
+# new steps are fetched by the ingest_steps worker, views only read them from the database
+DEPLOY_STEPS_WORKER = env.bool("DEPLOY_STEPS_WORKER", default=False)
+DEPLOY_WORKER_INTERVAL = env.float("DEPLOY_WORKER_INTERVAL", default=1.0)
+DEPLOY_WORKER_CONCURRENCY = env.int("DEPLOY_WORKER_CONCURRENCY", default=10)
+# seconds domain owners are cached by the registry
+REGISTRY_CACHE_TIMEOUT = env.int("REGISTRY_CACHE_TIMEOUT", default=300)
+# domains and deployments per page, pages are addressed by cursors instead of numbers
+REGISTRY_PAGE_SIZE = env.int("REGISTRY_PAGE_SIZE", default=2)
+# send database, fastdeploy and render time of each request as Server-Timing header,
+# off by default, because it exposes internal timings to every client
+REGISTRY_SERVER_TIMING = env.bool("REGISTRY_SERVER_TIMING", default=False)
+# bearer token for scraping /metrics/, the endpoint is disabled without it
+REGISTRY_METRICS_TOKEN = env("REGISTRY_METRICS_TOKEN", default=None)
 DEPLOY_CAST_SERVICE_TOKEN = env("DEPLOY_CAST_SERVICE_TOKEN", default=None)
 REMOVE_CAST_SERVICE_TOKEN = env("REMOVE_CAST_SERVICE_TOKEN", default=None)
 DEPLOY_WORDPRESS_SERVICE_TOKEN = env("DEPLOY_WORDPRESS_SERVICE_TOKEN", default=None)
@@ -15,6 +15,8 @@ AUTH_PASSWORD_VALIDATORS = []
 
 DEBUG = True
 
+REGISTRY_SERVER_TIMING = True
+
 EMAIL_BACKEND = "django.core.mail.backends.console.EmailBackend"
 
 # activate test client for UI tests
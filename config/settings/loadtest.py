@@ -0,0 +1,22 @@
+"""
+Django settings for cast_registry project in load test mode
+
+Like production, but without secrets and talking to the fastdeploy stand-in
+of `manage.py loadtest`. See `base.py` for basic settings.
+
+For the full list of settings and their values, see
+https://docs.djangoproject.com/en/4.0/ref/settings/
+"""
+
+from .base import *  # noqa
+from .base import env
+
+DEBUG = False
+
+ALLOWED_HOSTS = ["127.0.0.1", "localhost"]
+
+# the loadtest command starts the stand-in on this port, fastdeploy itself
+# usually runs on 8001 during development
+DEPLOY_BASE_URL = env("DEPLOY_BASE_URL", default="http://127.0.0.1:8901/")
+DEPLOY_CLIENT = "production"
+REGISTRY_SERVER_TIMING = True
@@ -25,6 +25,8 @@ ALLOWED_HOSTS = [ALLOWED_HOST]
 # static files
 STATICFILES_STORAGE = "whitenoise.storage.CompressedManifestStaticFilesStorage"
 
+# templates are compiled once per process by Django's default cached loaders, because DEBUG is off
+
 # Custom Admin URL, use {% url 'admin:index' %}
 ADMIN_URL = env("DJANGO_ADMIN_URL")
 